@@ -0,0 +1,61 @@
+import logging
+import threading
+from typing import Callable, Sequence
+
+from langchain_core.tools import BaseTool
+from langgraph.graph.state import CompiledStateGraph
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------------------
+# Compiled sub-agent registry
+#
+#    Building a ReAct agent compiles a graph, generates tool schemas and (for the
+#    local model) constructs a new client. The registry does that once per process
+#    for every (name, model, toolset) combination and hands back the cached graph
+#    on every later turn. Per-turn values are passed in the run config instead.
+# ------------------------------------------------------------------------------
+class AgentRegistry:
+    def __init__(self):
+        self._agents: dict[tuple, CompiledStateGraph] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(name: str, model_key: str, tools: Sequence[BaseTool]) -> tuple:
+        return (name, model_key, tuple(sorted(tool.name for tool in tools)))
+
+    def get(
+        self,
+        name: str,
+        model_key: str,
+        tools: Sequence[BaseTool],
+        build: Callable[[], CompiledStateGraph],
+    ) -> CompiledStateGraph:
+        """Return the compiled agent for this key, building it on first use only."""
+        key = self.make_key(name, model_key, tools)
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self.hits += 1
+                return agent
+            self.misses += 1
+            agent = build()
+            self._agents[key] = agent
+            logger.info("Agent built: %s", key)
+            return agent
+
+    def clear(self):
+        with self._lock:
+            self._agents.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "agents": len(self._agents)}
+
+
+agent_registry = AgentRegistry()
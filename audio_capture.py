@@ -0,0 +1,218 @@
+import functools
+import io
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import soundfile as sf
+from openai import OpenAI
+
+SAMPLE_RATE = 16000  # what speech recognition works at; anything higher is discarded server-side
+FRAME_MS = 30
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+MAX_RECORD_SECONDS = float(os.getenv("MAX_RECORD_SECONDS", "60"))
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", "12"))
+VAD_SILENCE_SECONDS = float(os.getenv("VAD_SILENCE_SECONDS", "1.0"))
+VAD_NO_SPEECH_SECONDS = float(os.getenv("VAD_NO_SPEECH_SECONDS", "8"))
+VAD_MIN_SPEECH_FRAMES = 3
+# Audio kept before the first and after the last voiced frame, so word edges aren't clipped.
+PADDING_SECONDS = 0.3
+TRANSCRIPTION_MODEL = "whisper-1"
+
+
+@functools.lru_cache(maxsize=1)
+def openai_client() -> OpenAI:
+    """One client (and HTTP connection pool) per process instead of one per request."""
+    return OpenAI()
+
+
+# ------------------------------------------------------------------------------
+# Audio capture
+#
+#    The microphone is read at 16 kHz int16 mono in 30 ms frames straight into a
+#    preallocated ring buffer, so a recording never allocates or queues per block.
+#    Each frame goes through an energy-based voice activity detector; recording
+#    stops by itself after VAD_SILENCE_SECONDS of silence following speech (or if
+#    nobody speaks within VAD_NO_SPEECH_SECONDS). Only the voiced part, plus a little
+#    padding, is encoded to FLAC in memory and uploaded from that buffer.
+# ------------------------------------------------------------------------------
+class RingBuffer:
+    """Fixed-size int16 buffer holding the most recent `capacity` samples."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.int16)
+        self.written = 0  # samples written since the start, including overwritten ones
+
+    def write(self, samples: np.ndarray):
+        samples = samples[-self.capacity:]
+        start = self.written % self.capacity
+        first = min(len(samples), self.capacity - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[:len(samples) - first] = samples[first:]
+        self.written += len(samples)
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """Copy of samples [start, end), by position since the start; clipped to what is still held."""
+        start = max(start, self.written - self.capacity, 0)
+        end = min(end, self.written)
+        if end <= start:
+            return np.zeros(0, dtype=np.int16)
+        first, last = start % self.capacity, (end - 1) % self.capacity + 1
+        if first < last:
+            return self._data[first:last].copy()
+        return np.concatenate((self._data[first:], self._data[:last]))
+
+
+class EnergyVAD:
+    """Voice activity from frame energy relative to an adaptive noise floor."""
+
+    def __init__(self, threshold_db: float = VAD_THRESHOLD_DB, min_level_db: float = -55.0):
+        self.threshold_db = threshold_db
+        self.min_level_db = min_level_db
+        self.noise_db: float | None = None
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        rms = np.sqrt(np.mean(np.square(frame, dtype=np.float32))) / 32768.0
+        level_db = 20 * np.log10(max(rms, 1e-6))
+        if self.noise_db is None:
+            self.noise_db = level_db
+        speech = level_db > max(self.noise_db + self.threshold_db, self.min_level_db)
+        if not speech:
+            # Follow the background level while nobody is talking; drop to quieter levels at once.
+            self.noise_db = min(level_db, 0.95 * self.noise_db + 0.05 * level_db)
+        return speech
+
+
+@dataclass
+class Recording:
+    audio: bytes
+    format: str
+    duration_seconds: float
+    speech_ended_at: float  # time.monotonic() of the last voiced frame
+    stopped_at: float
+    timings: dict = field(default_factory=dict)
+
+
+@dataclass
+class Transcript:
+    text: str
+    latency: dict
+
+
+def encode_flac(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="FLAC", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+class AudioRecorder:
+    def __init__(
+        self,
+        max_seconds: float = MAX_RECORD_SECONDS,
+        silence_seconds: float = VAD_SILENCE_SECONDS,
+        no_speech_seconds: float = VAD_NO_SPEECH_SECONDS,
+        vad: EnergyVAD | None = None,
+    ):
+        self.buffer = RingBuffer(int(max_seconds * SAMPLE_RATE))
+        self.vad = vad or EnergyVAD()
+        self.silence_samples = int(silence_seconds * SAMPLE_RATE)
+        self.no_speech_samples = int(no_speech_seconds * SAMPLE_RATE)
+        self.padding_samples = int(PADDING_SECONDS * SAMPLE_RATE)
+        self.recording = False
+        self.finished = threading.Event()
+        self.speech_start: int | None = None
+        self.speech_end = 0
+        self.speech_ended_at: float | None = None
+        self._voiced_run = 0
+        self.stream = None
+
+    def callback(self, indata, frames, time_info, status):
+        if self.recording and not self.finished.is_set():
+            self.process(indata[:, 0])
+
+    def process(self, frame: np.ndarray):
+        """Buffer one frame and update the voice activity state; sets `finished` when done."""
+        self.buffer.write(frame)
+        position = self.buffer.written
+        if self.vad.is_speech(frame):
+            self._voiced_run += 1
+            if self.speech_start is None and self._voiced_run >= VAD_MIN_SPEECH_FRAMES:
+                self.speech_start = position - self._voiced_run * len(frame)
+            self.speech_end = position
+            self.speech_ended_at = time.monotonic()
+        else:
+            self._voiced_run = 0
+        if self.speech_start is None:
+            if position >= self.no_speech_samples:
+                self.finished.set()
+        elif position - self.speech_end >= self.silence_samples:
+            self.finished.set()
+        elif position - self.speech_start >= self.buffer.capacity:
+            # The buffer is full of speech; stop before overwriting any of it.
+            self.finished.set()
+
+    def start_recording(self):
+        import sounddevice as sd
+
+        self.recording = True
+        self.stream = sd.InputStream(
+            samplerate=SAMPLE_RATE,
+            channels=1,
+            dtype="int16",
+            blocksize=FRAME_SAMPLES,
+            callback=self.callback,
+        )
+        self.stream.start()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until voice activity detection ends the recording; False on timeout."""
+        return self.finished.wait(timeout)
+
+    def elapsed(self) -> float:
+        return self.buffer.written / SAMPLE_RATE
+
+    def stop_recording(self) -> Recording | None:
+        """Stop the microphone and return the voiced part as FLAC, or None if nobody spoke."""
+        self.recording = False
+        stopped_at = time.monotonic()
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+        if self.speech_start is None:
+            return None
+        started = time.perf_counter()
+        samples = self.buffer.read(
+            self.speech_start - self.padding_samples, self.speech_end + self.padding_samples
+        )
+        audio = encode_flac(samples)
+        return Recording(
+            audio=audio,
+            format="flac",
+            duration_seconds=len(samples) / SAMPLE_RATE,
+            speech_ended_at=self.speech_ended_at,
+            stopped_at=stopped_at,
+            timings={"encode_seconds": time.perf_counter() - started, "bytes": len(audio)},
+        )
+
+
+def transcribe_audio(recording: Recording) -> Transcript:
+    """Upload the recording from memory and return the text with capture-to-transcript latency."""
+    started = time.monotonic()
+    transcription = openai_client().audio.transcriptions.create(
+        model=TRANSCRIPTION_MODEL,
+        file=(f"speech.{recording.format}", recording.audio),
+    )
+    done = time.monotonic()
+    latency = {
+        **recording.timings,
+        "audio_seconds": round(recording.duration_seconds, 2),
+        # From the end of speech until the recorder stopped (the VAD silence window, or the click).
+        "stop_seconds": round(recording.stopped_at - recording.speech_ended_at, 3),
+        "transcribe_seconds": round(done - started, 3),
+        "capture_to_transcript_seconds": round(done - recording.speech_ended_at, 3),
+    }
+    latency["encode_seconds"] = round(latency["encode_seconds"], 4)
+    return Transcript(text=transcription.text, latency=latency)
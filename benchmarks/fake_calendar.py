@@ -0,0 +1,230 @@
+import email
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from slot_scheduler import DEFAULT_TIMEZONE
+
+SERVICE_PATH = "/calendar/v3/"
+_EVENTS = re.compile(r"^/calendar/v3/calendars/([^/]+)/events(?:/([^/]+))?$")
+
+
+def _timestamp(value: dict | str) -> float:
+    if isinstance(value, dict):
+        value = value.get("dateTime") or value["date"]
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+
+
+@dataclass
+class FaultPlan:
+    """Which requests fail: a fixed script first, then `rate` of the rest with a random status."""
+
+    rate: float = 0.0
+    statuses: tuple[int, ...] = (429, 503)
+    retry_after: float | None = None
+    script: list[int] = field(default_factory=list)
+    seed: int = 0
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+
+    def next_status(self) -> int | None:
+        if self.script:
+            return self.script.pop(0)
+        if self.rate and self._random.random() < self.rate:
+            return self._random.choice(self.statuses)
+        return None
+
+
+def error_body(status: int) -> dict:
+    reason = {429: "rateLimitExceeded", 403: "rateLimitExceeded", 404: "notFound", 409: "duplicate"}.get(status, "backendError")
+    message = {429: "Rate Limit Exceeded", 404: "Not Found", 409: "The requested identifier already exists."}.get(status, "Backend Error")
+    return {"error": {"code": status, "message": message, "errors": [
+        {"domain": "usageLimits" if status in (403, 429) else "global", "reason": reason, "message": message}
+    ]}}
+
+
+# ------------------------------------------------------------------------------
+# Fake Google Calendar server
+#
+#    A local HTTP server with the handful of Calendar v3 endpoints the tools use
+#    (events list/insert/get/update/delete and freeBusy), backed by a dict. Point
+#    the service pool at it with CALENDAR_API_ENDPOINT=<server.endpoint>. Faults
+#    from the FaultPlan are injected before a request is handled, so a failed
+#    request never changes state. Batch requests are split into their parts, and
+#    each part is handled (and may fail) on its own, as Google does. An insert with
+#    an id that is already taken gets 409, as on Google. `latency`
+#    delays every request (concurrent requests overlap, as they would on Google).
+# ------------------------------------------------------------------------------
+class FakeCalendarServer:
+    def __init__(self, faults: FaultPlan | None = None, time_zone: str = DEFAULT_TIMEZONE, latency: float = 0.0):
+        self.faults = faults or FaultPlan()
+        self.time_zone = time_zone
+        self.latency = latency
+        self.events: dict[str, dict] = {}
+        self._cancelled: dict[str, dict] = {}
+        self.requests = 0
+        self.faults_injected = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}{SERVICE_PATH}"
+
+    def start(self) -> "FakeCalendarServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeCalendarServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self, events: list[dict] = ()):
+        """Replace the calendar's contents (events need an "id") and zero the counters."""
+        with self._lock:
+            self.events = {event["id"]: dict(event, status="confirmed") for event in events}
+            self._cancelled = {}
+            self.requests = 0
+            self.faults_injected = 0
+
+    # -- request handling ------------------------------------------------------------
+    def handle(self, method: str, path: str, query: dict, body: dict | None) -> tuple[int, dict | None, dict]:
+        """(status, response body, extra headers) for one request."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            status = self.faults.next_status()
+            if status is not None:
+                self.faults_injected += 1
+                headers = {"Retry-After": str(self.faults.retry_after)} if self.faults.retry_after is not None else {}
+                return status, error_body(status), headers
+            if method == "POST" and path == "/calendar/v3/freeBusy":
+                return 200, self._free_busy(body), {}
+            match = _EVENTS.match(path)
+            if match is None:
+                return 404, error_body(404), {}
+            event_id = match.group(2)
+            if event_id is None:
+                if method == "GET":
+                    return 200, self._list(query), {}
+                if method == "POST":
+                    if body.get("id") in self.events:
+                        return 409, error_body(409), {}
+                    return 200, self._store(body.get("id") or f"evt{next(self._ids)}", body), {}
+            elif event_id in self.events:
+                if method == "GET":
+                    return 200, self.events[event_id], {}
+                if method == "PUT":
+                    return 200, self._store(event_id, body), {}
+                if method == "DELETE":
+                    del self.events[event_id]
+                    self._cancelled[event_id] = {"id": event_id, "status": "cancelled"}
+                    return 204, None, {}
+            return 404, error_body(404), {}
+
+    def handle_batch(self, content_type: str, raw: bytes) -> tuple[int, bytes, dict]:
+        """Answer a multipart/mixed batch request part by part."""
+        message = email.message_from_bytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + raw)
+        boundary = "batch_response"
+        parts = []
+        for part in message.get_payload():
+            request_line, rest = part.get_payload().split("\n", 1)
+            method, target, _ = request_line.split(" ", 2)
+            inner = email.message_from_string(rest)
+            url = urlparse(target)
+            body = inner.get_payload()
+            status, payload, _ = self.handle(method, url.path, parse_qs(url.query), json.loads(body) if body.strip() else None)
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:]}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\nContent-Type: application/json\r\n\r\n"
+                f"{json.dumps(payload) if payload is not None else ''}\r\n"
+            )
+        data = ("".join(parts) + f"--{boundary}--\r\n").encode()
+        return 200, data, {"Content-Type": f"multipart/mixed; boundary={boundary}"}
+
+    def _store(self, event_id: str, body: dict) -> dict:
+        event = {**body, "id": event_id, "status": "confirmed", "htmlLink": f"https://calendar.test/event?eid={event_id}"}
+        self.events[event_id] = event
+        return event
+
+    def _list(self, query: dict) -> dict:
+        events = sorted(self.events.values(), key=lambda event: _timestamp(event["start"]))
+        if "syncToken" not in query:
+            time_min = _timestamp(query["timeMin"][0]) if "timeMin" in query else float("-inf")
+            time_max = _timestamp(query["timeMax"][0]) if "timeMax" in query else float("inf")
+            events = [e for e in events if _timestamp(e["end"]) > time_min and _timestamp(e["start"]) < time_max]
+        else:
+            # Incremental sync: everything, including deletions (no per-token change log).
+            events = events + list(self._cancelled.values())
+        start = int(query.get("pageToken", ["0"])[0])
+        size = int(query.get("maxResults", ["250"])[0])
+        response = {"timeZone": self.time_zone, "items": events[start:start + size]}
+        if start + size < len(events):
+            response["nextPageToken"] = str(start + size)
+        else:
+            response["nextSyncToken"] = f"sync-{self.requests}"
+        return response
+
+    def _free_busy(self, body: dict) -> dict:
+        time_min, time_max = _timestamp(body["timeMin"]), _timestamp(body["timeMax"])
+        busy = [
+            {"start": event["start"].get("dateTime") or event["start"]["date"],
+             "end": event["end"].get("dateTime") or event["end"]["date"]}
+            for event in sorted(self.events.values(), key=lambda event: _timestamp(event["start"]))
+            if _timestamp(event["end"]) > time_min and _timestamp(event["start"]) < time_max
+        ]
+        return {"calendars": {item["id"]: {"busy": busy} for item in body.get("items", [])}}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; with Nagle on, the body waits for
+            # the client's delayed ACK and every request gains ~40 ms that Google wouldn't add.
+            disable_nagle_algorithm = True
+
+            def _respond(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if url.path.startswith("/batch/"):
+                    status, data, headers = server.handle_batch(self.headers["Content-Type"], raw)
+                else:
+                    body = json.loads(raw) if raw else None
+                    status, payload, headers = server.handle(self.command, url.path, parse_qs(url.query), body)
+                    data = json.dumps(payload).encode() if payload is not None else b""
+                    headers = {"Content-Type": "application/json", **headers}
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
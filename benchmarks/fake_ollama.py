@@ -0,0 +1,146 @@
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+_DURATION = re.compile(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)")
+
+
+def keep_alive_seconds(value, default: float) -> float:
+    """Ollama's keep_alive (seconds, negative for ever, or a duration like "30m") in seconds."""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    total = sum(float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit] for amount, unit in _DURATION.findall(value))
+    return float("inf") if total < 0 else total
+
+
+# ------------------------------------------------------------------------------
+# Fake Ollama server
+#
+#    Serves /api/chat and /api/generate the way a local Ollama does, minus the
+#    model: the first request after the model was unloaded waits `load_seconds`
+#    and reports it as load_duration, the model stays loaded for the request's
+#    keep_alive, and requests are handled one at a time (OLLAMA_NUM_PARALLEL=1).
+#    Replies come from `reply`, a string or a callable given the chat messages.
+#    Point the manager at it with OllamaModelManager(base_url=server.url).
+# ------------------------------------------------------------------------------
+class FakeOllamaServer:
+    def __init__(self, reply: str | Callable[[list[dict]], str] = "{}", load_seconds: float = 0.5,
+                 generate_seconds: float = 0.05, default_keep_alive: float = 300):
+        self.reply = reply
+        self.load_seconds = load_seconds
+        self.generate_seconds = generate_seconds
+        self.default_keep_alive = default_keep_alive
+        self.loaded_until = 0.0
+        self.loads = 0
+        self.requests = 0
+        self.keep_alives: list = []
+        self.formats: list = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._model_lock = threading.Lock()  # one request at a time, like Ollama by default
+        self._counter_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def unload(self):
+        self.loaded_until = 0.0
+
+    def _run(self, body: dict, generate: bool) -> tuple[str, int]:
+        """(reply text, load nanoseconds) for one request, holding the model while it runs."""
+        with self._counter_lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.keep_alives.append(body.get("keep_alive"))
+            self.formats.append(body.get("format"))
+        try:
+            with self._model_lock:
+                load_ns = 0
+                if time.monotonic() >= self.loaded_until:
+                    time.sleep(self.load_seconds)
+                    self.loads += 1
+                    load_ns = int(self.load_seconds * 1e9)
+                text = ""
+                if not generate or body.get("prompt"):
+                    time.sleep(self.generate_seconds)
+                    text = self.reply(body.get("messages", [])) if callable(self.reply) else self.reply
+                self.loaded_until = time.monotonic() + keep_alive_seconds(body.get("keep_alive"), self.default_keep_alive)
+                return text, load_ns
+        finally:
+            with self._counter_lock:
+                self.in_flight -= 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                generate = self.path == "/api/generate"
+                if self.path not in ("/api/chat", "/api/generate"):
+                    return self._send(404, [{"error": "not found"}])
+                text, load_ns = server._run(body, generate)
+                done = {
+                    "model": body.get("model"),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "done": True,
+                    "done_reason": "stop" if text or not generate else "load",
+                    "total_duration": load_ns + int(server.generate_seconds * 1e9),
+                    "load_duration": load_ns,
+                    "prompt_eval_count": 10,
+                    "eval_count": max(1, len(text) // 4),
+                }
+                key = "response" if generate else "message"
+                empty = "" if generate else {"role": "assistant", "content": ""}
+                full = text if generate else {"role": "assistant", "content": text}
+                if body.get("stream", True):
+                    step = 16
+                    chunks = [
+                        {"model": body.get("model"), "done": False,
+                         key: text[i:i + step] if generate else {"role": "assistant", "content": text[i:i + step]}}
+                        for i in range(0, len(text), step)
+                    ]
+                    self._send(200, chunks + [{**done, key: empty}], content_type="application/x-ndjson")
+                else:
+                    self._send(200, [{**done, key: full}])
+
+            def _send(self, status: int, objects: list[dict], content_type: str = "application/json"):
+                data = "".join(json.dumps(item) + "\n" for item in objects).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
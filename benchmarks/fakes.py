@@ -0,0 +1,95 @@
+import time
+from typing import Any, Callable, Iterator
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from context_window import estimate_tokens
+
+
+# ------------------------------------------------------------------------------
+# Scriptable fake chat model
+#
+#    Stands in for ChatOpenAI / ChatOllama so the real graph can run offline.
+#    `responses` is cycled through; each entry is a string, an AIMessage (e.g. with
+#    tool_calls) or a callable that receives the prompt messages and returns either.
+#    With prompt_cache=True it also acts like a provider's prompt cache: the
+#    longest run of leading messages shared with an earlier prompt is reported as
+#    cached input tokens in the reply's usage_metadata.
+# ------------------------------------------------------------------------------
+class FakeChatModel(BaseChatModel):
+    responses: list[Any]
+    model_name: str = "fake-chat-model"
+    calls: int = 0
+    prompt_tokens: list[int] = []
+    prompt_cache: bool = False
+    cached_tokens: list[int] = []
+    seen_prompts: list[tuple] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(self, tools, **kwargs) -> "FakeChatModel":
+        return self
+
+    def _next_message(self, messages: list[BaseMessage]) -> AIMessage:
+        response = self.responses[self.calls % len(self.responses)]
+        self.calls += 1
+        self.prompt_tokens.append(estimate_tokens(messages))
+        if callable(response):
+            response = response(messages)
+        if isinstance(response, str):
+            response = AIMessage(content=response)
+        if self.prompt_cache:
+            cached = self._cached_prefix(messages)
+            self.cached_tokens.append(cached)
+            response = response.model_copy(update={"usage_metadata": {
+                "input_tokens": self.prompt_tokens[-1],
+                "output_tokens": 0,
+                "total_tokens": self.prompt_tokens[-1],
+                "input_token_details": {"cache_read": cached},
+            }})
+        return response
+
+    def _cached_prefix(self, messages: list[BaseMessage]) -> int:
+        keys = tuple((message.type, message.name, str(message.content)) for message in messages)
+        shared = 0
+        for seen in self.seen_prompts:
+            length = 0
+            while length < min(len(seen), len(keys)) and seen[length] == keys[length]:
+                length += 1
+            shared = max(shared, length)
+        self.seen_prompts.append(keys)
+        return estimate_tokens(messages[:shared]) if shared else 0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        message = self._next_message(messages)
+        text = message.content
+        for start in range(0, max(len(text), 1), 8):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text[start:start + 8]))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_calls=message.tool_calls))
+        if message.usage_metadata:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=message.usage_metadata))
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_tokens = []
+        self.cached_tokens = []
+        self.seen_prompts = []
+
+
+def slow(script: Callable, seconds: float) -> Callable:
+    """A response script that takes `seconds`, like a model call would."""
+    def run(messages):
+        time.sleep(seconds)
+        return script(messages)
+    return run
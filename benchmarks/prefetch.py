@@ -0,0 +1,99 @@
+"""Prefetch and parallel tool benchmark: day reads overlap the model call, independent tool calls overlap each other.
+
+Runs the real workflow against benchmarks/fake_calendar.py with a simulated
+Calendar round trip (--calendar-ms) and model call (--model-ms). Fails unless
+moving an event is faster with the day prefetched while the first model call
+runs, and three get_events calls from one model message take about one round
+trip, not three. Which turns use or waste a prefetch is checked in
+tests/test_prefetch.py.
+
+    python -m benchmarks.prefetch --calendar-ms 100 --model-ms 200
+"""
+import argparse
+import sys
+import time
+import uuid
+
+from google.oauth2.credentials import Credentials
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+import calendar_service
+import chatbot_with_todo
+import prefetch
+from agent_registry import agent_registry
+from benchmarks.fake_calendar import FakeCalendarServer
+from benchmarks.fakes import FakeChatModel, slow
+from benchmarks.turn_latency import DAY, at, day_range, envelope, seeded_event, update_by_name
+from datetime import timedelta
+from event_store import reset_event_stores
+from response_cache import response_cache
+from telemetry import metrics
+
+DENTIST = [seeded_event("dentist", "Dentist", at(10), at(11))]
+
+
+def three_days(messages):
+    if isinstance(messages[-1], ToolMessage):
+        return envelope("Here are your next three days.")
+    return AIMessage(content="", tool_calls=[
+        {"name": "get_events", "id": f"call_{offset}", "args": day_range(DAY + timedelta(days=offset))}
+        for offset in range(3)
+    ])
+
+
+def run_turn(server: FakeCalendarServer, script, text: str, events: list[dict], enabled: bool) -> dict:
+    prefetch.PREFETCH_ENABLED = enabled
+    chatbot_with_todo.llm = FakeChatModel(responses=[script])
+    agent_registry.clear()
+    response_cache.clear()
+    reset_event_stores()
+    server.reset(events)
+    graph = chatbot_with_todo.get_workflow()
+    before = {outcome: metrics.value("prefetch_total", {"outcome": outcome}) for outcome in ("hit", "wasted")}
+    started = time.perf_counter()
+    chatbot_with_todo.run_chatbot(graph, {"messages": [HumanMessage(text)]}, Credentials(token="bench-prefetch"),
+                                  thread_id=uuid.uuid4().hex)
+    elapsed = time.perf_counter() - started
+    counts = {outcome: metrics.value("prefetch_total", {"outcome": outcome}) - before[outcome] for outcome in before}
+    return {"ms": elapsed * 1000, "requests": server.requests, **counts}
+
+
+def compare(server, name: str, script, text: str, events: list[dict], model_seconds: float, iterations: int):
+    runs = {enabled: [run_turn(server, slow(script, model_seconds), text, events, enabled) for _ in range(iterations)]
+            for enabled in (False, True)}
+    ms = {enabled: sorted(run["ms"] for run in result)[len(result) // 2] for enabled, result in runs.items()}
+    last = runs[True][-1]
+    print(f"{name:<12} {ms[False]:7.1f} ms without prefetch, {ms[True]:7.1f} ms with "
+          f"({last['hit']:g} hit, {last['wasted']:g} wasted, {last['requests']} requests)")
+    return ms, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calendar-ms", type=float, default=100)
+    parser.add_argument("--model-ms", type=float, default=200)
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+    latency, model = args.calendar_ms / 1000, args.model_ms / 1000
+
+    failures = []
+    with FakeCalendarServer(latency=latency) as server:
+        calendar_service.CALENDAR_API_ENDPOINT = server.endpoint
+        calendar_service.service_pool.clear()
+
+        ms, last = compare(server, "update", update_by_name, "Move my dentist appointment tomorrow to 3pm",
+                           DENTIST, model, args.iterations)
+        if ms[False] - ms[True] < 0.5 * args.calendar_ms:
+            failures.append(f"prefetch saved only {ms[False] - ms[True]:.0f} ms of a {args.calendar_ms:g} ms round trip")
+
+        result = run_turn(server, three_days, "Show my next three days", DENTIST, enabled=False)
+        print(f"parallel     3 get_events calls in {result['ms']:.1f} ms ({args.calendar_ms:g} ms per round trip)")
+        if result["ms"] > 2 * args.calendar_ms + 100:
+            failures.append(f"three independent get_events calls took {result['ms']:.0f} ms; they should overlap")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Routing benchmark: the intent router sends each message to the cheapest prompt, toolset and model that serves it.
+
+Runs a mixed session through the real workflow with routing on and off. Fake
+models stand in for the two tiers, the full model answering in --full-ms and the
+fast one in --fast-ms, and the run fails unless routing lowers both the mean turn
+latency and the token cost (fast-tier tokens priced at --fast-price of a full one).
+The keyword rules themselves are checked in tests/test_routing.py.
+
+    python -m benchmarks.routing --full-ms 300 --fast-ms 80
+"""
+import argparse
+import statistics
+import sys
+import time
+import uuid
+
+from google.oauth2.credentials import Credentials
+from langchain_core.messages import HumanMessage
+
+import calendar_service
+import chatbot_with_todo
+from agent_registry import agent_registry
+from benchmarks.fake_calendar import FakeCalendarServer
+from benchmarks.fakes import FakeChatModel
+from benchmarks.turn_latency import at, chit_chat, list_events, seeded_event, single_create, update_by_name
+from event_store import reset_event_stores
+from intent_router import CHIT_CHAT, READ, WRITE
+from response_cache import response_cache
+from telemetry import metrics
+
+SESSION = [
+    ("hi", chit_chat),
+    ("What's on my calendar tomorrow?", list_events),
+    ("Book lunch with Sam tomorrow at noon", single_create),
+    ("Move my dentist appointment tomorrow to 3pm", update_by_name),
+    ("thanks!", chit_chat),
+]
+SCRIPTS = dict(SESSION)
+
+
+def scripted(seconds: float):
+    """Answer with the script of the turn's user message, after `seconds`."""
+    def run(messages):
+        time.sleep(seconds)
+        user = next(m for m in reversed(messages) if isinstance(m, HumanMessage) and m.name is None)
+        return SCRIPTS[user.content](messages)
+    return run
+
+
+def run_session(server: FakeCalendarServer, routed: bool, full_seconds: float, fast_seconds: float) -> dict:
+    full = FakeChatModel(responses=[scripted(full_seconds)], model_name="fake-full")
+    fast = FakeChatModel(responses=[scripted(fast_seconds)], model_name="fake-fast")
+    chatbot_with_todo.llm, chatbot_with_todo.fast_llm = full, fast
+    chatbot_with_todo.ROUTER_ENABLED = routed
+    agent_registry.clear()
+    response_cache.clear()
+    reset_event_stores()
+    server.reset([seeded_event("dentist", "Dentist", at(10), at(11))])
+    graph = chatbot_with_todo.get_workflow()
+    creds, thread_id, latencies = Credentials(token="bench-routing"), uuid.uuid4().hex, []
+    for text, _ in SESSION:
+        started = time.perf_counter()
+        chatbot_with_todo.run_chatbot(graph, {"messages": [HumanMessage(text)]}, creds, thread_id=thread_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {"ms": statistics.mean(latencies), "full_tokens": sum(full.prompt_tokens),
+            "fast_tokens": sum(fast.prompt_tokens), "calls": full.calls + fast.calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--full-ms", type=float, default=300)
+    parser.add_argument("--fast-ms", type=float, default=80)
+    parser.add_argument("--fast-price", type=float, default=0.15)
+    args = parser.parse_args()
+
+    failures, results = [], {}
+    with FakeCalendarServer() as server:
+        calendar_service.CALENDAR_API_ENDPOINT = server.endpoint
+        calendar_service.service_pool.clear()
+        for routed in (False, True):
+            result = run_session(server, routed, args.full_ms / 1000, args.fast_ms / 1000)
+            result["cost"] = result["full_tokens"] + args.fast_price * result["fast_tokens"]
+            results[routed] = result
+            print(f"{'routed' if routed else 'direct'}:  mean turn {result['ms']:6.1f} ms, {result['calls']} model calls, "
+                  f"{result['full_tokens']} full + {result['fast_tokens']} fast prompt tokens (cost {result['cost']:.0f})")
+    for intent in (CHIT_CHAT, READ, WRITE):
+        print(f"route:   {intent:<10} {metrics.value('route_total', {'intent': intent, 'source': 'rules'}):g} turns")
+    if results[True]["ms"] >= results[False]["ms"]:
+        failures.append("routing did not lower the mean turn latency")
+    if results[True]["cost"] >= results[False]["cost"]:
+        failures.append("routing did not lower the token cost")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""End-to-end turn benchmark: latency, model calls, tool calls, prompt tokens and memory per scenario.
+
+Runs the real workflow (get_workflow / run_chatbot) offline: scripted fake chat
+models stand in for ChatOpenAI (calendar agent) and ChatOllama (scheduler), and
+the Calendar tools talk to benchmarks/fake_calendar.py. Both fakes act as a
+prompt cache, so uncached_tokens is the prompt prefill a provider would still
+charge for once it reuses each prompt's prefix. Each scenario is measured
+--runs times and every metric is the median of those runs, so one noisy run
+(a p95 is close to the slowest session) can't fail the gate. The results are
+compared with benchmarks/baseline.json and the run fails if any scenario regressed.
+
+    python -m benchmarks.turn_latency
+    python -m benchmarks.turn_latency --scenario todo_10 --iterations 40 --runs 5
+    python -m benchmarks.turn_latency --update-baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable
+from zoneinfo import ZoneInfo
+
+# In-memory checkpoints and event store, and no throttling: only the code under test is measured.
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("CALENDAR_USER_QPS", "1000")
+os.environ.setdefault("CALENDAR_USER_BURST", "1000")
+os.environ.setdefault("CALENDAR_PROJECT_QPS", "1000")
+os.environ.setdefault("CALENDAR_PROJECT_BURST", "1000")
+
+from google.oauth2.credentials import Credentials
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+import calendar_service
+import chatbot_with_todo
+from agent_registry import agent_registry
+from benchmarks.fake_calendar import FakeCalendarServer
+from benchmarks.fakes import FakeChatModel
+from event_store import reset_event_stores
+from response_cache import response_cache
+from slot_scheduler import DEFAULT_TIMEZONE
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# metric: (allowed ratio to the baseline, absolute slack). Latency is noisy and machine
+# dependent (a busy host alone can add half), so only a doubling fails; the counts are
+# deterministic, so any increase is a regression.
+TOLERANCES = {
+    "p50_ms": (2.0, 10.0),
+    "p95_ms": (2.0, 10.0),
+    "model_calls": (1.0, 0.0),
+    "tool_calls": (1.0, 0.0),
+    "api_requests": (1.0, 0.0),
+    "prompt_tokens": (1.05, 0.0),
+    "uncached_tokens": (1.05, 0.0),
+    "peak_kb": (1.25, 256.0),
+}
+
+TZ = ZoneInfo(DEFAULT_TIMEZONE)
+DAY = datetime.now(TZ).date() + timedelta(days=1)
+
+
+def at(hour: int, minute: int = 0, day=DAY) -> str:
+    return datetime(day.year, day.month, day.day, hour, minute, tzinfo=TZ).isoformat()
+
+
+def day_range(day=DAY) -> dict:
+    return {"startDateTime": at(0, day=day), "endDateTime": at(23, 59, day=day)}
+
+
+def envelope(response: str, needs_deep_analysis: bool = False, scheduling_context: dict | None = None) -> str:
+    return json.dumps({
+        "needs_deep_analysis": needs_deep_analysis,
+        "message": "",
+        "scheduling_context": scheduling_context or {},
+        "response_for_user": response,
+    })
+
+
+def tool_call(name: str, args: dict) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}])
+
+
+def event_args(summary: str, start: str, end: str) -> dict:
+    return {"summary": summary, "location": "", "description": "", "start_time": start, "end_time": end, "attendees": []}
+
+
+def seeded_event(event_id: str, summary: str, start: str, end: str) -> dict:
+    return {"id": event_id, "summary": summary, "start": {"dateTime": start}, "end": {"dateTime": end}}
+
+
+# ------------------------------------------------------------------------------
+# Scripted models
+#
+#    Each script looks at the last message of the prompt, the way the real model
+#    would: a user question starts a tool call, a tool result or the scheduler's
+#    plan leads to the next step, and the last step is the JSON envelope.
+# ------------------------------------------------------------------------------
+def list_events(messages):
+    last = messages[-1]
+    if isinstance(last, ToolMessage):
+        # ToolNode keeps an empty list result as a (content block) list.
+        events = json.loads(last.content) if isinstance(last.content, str) else last.content
+        return envelope(f"You have {len(events)} events: " + ", ".join(e["summary"] for e in events))
+    day = DAY
+    for word in last.content.split():
+        try:
+            day = datetime.fromisoformat(word.rstrip("?")).date()
+        except ValueError:
+            continue
+    return tool_call("get_events", day_range(day))
+
+
+def chit_chat(messages):
+    return "Hi! I can look up, create, move and delete events, or fit a to-do list into your day."
+
+
+def single_create(messages):
+    if isinstance(messages[-1], ToolMessage):
+        return envelope("Lunch with Sam is booked for tomorrow at noon.")
+    return tool_call("create_event", event_args("Lunch with Sam", at(12), at(13)))
+
+
+def update_by_name(messages):
+    last = messages[-1]
+    if isinstance(last, ToolMessage) and last.name == "get_events":
+        dentist = next(e for e in json.loads(last.content) if e["summary"] == "Dentist")
+        return tool_call("update_event", {**event_args("Dentist", at(15), at(16)), "eventId": dentist["eventId"]})
+    if isinstance(last, ToolMessage):
+        return envelope("Your dentist appointment now starts at 3pm.")
+    return tool_call("get_events", day_range())
+
+
+TASKS = ["Write report", "Email Alex", "Groceries", "Gym", "Call mom", "Review PR", "Pay bills",
+         "Laundry", "Plan trip", "Read chapter"]
+
+
+def todo_list(with_durations: bool):
+    def script(messages):
+        last = messages[-1]
+        if isinstance(last, HumanMessage) and last.name == "scheduler":
+            schedule = json.loads(last.content)
+            return tool_call("create_events", {"events": [
+                event_args(task["summary"], task["start_time"], task["end_time"]) for task in schedule["tasks"]
+            ]})
+        if isinstance(last, ToolMessage) and last.name == "create_events":
+            return envelope(f"Scheduled {len(TASKS)} tasks for tomorrow.")
+        if isinstance(last, ToolMessage):
+            tasks = [{"summary": name, "priority": 2} for name in TASKS]
+            if with_durations:
+                tasks = [{**task, "duration_minutes": 30} for task in tasks]
+            context = {"date": DAY.isoformat(), "timezone": DEFAULT_TIMEZONE, "tasks": tasks}
+            return envelope("", needs_deep_analysis=True, scheduling_context=context)
+        return tool_call("get_free_busy", day_range())
+    return script
+
+
+def local_scheduler(messages):
+    tasks = [{"summary": name, "start_time": at(9 + i // 2, 30 * (i % 2)), "end_time": at(9 + i // 2, 30 * (i % 2) + 29)}
+             for i, name in enumerate(TASKS)]
+    return "<think>Ten short tasks, one after another from 9am.</think>" + json.dumps({"tasks": tasks})
+
+
+def overthinking_scheduler(messages):
+    """Reasons far past the budget unless it is told to stop thinking."""
+    if "out of thinking time" in messages[-1].content:
+        return local_scheduler(messages).split("</think>")[1]
+    return "<think>" + "Let me reconsider the order of these tasks once more. " * 2000
+
+
+@dataclass
+class Scenario:
+    name: str
+    turns: list[str]
+    calendar: Callable
+    scheduler: Callable = local_scheduler
+    events: list[dict] = field(default_factory=list)
+
+
+SCENARIOS = [
+    Scenario("list_events", ["What's on my calendar tomorrow?"], list_events,
+             events=[seeded_event("standup", "Standup", at(9), at(9, 15)), seeded_event("lunch", "Lunch", at(12), at(13))]),
+    Scenario("single_create", ["Book lunch with Sam tomorrow at noon"], single_create),
+    Scenario("chit_chat", ["hi", "thanks!"], chit_chat),
+    Scenario("todo_10", [f"Todo tomorrow: {', '.join(TASKS)}. 30 minutes each."], todo_list(with_durations=True)),
+    Scenario("todo_10_local_model", [f"Todo tomorrow: {', '.join(TASKS)}"], todo_list(with_durations=False)),
+    Scenario("todo_10_overthinking", [f"Todo tomorrow: {', '.join(TASKS)}"], todo_list(with_durations=False),
+             scheduler=overthinking_scheduler),
+    Scenario("update_by_name", ["Move my dentist appointment tomorrow to 3pm"], update_by_name,
+             events=[seeded_event("dentist", "Dentist", at(10), at(11))]),
+    Scenario("repeat_read", ["What's on my calendar tomorrow?"] * 5, list_events,
+             events=[seeded_event("standup", "Standup", at(9), at(9, 15))]),
+    Scenario("long_session", [f"What do I have on {(DAY + timedelta(days=i)).isoformat()}?" for i in range(50)],
+             list_events, events=[seeded_event(f"standup{i}", "Standup", at(9, day=DAY + timedelta(days=i)),
+                                               at(9, 15, day=DAY + timedelta(days=i))) for i in range(50)]),
+]
+
+
+# ------------------------------------------------------------------------------
+# Runner
+# ------------------------------------------------------------------------------
+def run_session(scenario: Scenario, server: FakeCalendarServer, creds) -> list[dict]:
+    """One conversation on a fresh thread and calendar; per-turn measurements."""
+    calendar_model = FakeChatModel(responses=[scenario.calendar], prompt_cache=True)
+    scheduler_model = FakeChatModel(responses=[scenario.scheduler], model_name="fake-scheduler", prompt_cache=True)
+    chatbot_with_todo.llm = calendar_model
+    chatbot_with_todo.scheduler_llm = scheduler_model
+    agent_registry.clear()
+    response_cache.clear()
+    reset_event_stores()
+    server.reset(scenario.events)
+    graph = chatbot_with_todo.get_workflow()
+    thread_id = uuid.uuid4().hex
+    models = (calendar_model, scheduler_model)
+    turns, history = [], 0
+    for text in scenario.turns:
+        calls = [model.calls for model in models]
+        tokens = [len(model.prompt_tokens) for model in models]
+        requests = server.requests
+        started = time.perf_counter()
+        snapshot = chatbot_with_todo.run_chatbot(graph, {"messages": [HumanMessage(text)]}, creds, thread_id=thread_id)
+        elapsed = time.perf_counter() - started
+        messages = snapshot.values["messages"]
+        turns.append({
+            "ms": elapsed * 1000,
+            "model_calls": sum(model.calls - before for model, before in zip(models, calls)),
+            "tool_calls": sum(isinstance(message, ToolMessage) for message in messages[history:]),
+            "api_requests": server.requests - requests,
+            "prompt_tokens": sum(sum(model.prompt_tokens[before:]) for model, before in zip(models, tokens)),
+            "uncached_tokens": sum(sum(model.prompt_tokens[before:]) - sum(model.cached_tokens[before:])
+                                   for model, before in zip(models, tokens)),
+        })
+        history = len(messages)
+    return turns
+
+
+def percentile(values: list[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(share * (len(ordered) - 1)))]
+
+
+def measure(scenario: Scenario, server: FakeCalendarServer, iterations: int) -> dict:
+    """Latency over `iterations` sessions (after one warm-up), counts per turn, and peak memory of one session."""
+    creds = Credentials(token=f"bench-{scenario.name}")
+    run_session(scenario, server, creds)
+    turns = [turn for _ in range(iterations) for turn in run_session(scenario, server, creds)]
+    # Traced separately: tracemalloc slows everything down and would distort the latencies.
+    tracemalloc.start()
+    run_session(scenario, server, creds)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies = [turn["ms"] for turn in turns]
+    result = {"p50_ms": statistics.median(latencies), "p95_ms": percentile(latencies, 0.95)}
+    for metric in ("model_calls", "tool_calls", "api_requests", "prompt_tokens", "uncached_tokens"):
+        result[metric] = sum(turn[metric] for turn in turns) / len(turns)
+    result["peak_kb"] = peak / 1024
+    return {metric: round(value, 2) for metric, value in result.items()}
+
+
+def median_run(runs: list[dict]) -> dict:
+    return {metric: round(statistics.median(run[metric] for run in runs), 2) for metric in runs[0]}
+
+
+def regressions(name: str, result: dict, baseline: dict) -> list[str]:
+    failures = []
+    for metric, (ratio, slack) in TOLERANCES.items():
+        if metric in baseline and result[metric] > baseline[metric] * ratio + slack:
+            failures.append(f"{name}: {metric} {result[metric]} exceeds baseline {baseline[metric]}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=[scenario.name for scenario in SCENARIOS],
+                        help="run only this scenario (repeatable)")
+    parser.add_argument("--iterations", type=int, default=20, help="sessions per run")
+    parser.add_argument("--runs", type=int, default=3, help="runs per scenario; each metric is their median")
+    parser.add_argument("--update-baseline", action="store_true", help=f"write the results to {BASELINE_FILE}")
+    parser.add_argument("--verbose", action="store_true", help="show the agents' own output")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as file:
+            baseline = json.load(file)
+    results = {}
+    with FakeCalendarServer() as server:
+        calendar_service.CALENDAR_API_ENDPOINT = server.endpoint
+        calendar_service.service_pool.clear()
+        for scenario in SCENARIOS:
+            if args.scenario and scenario.name not in args.scenario:
+                continue
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                results[scenario.name] = median_run([measure(scenario, server, args.iterations) for _ in range(args.runs)])
+
+    metrics = list(TOLERANCES)
+    print(f"{'scenario':<22}" + "".join(f"{metric:>15}" for metric in metrics))
+    for name, result in results.items():
+        print(f"{name:<22}" + "".join(f"{result[metric]:>15}" for metric in metrics))
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, "w") as file:
+            json.dump({**baseline, **results}, file, indent=2)
+            file.write("\n")
+        print(f"Baseline written to {BASELINE_FILE}")
+        return
+    failures = [failure for name, result in results.items() for failure in regressions(name, result, baseline.get(name, {}))]
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
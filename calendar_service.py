@@ -0,0 +1,148 @@
+import functools
+import hashlib
+import os
+import threading
+import urllib.parse
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import Resource, build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+from rate_limiter import CalendarUnavailable, request_builder
+
+HTTP_TIMEOUT = 30
+# Point the clients at another server (e.g. benchmarks/fake_calendar.py), including the service path.
+CALENDAR_API_ENDPOINT = os.getenv("CALENDAR_API_ENDPOINT")
+
+
+# ------------------------------------------------------------------------------
+# Google Calendar service client pool
+#
+#    `build("calendar", "v3", ...)` parses the discovery document and opens a new
+#    HTTP transport on every call. The pool parses the bundled static discovery
+#    document once and keeps idle service clients per credential identity, each
+#    with its own keep-alive httplib2 connection. httplib2 is not thread-safe, so
+#    a client is checked out by exactly one caller at a time and returned after use.
+#    Every request a client makes goes through the rate limiter in rate_limiter.py.
+# ------------------------------------------------------------------------------
+@functools.lru_cache(maxsize=1)
+def load_discovery_document() -> str:
+    document = discovery_cache.get_static_doc("calendar", "v3")
+    if document is None:
+        raise RuntimeError("Bundled Calendar v3 discovery document not found")
+    return document
+
+
+def credential_key(creds) -> str:
+    """Stable identity for a set of credentials (client + refresh token)."""
+    if creds is None:
+        return "anonymous"
+    identity = "|".join(
+        str(part)
+        for part in (
+            getattr(creds, "client_id", None),
+            getattr(creds, "refresh_token", None) or getattr(creds, "token", None),
+        )
+    )
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+class ServicePool:
+    def __init__(self, max_idle_per_key: int = 4, max_keys: int = 256):
+        self.max_idle_per_key = max_idle_per_key
+        self.max_keys = max_keys
+        self._idle: OrderedDict[str, list[tuple[Resource, str | None]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _build(self, creds) -> Resource:
+        http = httplib2.Http(timeout=HTTP_TIMEOUT)
+        if creds is not None:
+            http = AuthorizedHttp(creds, http=http)
+        return build_from_document(
+            load_discovery_document(),
+            http=http,
+            requestBuilder=request_builder(credential_key(creds)),
+            client_options={"api_endpoint": CALENDAR_API_ENDPOINT} if CALENDAR_API_ENDPOINT else None,
+        )
+
+    def acquire(self, creds) -> Resource:
+        key = credential_key(creds)
+        token = getattr(creds, "token", None)
+        with self._lock:
+            entries = self._idle.get(key, [])
+            while entries:
+                service, service_token = entries.pop()
+                if service_token == token:
+                    self.hits += 1
+                    return service
+                # The credentials were refreshed since this client was pooled.
+                self.evictions += 1
+            self.misses += 1
+        return self._build(creds)
+
+    def release(self, creds, service: Resource):
+        key = credential_key(creds)
+        with self._lock:
+            entries = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(entries) < self.max_idle_per_key:
+                entries.append((service, getattr(creds, "token", None)))
+            while len(self._idle) > self.max_keys:
+                _, dropped = self._idle.popitem(last=False)
+                self.evictions += len(dropped)
+
+    def evict(self, creds):
+        with self._lock:
+            dropped = self._idle.pop(credential_key(creds), [])
+            self.evictions += len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "idle": sum(len(entries) for entries in self._idle.values()),
+            }
+
+
+service_pool = ServicePool()
+
+
+def new_batch(service: Resource, callback) -> BatchHttpRequest:
+    """service.new_batch_http_request(), sent to CALENDAR_API_ENDPOINT's host when that is set."""
+    if not CALENDAR_API_ENDPOINT:
+        return service.new_batch_http_request(callback=callback)
+    # The discovery document's batch path ignores the endpoint override.
+    return BatchHttpRequest(callback=callback, batch_uri=urllib.parse.urljoin(CALENDAR_API_ENDPOINT, "/batch/calendar/v3"))
+
+
+@contextmanager
+def calendar_service(creds) -> Iterator[Resource]:
+    """Check a Calendar service client out of the shared pool for the duration of a block."""
+    service = service_pool.acquire(creds)
+    healthy = False
+    try:
+        yield service
+        healthy = True
+    except (HttpError, CalendarUnavailable):
+        # An API error (or a call refused locally) still means the connection itself is fine.
+        healthy = True
+        raise
+    finally:
+        # Don't hand a client with a possibly broken connection to the next caller.
+        if healthy:
+            service_pool.release(creds, service)
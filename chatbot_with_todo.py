@@ -1,24 +1,40 @@
 # main.py
 import os
-from datetime import datetime, time
+from datetime import datetime, time, timezone
 import pytz
 from dotenv import load_dotenv
 
 from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START, END, MessagesState
 from langgraph.graph.state import CompiledStateGraph
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.types import StateSnapshot, Command
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import merge_configs
 from google_auth_oauthlib.flow import Flow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
+import asyncio
 import json
+import logging
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator
 # Import the calendar tools from our event_handler module.
-from event_handler import create_event, get_events, update_event, delete_event, init_google_calendar
+from event_handler import create_event, create_events, get_events, get_free_busy, update_event, delete_event
+from agent_registry import agent_registry
+from checkpointer import get_checkpoint_store
+from slot_scheduler import AmbiguousSchedule, day_bounds, plan_day
+from context_window import calendar_context, estimate_tokens, scheduler_context
+from response_cache import response_cache
+from streaming import JsonFlagStreamer, ThinkStreamer
+from envelopes import CalendarReply, Schedule, openai_response_format, parse_reply, parse_schedule
+from telemetry import traced, tracing_callbacks, turn
+from ollama_manager import PRIORITY_INTERACTIVE, SCHEDULER_MODEL, ModelBusy, ollama_manager
+from prefetch import start_prefetch
+from intent_router import CHIT_CHAT, FULL, READ, ROUTER_ENABLED, TODO, WRITE, intent_router
 
 # ------------------------------------------------------------------------------
 # 1. Load environment variables and initialize the LLM model
@@ -27,22 +43,34 @@ load_dotenv()
 TOKEN_FILE = "token.json"
 CLIENT_SECRET_FILE = "credentials.json"
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
+DEFAULT_THREAD_ID = "local"
+logger = logging.getLogger(__name__)
 
-def init_model() -> ChatOpenAI:
+def init_model(model_name: str | None = None) -> ChatOpenAI:
     try:
-        MODEL_NAME = os.getenv("MODEL_NAME")
+        MODEL_NAME = model_name or os.getenv("MODEL_NAME")
         OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
         llm = ChatOpenAI(
             model=MODEL_NAME,
             temperature=0.3,
             api_key=OPENAI_API_KEY,
+            # Streamed replies report usage too, including the prompt tokens served from cache.
+            stream_usage=True,
         )
-        print("Model initialized successfully:", llm)
+        logger.info("Model initialized successfully: %s", llm.model_name)
         return llm
     except Exception as e:
-        print(f"Model cannot be initialized: {e}")
+        logger.error("Model cannot be initialized: %s", e)
 
 llm = init_model()
+# Cheaper model for chit-chat and read-only questions (see intent_router.py); unset: llm serves every tier.
+FAST_MODEL_NAME = os.getenv("FAST_MODEL_NAME")
+fast_llm = init_model(FAST_MODEL_NAME) if FAST_MODEL_NAME else None
+
+
+def tier_model(tier: str):
+    """The model for a tier: "fast" (FAST_MODEL_NAME, if set) or "full" (MODEL_NAME)."""
+    return fast_llm if tier == "fast" and fast_llm is not None else llm
 
 # ------------------------------------------------------------------------------
 # 2. Define the agent node
@@ -50,83 +78,341 @@ llm = init_model()
 #    If the user's message appears to be a to‑do list (detected via keywords), the prompt instructs
 #    the LLM to extract individual tasks, estimate durations, and call the tool "create_event"
 #    for each scheduled task. Otherwise, it falls back to normal calendar operations.
+#
+#    The calendar sub-agent is compiled once per process through the agent registry; the
+#    scheduler has no tools, so it is a single streamed call to the local model. The system
+#    prompts below are fixed text, the same bytes on every call, so OpenAI's prompt cache and
+#    Ollama's KV cache can reuse their prefill (and the tool schemas ahead of them). The
+#    per-turn values (today's date, current time) follow in a short message of their own,
+#    read from the run config when the prompt is rendered, and the user's message is only
+#    in the history, so the cached graph never needs rebuilding.
+#    The history sent with each prompt goes through the model's context window (see
+#    context_window.py), so prompt size stays bounded however long the session gets.
 # ------------------------------------------------------------------------------
-def calendar_agent(state: MessagesState) -> MessagesState:
-    try:
-        user_message = state["messages"][-1].content
-        today_str = datetime.now().strftime("%Y-%m-%d")
-        
-        # Check if the message likely contains a to‑do list.
-       
-        prompt = f"""
+# The local model's one shared client; ollama_manager.py keeps it loaded and queues requests to it.
+scheduler_llm = ollama_manager.llm
+# deepseek-r1 thinks before it answers. Past this many streamed reasoning tokens it is stopped
+# and asked for the answer alone, in at most SCHEDULER_ANSWER_TOKENS tokens.
+SCHEDULER_REASONING_BUDGET = int(os.getenv("SCHEDULER_REASONING_BUDGET", "1500"))
+SCHEDULER_ANSWER_TOKENS = int(os.getenv("SCHEDULER_ANSWER_TOKENS", "1024"))
+# Keep the reasoning on the checkpointed scheduler message (additional_kwargs["reasoning"]).
+SCHEDULER_KEEP_REASONING = os.getenv("SCHEDULER_KEEP_REASONING", "0") == "1"
+CALENDAR_TOOLS = [create_event, create_events, get_events, get_free_busy, update_event, delete_event]
+# Tool calls from one model message run concurrently, at most this many at a time.
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "4"))
+# The key the graph routes on; CalendarReply streams it first.
+ROUTE_FIELD = "needs_deep_analysis"
+# Ollama constrains the scheduler's answer-only call to this schema.
+SCHEDULE_SCHEMA = Schedule.model_json_schema()
+
+CALENDAR_RULES = """
 You are an intelligent assistant that manages a Google Calendar using tools you are provided.
-You can call only one tool at a time, once you create one event you have to call again if you want to create another event.
+To create a single event call "create_event". To create more than one event call "create_events" once with all of them instead of calling "create_event" repeatedly.
+To answer availability questions (when am I free, is this time open) use "get_free_busy" rather than "get_events"; it can check several calendars in one call.
+Tool calls that don't depend on each other's results (e.g. reading two different days, or deleting two events whose ids you have) should be requested together in one step; they run at the same time.
+If a tool returns an "error", do not call it again with the same arguments unless "retryable" is true, and never more than once; tell the user what failed (and when to try again if "retry_after_seconds" is given).
 While updating or deleting events, get all the events for the mentioned date from 12am to 11:59pm. Use the id of that particular event to perform the necessary action.
 output date/time values in ISO 8601/RFC3339 format including the time zone information.
-If the user has provided a to-do list. Your task is to:
+"""
+
+TODO_RULES = """If the user has provided a to-do list. Your task is to:
   1. Parse the following to-do list input and extract each task.
-  2. Fetch the events of the mentioned day using get_event tool as prescribed from 12am to 11:59pm.
+  2. Check the availability of the mentioned day using get_free_busy from 12am to 11:59pm.
   3. If you do not have times for each task set the boolean needs_deep_analysis as True for scheduling tasks and return the output in the mentioned format. There exists an agent that will provide you with the times for each events. You can create events only after that. 
+     In that case scheduling_context must be a JSON object with:
+     - date: the day to schedule on (YYYY-MM-DD).
+     - timezone: the IANA time zone name, e.g. America/Los_Angeles.
+     - tasks: a list of objects with summary, duration_minutes (your estimate of how long the task takes), priority (1 high, 2 normal, 3 low), and earliest and deadline date-times (null unless the user gave them).
+     - working_hours: an object with start and end (HH:MM), null unless the user mentioned them.
+     Otherwise scheduling_context is null.
   4. If you do have times, set the boolean needs_deep_analysis as False and move to the next step.
-  5. For each scheduled task, call the tool "create_event" with these parameters:
+  5. Call the tool "create_events" once with every scheduled task, each with these parameters:
      - summary: the task description.
      - location: an empty string if not provided.
      - description: "Scheduled from to-do list".
      - start_time: the scheduled start time.
      - end_time: the scheduled end time.
      - attendees: an empty list.
-User input: "{user_message}"
-Today's date is {today_str}.
-Output must only be a valid JSON in the following format with no extra characters:
-            - message: Message for the agent.
+If the last message comes from the scheduler, it is the final schedule: call "create_events" once with all of its tasks, set needs_deep_analysis as False and report the result of each task to the user. If the scheduler returned an "error" instead, create nothing and tell the user to try again shortly.
+"""
+
+REPLY_FORMAT = """Output must only be a valid JSON in the following format with no extra characters:
             - needs_deep_analysis: Boolean indicating need for deeper scheduling help if the user asks to schedule a task or gives a todo list.
+            - message: Message for the agent.
             - scheduling_context: Additional metadata with user input.
             - response_for_user: Response to the user for user input with all information (if any) formatted in a pretty way if needs_deep_analysis is False, else empty.
 """
-        graph_agent = create_react_agent(
-            llm,
-            tools=[create_event, get_events, update_event, delete_event],
-            state_modifier=prompt
+
+CALENDAR_PROMPT = CALENDAR_RULES + TODO_RULES + REPLY_FORMAT
+
+# Smaller prompts for the intents that don't need the to-do list workflow (see AGENT_PROFILES).
+NO_SCHEDULING = "Set needs_deep_analysis as False and scheduling_context as null.\n"
+
+READ_PROMPT = """
+You are an intelligent assistant that answers questions about a Google Calendar using tools you are provided.
+Use "get_free_busy" for availability questions (when am I free, is this time open) and "get_events" to list events. Request calls that don't depend on each other together in one step.
+If a tool returns an "error", call it again at most once and only if "retryable" is true; otherwise tell the user what failed.
+output date/time values in ISO 8601/RFC3339 format including the time zone information.
+""" + NO_SCHEDULING + REPLY_FORMAT
+
+WRITE_PROMPT = CALENDAR_RULES + NO_SCHEDULING + REPLY_FORMAT
+
+CHAT_PROMPT = """You are the friendly assistant of a Google Calendar app. Reply briefly, in plain text, to the user's message.
+If they seem to want something done, say what you can do: answer questions about their calendar, create, move and delete events, and fit a to-do list into their day."""
+
+SCHEDULING_PROMPT = """
+        You are an intellient task scheduling that schedules user's tasks or events at reasonable times by analysing user's schedule for the day. You need to think how much time will each task take and what order should to schedule the tasks in.
+        The current date and time are in the last message. Schedule events only after the current time without overlap with existing events.
+        Your input is the calendar agent's message before it.
+        output date/time values in ISO 8601/RFC3339 format including the time zone information.
+        Output all user's tasks with the scheduled start time and end time. Respond only in valid json format:
+        {"date": "YYYY-MM-DD", "timezone": "IANA name", "tasks": [{"summary": "...", "start_time": "...", "end_time": "...", "priority": 2}], "unscheduled": [{"summary": "...", "reason": "..."}]}
+        """
+
+FINISH_SCHEDULE_PROMPT = """You are out of thinking time. Do not think any further. Using your notes below, output only the final schedule as valid json now.
+Your notes: {reasoning}"""
+
+# The volatile part of each prompt, sent after the fixed system prompt.
+TODAY_NOTE = "Today's date is {today_str}."
+NOW_NOTE = "The current date and time is {now_str}."
+
+
+def today_note(config: RunnableConfig | None = None) -> SystemMessage:
+    today_str = (config or {}).get("configurable", {}).get("today_str") or datetime.now().strftime("%Y-%m-%d")
+    return SystemMessage(content=TODAY_NOTE.format(today_str=today_str))
+
+
+def calendar_prompt(template: str):
+    """State modifier putting `template` (one of the calendar prompts) ahead of the sub-agent's messages.
+
+    The prompt comes first, unchanged, then today's date, which only changes daily,
+    then the history, which within a turn only grows; each model call's prompt is
+    the previous one's plus the new messages.
+    """
+    system = SystemMessage(content=template)
+
+    def render(state: dict, config: RunnableConfig) -> list:
+        today = today_note(config)
+        return [system, today] + calendar_context.prepare(state["messages"], reserved_tokens=estimate_tokens([system, today]))
+    return render
+
+
+def scheduling_prompt(state: dict, config: RunnableConfig) -> list:
+    """The scheduler's prompt, with the current time last.
+
+    Ollama's templates merge every system message into the one at the top, so the
+    time goes in a user message at the end instead, behind the part its KV cache
+    can reuse.
+    """
+    now_str = config.get("configurable", {}).get("now_str") or datetime.now().strftime("%d/%m/%Y, %H:%M:%S")
+    system, now = SystemMessage(content=SCHEDULING_PROMPT), HumanMessage(content=NOW_NOTE.format(now_str=now_str))
+    return [system] + scheduler_context.prepare(state["messages"], reserved_tokens=estimate_tokens([system, now])) + [now]
+
+
+@dataclass(frozen=True)
+class AgentProfile:
+    prompt: str
+    tools: tuple
+    tier: str  # "fast" or "full", see tier_model
+
+
+# What the calendar agent gets for each intent the router assigns; see intent_router.py.
+AGENT_PROFILES = {
+    READ: AgentProfile(READ_PROMPT, (get_events, get_free_busy), "fast"),
+    WRITE: AgentProfile(WRITE_PROMPT, tuple(CALENDAR_TOOLS), "full"),
+    TODO: AgentProfile(CALENDAR_PROMPT, tuple(CALENDAR_TOOLS), "full"),
+    FULL: AgentProfile(CALENDAR_PROMPT, tuple(CALENDAR_TOOLS), "full"),
+}
+
+
+def calendar_model(model, tools: list):
+    """The calendar agent's model, constrained to reply with a CalendarReply where the provider supports it.
+
+    OpenAI's structured outputs only apply to the final message; tool calls are
+    unaffected. The response_format goes in the request body directly because the
+    SDK's parsing client insists that every tool be strict, and these are not.
+    """
+    if isinstance(model, ChatOpenAI):
+        return model.bind_tools(
+            tools,
+            parallel_tool_calls=True,
+            extra_body={"response_format": openai_response_format(CalendarReply)},
         )
-        result = graph_agent.invoke(state)
-        print("Final state:", result['messages'][-1].content)
+    return model
+
+
+def get_calendar_agent(intent: str = FULL) -> CompiledStateGraph:
+    profile = AGENT_PROFILES.get(intent, AGENT_PROFILES[FULL])
+    model, tools = tier_model(profile.tier), list(profile.tools)
+    return agent_registry.get(
+        f"calendar.{intent}",
+        model.model_name,
+        tools,
+        lambda: create_react_agent(
+            calendar_model(model, tools),
+            tools=tools,
+            state_modifier=RunnableLambda(calendar_prompt(profile.prompt)),
+            checkpointer=False,
+        ),
+    )
+
+
+def new_messages(history: list, produced: list) -> list:
+    """Messages a sub-agent produced that are not already in the history (by message id).
+
+    Nodes return only these; the MessagesState reducer appends them to the checkpointed
+    log, so each message is stored once no matter how many times it is passed around.
+    """
+    seen = {message.id for message in history if message.id}
+    return [message for message in produced if not message.id or message.id not in seen]
+
+
+def asked_user(messages: list) -> bool:
+    """Whether the previous turn's reply (the message before the user's latest one) asked a question."""
+    if len(messages) < 2 or getattr(messages[-2], "name", None) != "calendar":
+        return False
+    envelope = parse_reply(messages[-2].content)
+    return envelope is not None and "?" in (envelope.response_for_user or "")
+
+
+@traced("node", "router")
+def route_message(state: "CalendarState", config: RunnableConfig) -> dict:
+    last = state["messages"][-1]
+    text = last.content if isinstance(last.content, str) else ""
+    asked = (state.get("intent") or FULL) if asked_user(state["messages"]) else None
+    return {"intent": intent_router.route(text, config, asked=asked)}
+
+
+@traced("node", "chat")
+def chat_agent(state: "CalendarState", config: RunnableConfig) -> MessagesState:
+    """Chit-chat: one call to the fast model, no tools, wrapped in a CalendarReply like any other reply."""
+    try:
+        system, today = SystemMessage(content=CHAT_PROMPT), today_note(config)
+        history = calendar_context.prepare(state["messages"], reserved_tokens=estimate_tokens([system, today]))
+        reply = tier_model("fast").invoke([system, today] + history, config=config)
+        envelope = CalendarReply(needs_deep_analysis=False, message="", response_for_user=reply.content)
+        return {"messages": [HumanMessage(content=envelope.model_dump_json(), name="calendar")]}
+    except Exception as e:
+        logger.exception("Error in chat_agent: %s", e)
+        return {"messages": []}
+
+
+@traced("node", "calendar")
+def calendar_agent(state: "CalendarState", config: RunnableConfig) -> MessagesState:
+    prefetch = None
+    try:
+        today_str = datetime.now().strftime("%Y-%m-%d")
+        last = state["messages"][-1]
+        if isinstance(last, HumanMessage) and last.name is None:
+            # Fetch the days the user mentioned while the first model call runs.
+            prefetch = start_prefetch(config.get("configurable", {}).get("credentials"), last.content)
+        graph_agent = get_calendar_agent(state.get("intent") or FULL)
+        result = graph_agent.invoke(state, config=merge_configs(config, {
+            "configurable": {"today_str": today_str, "prefetch": prefetch},
+            "max_concurrency": TOOL_CONCURRENCY,
+        }))
+        logger.debug("Calendar agent result: %s", result['messages'][-1].content)
         result["messages"][-1] = HumanMessage(content=result["messages"][-1].content, name="calendar")
-        state["messages"].extend(result["messages"])
-        return state
+        return {"messages": new_messages(state["messages"], result["messages"])}
 
     except Exception as e:
-        print(f"Error in calendar_agent: {e}")
-        return state
+        logger.exception("Error in calendar_agent: %s", e)
+        return {"messages": []}
+    finally:
+        if prefetch is not None:
+            prefetch.close()
     
 
-def scheduling_agent(state: MessagesState) -> MessagesState:
+def plan_schedule(envelope: str, config: RunnableConfig) -> dict | None:
+    """Deterministic fast path: pack the calendar agent's tasks into the day's free time.
+
+    Returns None when the request is too ambiguous for slot_scheduler, so the local
+    model can take over.
+    """
+    try:
+        reply = parse_reply(envelope)
+        if reply is None or reply.scheduling_context is None:
+            raise AmbiguousSchedule("no scheduling_context in the calendar agent's reply")
+        context = reply.scheduling_context.model_dump()
+        now = datetime.now(timezone.utc)
+        day_start, day_end = day_bounds(context, now)
+        free_busy = get_free_busy.invoke({"startDateTime": day_start, "endDateTime": day_end}, config=config)
+        busy = free_busy.get("primary", {}).get("busy")
+        if busy is None:
+            return None
+        return plan_day(context, busy, now)
+    except (AmbiguousSchedule, ValueError, KeyError, TypeError) as e:
+        logger.info("Slot scheduler cannot handle this request, falling back to %s: %s", SCHEDULER_MODEL, e)
+        return None
+
+
+def stream_reasoning(model, messages: list, config: RunnableConfig, budget: int) -> tuple[ThinkStreamer, bool]:
+    """Stream the model's reply, split into reasoning and answer; stop once reasoning passes `budget`.
+
+    Ollama streams about one token per chunk, so reasoning chunks are counted as tokens.
+    Returns the streamer and whether the budget stopped the model; closing the stream
+    ends the request, so Ollama stops generating too.
+    """
+    streamer, reasoning_tokens, final = ThinkStreamer(), 0, None
+    chunks = model.stream(messages, config=config)
+    try:
+        for chunk in chunks:
+            if chunk.response_metadata:
+                final = chunk
+            if isinstance(chunk.content, str) and streamer.feed(chunk.content)[0]:
+                reasoning_tokens += 1
+                if reasoning_tokens > budget and streamer.state == "reasoning":
+                    return streamer, True
+    finally:
+        chunks.close()
+    streamer.flush()
+    ollama_manager.record_response(final)
+    return streamer, False
+
+
+def scheduler_message(content: str, reasoning: str = "") -> HumanMessage:
+    # The reasoning is only stored when asked for; it is long and no later prompt needs it.
+    extra = {"reasoning": reasoning.strip()} if SCHEDULER_KEEP_REASONING and reasoning.strip() else {}
+    return HumanMessage(content=content, name="scheduler", additional_kwargs=extra)
+
+
+@traced("node", "scheduler")
+def scheduling_agent(state: MessagesState, config: RunnableConfig) -> MessagesState:
     try:
-      
-        agent_message = state["messages"][-1].content
+        schedule = plan_schedule(state["messages"][-1].content, config)
+        if schedule is not None:
+            logger.debug("Slot scheduler result: %s", schedule)
+            return {"messages": [scheduler_message(json.dumps(schedule))]}
+
         date = datetime.now().strftime("%d/%m/%Y, %H:%M:%S")
-        
-        prompt = f"""
-        You are an intellient task scheduling that schedules user's tasks or events at reasonable times by analysing user's schedule for the day. You need to think how much time will each task take and what order should to schedule the tasks in.
-        Remember that today's date and time {date}. Schedule events only after the current time without overlap with existing events.
-        Your input: {agent_message}
-        output date/time values in ISO 8601/RFC3339 format including the time zone information.
-        Output all user's tasks with the scheduled start time and end time and all other information you received. Respond only in valid json format.
-        """
-    
-        deepseek = ChatOllama(model='deepseek-r1:7b')
-        print("----------------------------", deepseek)
-
-        graph_agent = create_react_agent(model=deepseek, tools=[], state_modifier=prompt)
-        result = graph_agent.invoke(state)
-        print("Scheduling agent result:", result)  # Debugging
-        result["messages"][-1] = HumanMessage(content=result["messages"][-1].content.split('</think>')[1], name="calendar")
-        state["messages"].extend(result["messages"])
-        
-        return state
-    
+        config = merge_configs(config, {"configurable": {"now_str": date}})
+        prompt = scheduling_prompt(state, config)
+        priority = config.get("configurable", {}).get("model_priority", PRIORITY_INTERACTIVE)
+        with ollama_manager.slot(priority):
+            # The reasoning call is left unconstrained: a JSON schema would stop deepseek-r1
+            # from thinking at all. Only the answer-only call below is schema-constrained.
+            streamer, stopped = stream_reasoning(scheduler_llm, prompt, config, SCHEDULER_REASONING_BUDGET)
+            reasoning = streamer.reasoning
+            schedule = None if stopped else parse_schedule(streamer.answer)
+            if schedule is None:
+                logger.info("Scheduler reasoning %s; asking for the answer only",
+                            "hit its budget" if stopped else "ended without a valid schedule")
+                finish = prompt + [HumanMessage(content=FINISH_SCHEDULE_PROMPT.format(reasoning=reasoning.strip()))]
+                answer_model = scheduler_llm.bind(format=SCHEDULE_SCHEMA, options={"num_predict": SCHEDULER_ANSWER_TOKENS})
+                streamer, _ = stream_reasoning(answer_model, finish, config, SCHEDULER_ANSWER_TOKENS)
+                schedule = parse_schedule(streamer.answer)
+        if schedule is None:
+            error = {"category": "no_schedule", "retryable": True, "message": "The scheduling model did not produce a schedule"}
+            return {"messages": [scheduler_message(json.dumps({"error": error}), reasoning)]}
+        logger.debug("Scheduling agent result: %s", streamer.answer)
+        return {"messages": [scheduler_message(schedule.model_dump_json(exclude_none=True), reasoning)]}
+
+    except ModelBusy as e:
+        logger.warning("Scheduling model busy: %s", e)
+        return {"messages": [scheduler_message(json.dumps(e.as_error()))]}
     except Exception as e:
-        print(f"Error in scheduling_agent: {e}")
-        return state
+        logger.exception("Error in scheduling_agent: %s", e)
+        return {"messages": []}
 
 # ------------------------------------------------------------------------------
 # 3. (Optional) A helper to print streaming output for debugging.
@@ -148,38 +434,213 @@ def print_stream(stream):
     except Exception as e:
         print(f"Error in print_stream: {e}")
 
+def scheduled_this_turn(messages: list) -> bool:
+    for message in reversed(messages):
+        if getattr(message, "name", None) == "scheduler":
+            return True
+        if isinstance(message, HumanMessage) and message.name is None:
+            return False
+    return False
+
+
 def schedule_decision(state: dict):
-    if json.loads(state['messages'][-1].content)['needs_deep_analysis']:
+    # Once the scheduler has produced this turn's schedule, the calendar agent creates it
+    # with a single create_events call and the turn ends; never loop back.
+    if scheduled_this_turn(state['messages']):
+        return END
+    if needs_deep_analysis(state['messages'][-1].content):
         return "scheduler"
     else: 
         return END
 
+
+def needs_deep_analysis(content) -> bool:
+    """Read the route off the start of a calendar reply without parsing the rest of it."""
+    return isinstance(content, str) and bool(JsonFlagStreamer(ROUTE_FIELD).feed(content))
+
+def intent_decision(state: dict):
+    return "chat" if state.get("intent") == CHIT_CHAT else "calendar"
+
 # ------------------------------------------------------------------------------
 # 4. Build the workflow graph
+#
+#    With ROUTER_ENABLED, each turn starts at the router (intent_router.py), which
+#    stores the message's intent in the state: chit-chat goes to the chat node and
+#    ends there, everything else to the calendar agent profile for that intent.
 # ------------------------------------------------------------------------------
-def get_workflow() -> CompiledStateGraph:
-    workflow = StateGraph(MessagesState)
+class CalendarState(MessagesState):
+    intent: str
+
+
+def get_workflow(checkpointer: BaseCheckpointSaver | None = None) -> CompiledStateGraph:
+    workflow = StateGraph(CalendarState)
     workflow.add_node("calendar", calendar_agent)
     workflow.add_node("scheduler", scheduling_agent)
-    workflow.add_edge(START, "calendar")
-    workflow.add_conditional_edges("calendar", schedule_decision)
+    if ROUTER_ENABLED:
+        workflow.add_node("router", route_message)
+        workflow.add_node("chat", chat_agent)
+        workflow.add_edge(START, "router")
+        workflow.add_conditional_edges("router", intent_decision, ["chat", "calendar"])
+        workflow.add_edge("chat", END)
+    else:
+        workflow.add_edge(START, "calendar")
+    workflow.add_conditional_edges("calendar", schedule_decision, ["scheduler", END])
     workflow.add_edge("scheduler", "calendar")
     # workflow.add_edge("calendar", END)
-    memory = MemorySaver()
-    graph = workflow.compile(checkpointer=memory)
+    graph = workflow.compile(checkpointer=checkpointer or get_checkpoint_store().saver)
     return graph
 
 # ------------------------------------------------------------------------------
 # 5. Main runner: Initialize Google Calendar and run the agent workflow.
+#
+#    Each conversation is its own checkpointed thread; callers pass a per-user,
+#    per-session id built with checkpointer.make_thread_id.
+#
+#    With stream=True, run_chatbot returns a generator of events instead of the final
+#    state snapshot:
+#      {"type": "token", "node", "content", "id"} model tokens; "id" identifies the model message
+#      {"type": "tool_call", "node", "name"}     a tool call was requested
+#      {"type": "tool_result", "node", "name"}   a tool finished
+#      {"type": "route", "node", "next"}         where the turn goes after this calendar reply
+#                                                ("scheduler" or "end"), as soon as it has streamed
+#      {"type": "node", "node"}                  a graph node finished
+#      {"type": "final", "state"}                the final StateSnapshot
+#    "node" is the top-level graph node ("calendar" or "scheduler") the event came from.
+#
+#    A repeated read-only question is answered from response_cache.py: the cached
+#    reply is appended to the thread as if the calendar node had produced it, and no
+#    node runs.
+#
+#    `configurable` adds run settings for the nodes and tools, e.g. the background
+#    job's idempotency key and progress callback (jobs.py). `interrupt_before` stops
+#    the turn before those nodes (the chat hands a turn bound for the scheduler to
+#    jobs.py this way); the final state's `next` then says where it stopped.
+#    Streaming with state=None resumes the thread's interrupted turn from its last
+#    checkpoint.
 # ------------------------------------------------------------------------------
-def run_chatbot(graph: CompiledStateGraph, state: MessagesState, creds) -> StateSnapshot:
-    init_google_calendar(creds)
-    config = {"configurable": {"thread_id": "1"}}
-    for chunk in graph.stream(state, config=config):
-        print("--------------------------------------------------------------------")
-        print(chunk)
+def run_config(creds, thread_id: str, configurable: dict | None = None) -> RunnableConfig:
+    # Credentials travel with the run (the tools read them from the config), so
+    # concurrent conversations never see each other's calendar. The callbacks add
+    # model and tool spans to the turn's trace (telemetry.py).
+    return {"configurable": {**(configurable or {}), "thread_id": thread_id, "credentials": creds},
+            "callbacks": [tracing_callbacks]}
+
+
+def cached_update(state: MessagesState, reply: str) -> dict:
+    return {"messages": [state["messages"][-1], HumanMessage(content=reply, name="calendar")]}
+
+
+def cached_turn(graph: CompiledStateGraph, state: MessagesState, config: RunnableConfig) -> StateSnapshot | None:
+    """The thread's new state if the question was answered from the response cache, else None."""
+    reply = response_cache.lookup(config["configurable"]["credentials"], state["messages"][-1].content)
+    if reply is None:
+        return None
+    graph.update_state(config, cached_update(state, reply), as_node="calendar")
     return graph.get_state(config=config)
 
+
+def remember_reply(state: MessagesState, final_state: StateSnapshot, creds):
+    response_cache.store(creds, state["messages"][-1].content, final_state.values["messages"])
+    logger.debug("Response cache: %s", response_cache.stats())
+
+
+def stream_events(mode: str, payload, routes: dict[str, JsonFlagStreamer]) -> Iterator[dict]:
+    """Translate one (mode, payload) item from graph.stream/astream into chat events.
+
+    `routes` holds one flag reader per calendar message of the turn (by message id).
+    """
+    if mode == "updates":
+        for node in payload:
+            yield {"type": "node", "node": node}
+        return
+    message, metadata = payload
+    node = metadata.get("langgraph_checkpoint_ns", "").split(":")[0] or metadata.get("langgraph_node")
+    if isinstance(message, ToolMessage):
+        yield {"type": "tool_result", "node": node, "name": message.name}
+    elif isinstance(message, AIMessageChunk):
+        for tool_call in message.tool_call_chunks:
+            if tool_call.get("name"):
+                yield {"type": "tool_call", "node": node, "name": tool_call["name"]}
+        if isinstance(message.content, str) and message.content:
+            yield {"type": "token", "node": node, "content": message.content, "id": message.id}
+            if node == "calendar":
+                flag = routes.setdefault(message.id, JsonFlagStreamer(ROUTE_FIELD))
+                if not flag.done and flag.feed(message.content) is not None:
+                    yield {"type": "route", "node": node, "next": "scheduler" if flag.value else "end"}
+
+
+def stream_chatbot(graph: CompiledStateGraph, state: MessagesState | None, creds, thread_id: str = DEFAULT_THREAD_ID,
+                   configurable: dict | None = None, interrupt_before: list[str] | None = None) -> Iterator[dict]:
+    config = run_config(creds, thread_id, configurable)
+    with turn(thread_id) as attributes:
+        final_state = cached_turn(graph, state, config) if state is not None else None
+        attributes["cache"] = "miss" if final_state is None else "hit"
+        if final_state is not None:
+            reply = final_state.values["messages"][-1]
+            yield {"type": "token", "node": "calendar", "content": reply.content, "id": reply.id}
+        else:
+            routes = {}
+            for mode, payload in graph.stream(state, config=config, stream_mode=["messages", "updates"],
+                                              interrupt_before=interrupt_before):
+                yield from stream_events(mode, payload, routes)
+            logger.debug("Agent registry: %s", agent_registry.stats())
+            final_state = graph.get_state(config=config)
+            attributes["intent"] = final_state.values.get("intent", FULL)
+            if state is not None:
+                remember_reply(state, final_state, creds)
+        get_checkpoint_store().after_turn(thread_id)
+    yield {"type": "final", "state": final_state}
+
+
+async def astream_chatbot(graph: CompiledStateGraph, state: MessagesState, creds, thread_id: str = DEFAULT_THREAD_ID,
+                          interrupt_before: list[str] | None = None) -> AsyncIterator[dict]:
+    """Async twin of stream_chatbot for graphs compiled with an async checkpointer."""
+    config = run_config(creds, thread_id)
+    with turn(thread_id) as attributes:
+        reply = await asyncio.to_thread(response_cache.lookup, creds, state["messages"][-1].content)
+        attributes["cache"] = "miss" if reply is None else "hit"
+        if reply is not None:
+            await graph.aupdate_state(config, cached_update(state, reply), as_node="calendar")
+            final_state = await graph.aget_state(config=config)
+            reply = final_state.values["messages"][-1]
+            yield {"type": "token", "node": "calendar", "content": reply.content, "id": reply.id}
+        else:
+            routes = {}
+            async for mode, payload in graph.astream(state, config=config, stream_mode=["messages", "updates"],
+                                                     interrupt_before=interrupt_before):
+                for event in stream_events(mode, payload, routes):
+                    yield event
+            final_state = await graph.aget_state(config=config)
+            attributes["intent"] = final_state.values.get("intent", FULL)
+            await asyncio.to_thread(remember_reply, state, final_state, creds)
+        await asyncio.to_thread(get_checkpoint_store().after_turn, thread_id)
+    yield {"type": "final", "state": final_state}
+
+
+def extract_response(content: str) -> str:
+    """The user-facing text of a calendar agent reply (its response_for_user field)."""
+    reply = parse_reply(content)
+    return content if reply is None else reply.response_for_user
+
+
+def run_chatbot(graph: CompiledStateGraph, state: MessagesState, creds, stream: bool = False, thread_id: str = DEFAULT_THREAD_ID,
+                configurable: dict | None = None, interrupt_before: list[str] | None = None) -> StateSnapshot | Iterator[dict]:
+    if stream:
+        return stream_chatbot(graph, state, creds, thread_id, configurable, interrupt_before)
+    config = run_config(creds, thread_id, configurable)
+    with turn(thread_id) as attributes:
+        final_state = cached_turn(graph, state, config)
+        attributes["cache"] = "miss" if final_state is None else "hit"
+        if final_state is None:
+            for chunk in graph.stream(state, config=config, interrupt_before=interrupt_before):
+                logger.debug("Graph update: %s", chunk)
+            logger.debug("Agent registry: %s", agent_registry.stats())
+            final_state = graph.get_state(config=config)
+            attributes["intent"] = final_state.values.get("intent", FULL)
+            remember_reply(state, final_state, creds)
+        get_checkpoint_store().after_turn(thread_id)
+    return final_state
+
 # ------------------------------------------------------------------------------
 # 6. For local testing: simulate a to-do list input.
 # ------------------------------------------------------------------------------
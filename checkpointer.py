@@ -0,0 +1,196 @@
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import MemorySaver
+
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite")  # memory | sqlite | postgres
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "checkpoints.sqlite")
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "5"))
+CHECKPOINT_TTL_HOURS = float(os.getenv("CHECKPOINT_TTL_HOURS", "168"))
+CHECKPOINT_CLEANUP_INTERVAL = float(os.getenv("CHECKPOINT_CLEANUP_INTERVAL", "3600"))
+logger = logging.getLogger(__name__)
+
+
+def postgres_uri() -> str:
+    # Same variables docker-compose.yml uses for the Postgres service.
+    return os.getenv("POSTGRES_URI") or "postgresql://{}:{}@{}:{}/{}".format(
+        os.getenv("DB_USER"),
+        os.getenv("DB_PASSWORD"),
+        os.getenv("DB_HOST", "localhost"),
+        os.getenv("DB_PORT", "5432"),
+        os.getenv("DB_NAME"),
+    )
+
+
+def make_thread_id(user_id: str, session_id: str) -> str:
+    return f"{user_id}:{session_id}"
+
+
+# ------------------------------------------------------------------------------
+# Durable checkpointer
+#
+#    SQLite (local, tests) or Postgres (production) replaces the in-process
+#    MemorySaver. After every turn the thread's older checkpoints are pruned so
+#    only the latest CHECKPOINT_KEEP_LAST remain, and threads that have been idle
+#    longer than CHECKPOINT_TTL_HOURS are deleted on a periodic sweep. Activity is
+#    tracked in a small side table because the checkpoints themselves are opaque blobs.
+# ------------------------------------------------------------------------------
+class CheckpointStore:
+    def __init__(
+        self,
+        saver: BaseCheckpointSaver,
+        backend: str,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        ttl_seconds: float = CHECKPOINT_TTL_HOURS * 3600,
+        pool=None,
+    ):
+        self.saver = saver
+        self.backend = backend
+        self.keep_last = keep_last
+        self.ttl_seconds = ttl_seconds
+        self._pool = pool
+        self._last_cleanup = 0.0
+        self._cleanup_lock = threading.Lock()
+        if backend != "memory":
+            self._execute(
+                "CREATE TABLE IF NOT EXISTS checkpoint_thread_activity "
+                "(thread_id TEXT PRIMARY KEY, last_seen DOUBLE PRECISION NOT NULL)"
+            )
+
+    @property
+    def _tables(self) -> list[str]:
+        if self.backend == "postgres":
+            return ["checkpoint_writes", "checkpoints"]
+        return ["writes", "checkpoints"]
+
+    def _execute(self, *statements: tuple[str, tuple] | str):
+        statements = [(s, ()) if isinstance(s, str) else s for s in statements]
+        if self.backend == "sqlite":
+            with self.saver.lock, self.saver.conn:
+                for sql, params in statements:
+                    self.saver.conn.execute(sql, params)
+        elif self.backend == "postgres":
+            with self._pool.connection() as conn, conn.transaction():
+                for sql, params in statements:
+                    conn.execute(sql.replace("?", "%s"), params)
+
+    def touch(self, thread_id: str):
+        self._execute((
+            "INSERT INTO checkpoint_thread_activity (thread_id, last_seen) VALUES (?, ?) "
+            "ON CONFLICT (thread_id) DO UPDATE SET last_seen = excluded.last_seen",
+            (thread_id, time.time()),
+        ))
+
+    def prune(self, thread_id: str):
+        """Keep the thread's latest `keep_last` root checkpoints; drop finished sub-agent checkpoints."""
+        writes, checkpoints = self._tables
+        statements = []
+        for table in (writes, checkpoints):
+            statements.append((f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns != ''", (thread_id,)))
+            statements.append((
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = '' AND checkpoint_id NOT IN ("
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' "
+                "ORDER BY checkpoint_id DESC LIMIT ?)",
+                (thread_id, thread_id, self.keep_last),
+            ))
+        if self.backend == "postgres":
+            # Channel values are stored once per version; drop versions no remaining checkpoint uses.
+            statements.append((
+                "DELETE FROM checkpoint_blobs b WHERE b.thread_id = ? AND NOT EXISTS ("
+                "SELECT 1 FROM checkpoints c WHERE c.thread_id = b.thread_id "
+                "AND c.checkpoint_ns = b.checkpoint_ns "
+                "AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version)",
+                (thread_id,),
+            ))
+        self._execute(*statements)
+
+    def cleanup_expired(self) -> None:
+        """Delete every thread that has been idle for longer than the TTL."""
+        cutoff = time.time() - self.ttl_seconds
+        expired = "SELECT thread_id FROM checkpoint_thread_activity WHERE last_seen < ?"
+        tables = self._tables + (["checkpoint_blobs"] if self.backend == "postgres" else [])
+        self._execute(
+            *[(f"DELETE FROM {table} WHERE thread_id IN ({expired})", (cutoff,)) for table in tables],
+            ("DELETE FROM checkpoint_thread_activity WHERE last_seen < ?", (cutoff,)),
+        )
+
+    def after_turn(self, thread_id: str):
+        if self.backend == "memory":
+            return
+        try:
+            self.touch(thread_id)
+            self.prune(thread_id)
+            with self._cleanup_lock:
+                due = time.time() - self._last_cleanup > CHECKPOINT_CLEANUP_INTERVAL
+                if due:
+                    self._last_cleanup = time.time()
+            if due:
+                self.cleanup_expired()
+        except Exception as e:
+            logger.warning("Checkpoint maintenance failed: %s", e)
+
+
+@functools.lru_cache(maxsize=None)
+def get_checkpoint_store(backend: str = CHECKPOINT_BACKEND) -> CheckpointStore:
+    """One checkpointer (and connection pool) per process, shared by every session's graph."""
+    if backend == "memory":
+        return CheckpointStore(MemorySaver(), backend)
+    if backend == "sqlite":
+        from langgraph.checkpoint.sqlite import SqliteSaver
+
+        saver = SqliteSaver(sqlite3.connect(CHECKPOINT_DB, check_same_thread=False))
+        saver.setup()
+        return CheckpointStore(saver, backend)
+    if backend == "postgres":
+        from langgraph.checkpoint.postgres import PostgresSaver
+        from psycopg.rows import dict_row
+        from psycopg_pool import ConnectionPool
+
+        pool = ConnectionPool(
+            postgres_uri(),
+            max_size=int(os.getenv("POSTGRES_POOL_SIZE", "10")),
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+        )
+        saver = PostgresSaver(pool)
+        saver.setup()
+        return CheckpointStore(saver, backend, pool=pool)
+    raise ValueError(f"Unknown CHECKPOINT_BACKEND: {backend}")
+
+
+@asynccontextmanager
+async def async_checkpointer(backend: str = CHECKPOINT_BACKEND) -> AsyncIterator[BaseCheckpointSaver]:
+    """Async saver for graph.astream, on the same database as get_checkpoint_store().
+
+    Checkpoint maintenance keeps using the sync CheckpointStore on its own connection.
+    """
+    if backend == "memory":
+        # The sync store's saver, so background jobs (jobs.py) see the server's threads.
+        yield get_checkpoint_store().saver if backend == CHECKPOINT_BACKEND else MemorySaver()
+    elif backend == "sqlite":
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        async with AsyncSqliteSaver.from_conn_string(CHECKPOINT_DB) as saver:
+            await saver.setup()
+            yield saver
+    elif backend == "postgres":
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+
+        async with AsyncConnectionPool(
+            postgres_uri(),
+            max_size=int(os.getenv("POSTGRES_POOL_SIZE", "10")),
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+        ) as pool:
+            saver = AsyncPostgresSaver(pool)
+            await saver.setup()
+            yield saver
+    else:
+        raise ValueError(f"Unknown CHECKPOINT_BACKEND: {backend}")
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage, get_buffer_string
+
+# Rolling summaries kept per window; the least recently used conversation's is dropped
+# first (and rebuilt from its history if it comes back).
+MAX_SUMMARIES = int(os.getenv("CONTEXT_MAX_SUMMARIES", "1024"))
+
+
+def estimate_tokens(messages: list[BaseMessage]) -> int:
+    """Rough token count (4 characters per token); no tokenizer download needed."""
+    return len(get_buffer_string(messages)) // 4
+
+
+# ------------------------------------------------------------------------------
+# Token-budgeted context window
+#
+#    The checkpointed history is never trimmed; this only decides what is sent to a
+#    model. The current turn is always kept verbatim, the previous `keep_turns` turns
+#    are kept with long tool results replaced by short references, and everything
+#    older is folded into a rolling summary. If the result is still over budget,
+#    more turns move into the summary.
+# ------------------------------------------------------------------------------
+@dataclass
+class ContextBudget:
+    max_tokens: int
+    keep_turns: int = 4
+    summary_tokens: int = 300
+    tool_result_chars: int = 200
+
+
+def split_turns(messages: list[BaseMessage]) -> list[list[BaseMessage]]:
+    """Split the history at every message typed by the user (unnamed HumanMessage)."""
+    turns: list[list[BaseMessage]] = []
+    for message in messages:
+        if not turns or (isinstance(message, HumanMessage) and message.name is None):
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def compact_tool_result(message: ToolMessage, max_chars: int) -> ToolMessage:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    if len(content) <= max_chars:
+        return message
+    return message.model_copy(update={
+        "content": f"[{message.name or 'tool'} result omitted from context ({len(content)} chars, "
+                   f"tool_call_id={message.tool_call_id}); call the tool again if you need it]"
+    })
+
+
+def _short(text, limit: int = 150) -> str:
+    text = text if isinstance(text, str) else json.dumps(text)
+    try:
+        text = json.loads(text).get("response_for_user") or text
+    except (ValueError, AttributeError):
+        pass
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def extractive_summary(turns: list[list[BaseMessage]], previous: str, max_tokens: int) -> str:
+    """Summarise turns without a model call: the user request and final reply of each turn."""
+    lines = [previous] if previous else []
+    for turn in turns:
+        lines.append(f"User: {_short(turn[0].content)}")
+        if len(turn) > 1:
+            lines.append(f"Assistant: {_short(turn[-1].content)}")
+    summary = "\n".join(lines)
+    # Keep the most recent part when the summary outgrows its budget.
+    return summary[-max_tokens * 4:]
+
+
+class ContextWindow:
+    def __init__(
+        self,
+        budget: ContextBudget,
+        summarizer: Callable[[list[list[BaseMessage]], str, int], str] = extractive_summary,
+        count_tokens: Callable[[list[BaseMessage]], int] = estimate_tokens,
+        max_summaries: int = MAX_SUMMARIES,
+    ):
+        self.budget = budget
+        self.summarizer = summarizer
+        self.count_tokens = count_tokens
+        self.max_summaries = max_summaries
+        # Rolling summaries per conversation, least recently used first: first message id -> (turns summarised, summary).
+        self._summaries: OrderedDict[str, tuple[int, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _summary(self, conversation: str, older: list[list[BaseMessage]]) -> str:
+        summarised, summary = self.summarised(conversation)
+        if summarised < len(older):
+            summary = self.summarizer(older[summarised:], summary, self.budget.summary_tokens)
+            with self._lock:
+                self._summaries[conversation] = (len(older), summary)
+                self._summaries.move_to_end(conversation)
+                while len(self._summaries) > self.max_summaries:
+                    self._summaries.popitem(last=False)
+        return summary
+
+    def summarised(self, conversation: str) -> tuple[int, str]:
+        with self._lock:
+            if conversation not in self._summaries:
+                return 0, ""
+            self._summaries.move_to_end(conversation)
+            return self._summaries[conversation]
+
+    def prepare(self, messages: list[BaseMessage], reserved_tokens: int = 0) -> list[BaseMessage]:
+        """Return the messages to send, within max_tokens minus `reserved_tokens` (e.g. the system prompt)."""
+        turns = split_turns(list(messages))
+        if len(turns) <= 1:
+            return list(messages)
+        budget = self.budget.max_tokens - reserved_tokens
+        conversation = messages[0].id or ""
+        # Turns already folded into the summary stay there, so the summary only ever rolls forward.
+        split = max(len(turns) - 1 - self.budget.keep_turns, self.summarised(conversation)[0])
+        split = min(split, len(turns) - 1)
+        compacted = [
+            [
+                compact_tool_result(message, self.budget.tool_result_chars)
+                if isinstance(message, ToolMessage) else message
+                for message in turn
+            ]
+            for turn in turns[:-1]
+        ] + [turns[-1]]
+
+        while True:
+            older, recent = turns[:split], compacted[split:]
+            window = [message for turn in recent for message in turn]
+            if older:
+                summary = self._summary(conversation, older)
+                window = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + window
+            if split >= len(turns) - 1 or self.count_tokens(window) <= budget:
+                return window
+            split += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"conversations": len(self._summaries), "max_tokens": self.budget.max_tokens}
+
+
+calendar_context = ContextWindow(ContextBudget(
+    max_tokens=int(os.getenv("CALENDAR_CONTEXT_TOKENS", "12000")),
+    keep_turns=int(os.getenv("CONTEXT_KEEP_TURNS", "4")),
+))
+scheduler_context = ContextWindow(ContextBudget(
+    max_tokens=int(os.getenv("SCHEDULER_CONTEXT_TOKENS", "4000")),
+    keep_turns=int(os.getenv("SCHEDULER_KEEP_TURNS", "1")),
+))
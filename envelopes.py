@@ -0,0 +1,131 @@
+import json
+from typing import Iterator, Literal, TypeVar
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+T = TypeVar("T", bound=BaseModel)
+
+
+# ------------------------------------------------------------------------------
+# Typed replies of the calendar agent and the scheduler
+#
+#    The calendar agent answers with a CalendarReply and the scheduler with a
+#    Schedule. Both models are also the JSON schemas the providers constrain
+#    decoding to (OpenAI structured outputs, Ollama's `format`), so a reply that
+#    reaches the graph already has this shape; parse_reply/parse_schedule are the
+#    only places the JSON is read back. needs_deep_analysis is CalendarReply's
+#    first field, so the route is known as soon as the reply starts streaming.
+# ------------------------------------------------------------------------------
+class ContextTask(BaseModel):
+    summary: str
+    duration_minutes: int | None = Field(None, description="Estimated length of the task in minutes.")
+    priority: int | None = Field(None, description="1 high, 2 normal, 3 low.")
+    earliest: str | None = Field(None, description="RFC3339 date-time, only if the user gave one.")
+    deadline: str | None = Field(None, description="RFC3339 date-time, only if the user gave one.")
+
+
+class WorkingHours(BaseModel):
+    start: str = Field(description="HH:MM")
+    end: str = Field(description="HH:MM")
+
+
+class SchedulingContext(BaseModel):
+    date: str | None = Field(None, description="The day to schedule on, YYYY-MM-DD.")
+    timezone: str | None = Field(None, description="IANA time zone name, e.g. America/Los_Angeles.")
+    tasks: list[ContextTask]
+    working_hours: WorkingHours | None = None
+
+
+class CalendarReply(BaseModel):
+    needs_deep_analysis: bool
+    message: str
+    scheduling_context: SchedulingContext | None = None
+    response_for_user: str
+
+    @field_validator("scheduling_context", mode="before")
+    @classmethod
+    def _loose_context(cls, value):
+        # Older replies carried {} or a JSON string here.
+        if isinstance(value, str):
+            value = json.loads(value) if value.strip() else None
+        return value or None
+
+
+class ScheduledTask(BaseModel):
+    summary: str
+    start_time: str
+    end_time: str
+    priority: int | None = None
+
+
+class UnscheduledTask(BaseModel):
+    summary: str
+    reason: str
+
+
+class Schedule(BaseModel):
+    date: str | None = None
+    timezone: str | None = None
+    tasks: list[ScheduledTask]
+    unscheduled: list[UnscheduledTask] = []
+
+
+class IntentChoice(BaseModel):
+    intent: Literal["chit_chat", "read", "write", "todo"]
+
+
+def json_objects(text) -> Iterator[dict]:
+    """The JSON objects in `text`, in order, skipping code fences and any other text around them."""
+    if not isinstance(text, str):
+        return
+    decoder, start = json.JSONDecoder(), text.find("{")
+    while start != -1:
+        try:
+            value, end = decoder.raw_decode(text, start)
+        except ValueError:
+            start = text.find("{", start + 1)
+            continue
+        if isinstance(value, dict):
+            yield value
+        start = text.find("{", end)
+
+
+def _parse(model: type[T], text) -> T | None:
+    for data in json_objects(text):
+        try:
+            return model.model_validate(data)
+        except (ValidationError, ValueError):
+            continue
+    return None
+
+
+def parse_reply(content) -> CalendarReply | None:
+    """The calendar agent's reply, or None if `content` holds no valid one."""
+    return _parse(CalendarReply, content)
+
+
+def parse_schedule(content) -> Schedule | None:
+    """The scheduler's schedule, or None if `content` holds no valid one."""
+    return _parse(Schedule, content)
+
+
+def strict_json_schema(model: type[BaseModel]) -> dict:
+    """`model`'s JSON schema in the form OpenAI's strict mode accepts.
+
+    Every property is required (optional ones are nullable instead), no object
+    allows extra keys and defaults are dropped.
+    """
+    def strict(node):
+        if isinstance(node, dict):
+            node = {key: strict(value) for key, value in node.items() if key != "default"}
+            if node.get("type") == "object" and "properties" in node:
+                node["required"] = list(node["properties"])
+                node["additionalProperties"] = False
+        elif isinstance(node, list):
+            node = [strict(value) for value in node]
+        return node
+    return strict(model.model_json_schema())
+
+
+def openai_response_format(model: type[BaseModel]) -> dict:
+    return {"type": "json_schema", "json_schema": {"name": model.__name__, "strict": True, "schema": strict_json_schema(model)}}
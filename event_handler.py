@@ -1,21 +1,40 @@
 import datetime
+import hashlib
+import logging
+import os
 import os.path
+import uuid
+from collections import Counter
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from typing import List
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
+from pydantic import BaseModel, Field
+
+from calendar_service import calendar_service, credential_key, new_batch, service_pool
+from rate_limiter import CALENDAR_ERRORS, calendar_limiter, classify_error, is_retryable, retry_after
+from event_store import EVENT_STORE_ENABLED, get_event_store, iter_events, parse_bound
+from slot_scheduler import BusyIndex
+
+logger = logging.getLogger(__name__)
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
+# Google Calendar accepts at most 50 calls in a single batch request.
+MAX_BATCH_SIZE = 50
+# get_events returns at most this many events; the rest are summarised per day.
+MAX_EVENTS_RETURNED = int(os.getenv("MAX_EVENTS_RETURNED", "50"))
+# Stop reading (and counting) events after this many.
+MAX_EVENTS_SCANNED = int(os.getenv("MAX_EVENTS_SCANNED", "2500"))
 
 
 """Shows basic usage of the Google Calendar API.
 Prints the start and name of the next 10 events on the user's calendar.
 """
-cred = None
+creds = None
 # The file token.json stores the user's access and refresh tokens, and is
 # created automatically when the authorization flow completes for the first
 # time.
@@ -36,8 +55,102 @@ cred = None
 
 def init_google_calendar(credentials):
   global creds
+  if creds is not None and credential_key(creds) != credential_key(credentials):
+    service_pool.evict(creds)
   creds = credentials
-  print("Calendar initialized successfully")
+  logger.info("Calendar initialized successfully")
+
+def get_credentials(config: RunnableConfig | None = None):
+  """Credentials for the current run.
+
+  Taken from `configurable["credentials"]` in the graph config so concurrent users never
+  share them; falls back to the process-wide ones set by init_google_calendar.
+  """
+  if config:
+    credentials = config.get("configurable", {}).get("credentials")
+    if credentials is not None:
+      return credentials
+  return creds
+
+def parse_datetime(value: str) -> datetime.datetime:
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+def compact_time(value: datetime.datetime) -> str:
+    return value.isoformat(timespec="minutes")
+
+def bounded_events(events, limit: int = MAX_EVENTS_RETURNED, scan_limit: int = MAX_EVENTS_SCANNED) -> List[dict]:
+    """Take the first `limit` events and summarise the rest instead of returning them."""
+    shown, overflow, scanned = [], Counter(), 0
+    for event in events:
+        scanned += 1
+        if len(shown) < limit:
+            shown.append(event)
+        else:
+            overflow[event["start"][:10]] += 1
+        if scanned >= scan_limit:
+            break
+    if overflow:
+        shown.append({"overflow": {
+            "more_events": sum(overflow.values()),
+            "truncated": scanned >= scan_limit,
+            "by_day": dict(overflow),
+            "note": "Not every event is listed; query a narrower range to see the rest.",
+        }})
+    return shown
+
+def idempotent_event_id(key: str, summary: str, start_time: str, end_time: str) -> str:
+    """Calendar event id for the event `summary` from `start_time` to `end_time` created under `key` (e.g. a job id).
+
+    Inserting an event with an id that already exists fails with 409, so a retried
+    job can't create the same task twice: it resumes from the checkpointed schedule
+    and sends the same times again. Two tasks with the same name at different times
+    get different ids, whichever tool call creates them. The times are compared as
+    instants, so "Z" and "+00:00" give the same id. The hex digest fits Google's id
+    alphabet (base32hex, 5-1024 characters).
+    """
+    bounds = []
+    for value in (start_time, end_time):
+        try:
+            bounds.append(f"{parse_bound(value):.0f}")
+        except ValueError:
+            bounds.append(value)
+    return hashlib.sha1("|".join([key, summary, *bounds]).encode()).hexdigest()
+
+def insert_key(config: RunnableConfig) -> str:
+    """Key for the ids of the events a tool call inserts: the run's `idempotency_key`, or a fresh one.
+
+    Every insert carries an id, so an insert that is retried after Google already
+    applied it (a 5xx or dropped connection on the way back) gets 409 instead of
+    creating the event twice.
+    """
+    return config.get("configurable", {}).get("idempotency_key") or uuid.uuid4().hex
+
+def is_duplicate(error: Exception) -> bool:
+    return isinstance(error, HttpError) and error.resp.status == 409
+
+def report_progress(config: RunnableConfig | None, result: dict):
+    """Pass one task's result to the run's progress callback (`configurable["progress"]`, see jobs.py)."""
+    progress = (config or {}).get("configurable", {}).get("progress")
+    if progress is not None:
+        progress(result)
+
+def build_event_body(summary, location, description, start_time, end_time, attendees) -> dict:
+    return {
+        "summary": summary,
+        "location": location,
+        "description": description,
+        "start": {"dateTime": start_time, "timeZone": "America/Los_Angeles"},
+        "end": {"dateTime": end_time, "timeZone": "America/Los_Angeles"},
+        "attendees": [{"email": attendee} for attendee in attendees],
+        "reminders": {
+            "useDefault": False,
+            "overrides": [
+                {"method": "email", "minutes": 24 * 60},
+                {"method": "popup", "minutes": 10},
+            ],
+        },
+    }
 
 @tool
 def create_event(
@@ -47,7 +160,8 @@ def create_event(
     start_time: str,
     end_time: str,
     attendees: List[str],
-) -> str | None:
+    config: RunnableConfig,
+) -> str | dict:
     """Create a Google Calendar event.
 
     Args:
@@ -59,53 +173,184 @@ def create_event(
         attendees (List[str]): The list of attendees' emails.
 
     Returns:
-        str: The link to the created event.
+        str: The link to the created event, or {"error": ...} saying whether a retry can help.
     """
+    credentials = get_credentials(config)
+    idempotency_key = insert_key(config)
     try:
-        service = build("calendar", "v3", credentials=creds)
-        event = {
-            "summary": summary,
-            "location": location,
-            "description": description,
-            "start": {"dateTime": start_time, "timeZone": "America/Los_Angeles"},
-            "end": {"dateTime": end_time, "timeZone": "America/Los_Angeles"},
-            "recurrence": ["RRULE:FREQ=DAILY;COUNT=1"],
-            "attendees": [{"email": attendee} for attendee in attendees],
-            "reminders": {
-                "useDefault": False,
-                "overrides": [
-                    {"method": "email", "minutes": 24 * 60},
-                    {"method": "popup", "minutes": 10},
-                ],
-            },
-        }
-
-        event = service.events().insert(calendarId='primary', body=event).execute()
-        print('Event created: %s' % (event.get('htmlLink')))
+        event = build_event_body(summary, location, description, start_time, end_time, attendees)
+        event["id"] = idempotent_event_id(idempotency_key, summary, start_time, end_time)
+
+        with calendar_service(credentials) as service:
+            event = service.events().insert(calendarId='primary', body=event).execute()
+        get_event_store(credentials).record_write(event)
+        logger.info("Event created: %s", event.get('htmlLink'))
+        report_progress(config, {"summary": summary, "status": "created", "link": event.get("htmlLink")})
         return 'Event created: %s' % (event.get('htmlLink'))
-    except HttpError as error:
-        print(f"An error occurred: {error}")
-        return None
+    except CALENDAR_ERRORS as error:
+        if is_duplicate(error):
+            report_progress(config, {"summary": summary, "status": "already_created"})
+            return 'Event already created by an earlier attempt'
+        logger.warning("Calendar call failed: %s", error)
+        report_progress(config, {"summary": summary, "status": "error"})
+        return classify_error(error)
+
+
+class EventInput(BaseModel):
+    summary: str = Field(description="The summary of the event.")
+    location: str = Field(default="", description="The location of the event.")
+    description: str = Field(default="", description="The description of the event.")
+    start_time: str = Field(description="The start time of the event.")
+    end_time: str = Field(description="The end time of the event.")
+    attendees: List[str] = Field(default_factory=list, description="The list of attendees' emails.")
+
+
+@tool
+def create_events(events: List[EventInput], config: RunnableConfig) -> List[dict]:
+    """Create several Google Calendar events in one batch request.
+
+    Use this instead of repeated create_event calls when scheduling a to-do list.
+
+    Args:
+        events (List[EventInput]): The fully specified events to create.
+
+    Returns:
+        List[dict]: One result per event, in input order, with its status and link or error.
+            Throttled inserts are retried here; only resend events whose error is retryable.
+            "already_created" means an earlier attempt of the same job created it.
+    """
+    credentials = get_credentials(config)
+    key = credential_key(credentials)
+    idempotency_key = insert_key(config)
+    results = [None] * len(events)
+    store = get_event_store(credentials)
+    retry, retry_delays = [], []
+    event_ids = [idempotent_event_id(idempotency_key, event.summary, event.start_time, event.end_time) for event in events]
+
+    def callback(request_id, response, exception):
+        index = int(request_id)
+        if exception is not None and is_duplicate(exception):
+            results[index] = {"summary": events[index].summary, "status": "already_created"}
+        elif exception is not None:
+            if isinstance(exception, HttpError) and is_retryable(exception):
+                retry.append(index)
+                retry_delays.append(retry_after(exception) or 0.0)
+            results[index] = {"summary": events[index].summary, "status": "error", **classify_error(exception)}
+        else:
+            store.record_write(response)
+            results[index] = {"summary": events[index].summary, "status": "created", "link": response.get("htmlLink")}
+        report_progress(config, results[index])
+
+    pending = list(range(len(events)))
+    try:
+        with calendar_service(credentials) as service:
+            for attempt in range(calendar_limiter.max_retries + 1):
+                for offset in range(0, len(pending), MAX_BATCH_SIZE):
+                    chunk = pending[offset:offset + MAX_BATCH_SIZE]
+                    batch = new_batch(service, callback)
+                    for index in chunk:
+                        body = build_event_body(**events[index].model_dump())
+                        body["id"] = event_ids[index]
+                        batch.add(service.events().insert(calendarId='primary', body=body), request_id=str(index))
+                    calendar_limiter.call(key, batch.execute, cost=len(chunk), name="calendar.events.batch")
+                if not retry:
+                    break
+                # Resend only the inserts that were throttled or hit a server error.
+                calendar_limiter.pause(key, calendar_limiter.backoff(attempt, max(retry_delays)))
+                pending, retry, retry_delays = sorted(retry), [], []
+    except CALENDAR_ERRORS as error:
+        logger.warning("Calendar call failed: %s", error)
+        failure = classify_error(error)
+    else:
+        failure = {"error": {"category": "batch_failed", "retryable": True, "message": "Batch request failed"}}
+    for index, result in enumerate(results):
+        if result is None:
+            results[index] = {"summary": events[index].summary, "status": "error", **failure}
+            report_progress(config, results[index])
+    logger.info("Events created: %d/%d", sum(r["status"] != "error" for r in results), len(events))
+    return results
 
 
 @tool
-def get_events(startDateTime: str, endDateTime: str) -> List[dict]:
+def get_events(startDateTime: str, endDateTime: str, config: RunnableConfig) -> List[dict]:
   """Get Google Calendar events using any date range.
   Args:
     startDateTime (str): The start time of the event. example : 2011-06-03T10:00:00-07:00
     endDateTime (str): The end time of the event. example : 2011-06-03T14:00:00-07:00
   
   Returns:
-    dict: The Google Calendar events with event Id
+    List[dict]: The events (eventId, summary, start, end) in start order. Long ranges are
+      capped; a final {"overflow": ...} entry then counts the remaining events per day.
   """
-  try:
-      service = build("calendar", "v3", credentials=creds)
-      events = service.events().list(calendarId='primary', timeMin = startDateTime, timeMax = endDateTime, singleEvents=True).execute()
-      events = [{"eventId":event["id"],"summary": event['summary'], "start": event['start'], "end": event['end']} for event in events['items']]
+  # A day the turn's prefetch (prefetch.py) already fetched is answered without a request.
+  prefetch = config.get("configurable", {}).get("prefetch")
+  if prefetch is not None:
+    events = prefetch.take(startDateTime, endDateTime)
+    if events is not None:
       return events
-  except HttpError as error:
-      print(f"An error occurred: {error}")
-      return {"error": error}
+  return fetch_events(get_credentials(config), startDateTime, endDateTime)
+
+
+def fetch_events(credentials, startDateTime: str, endDateTime: str) -> List[dict] | dict:
+  """What get_events returns for the range, or the classified error."""
+  try:
+      with calendar_service(credentials) as service:
+        if EVENT_STORE_ENABLED:
+          events = get_event_store(credentials).iter_range(service, startDateTime, endDateTime)
+        else:
+          events = iter_events(service, startDateTime, endDateTime)
+        return bounded_events(events)
+  except CALENDAR_ERRORS as error:
+      logger.warning("Calendar call failed: %s", error)
+      return classify_error(error)
+
+@tool
+def get_free_busy(
+    startDateTime: str,
+    endDateTime: str,
+    config: RunnableConfig,
+    calendars: List[str] = ["primary"],
+    include_free: bool = False,
+) -> dict:
+  """Get busy (and optionally free) time ranges for one or more calendars in one call.
+  Use this to check availability; it is much smaller than get_events.
+
+  Args:
+    startDateTime (str): Start of the range. example : 2011-06-03T00:00:00-07:00
+    endDateTime (str): End of the range. example : 2011-06-03T23:59:00-07:00
+    calendars (List[str]): Calendar ids or emails to check, "primary" for the user's own.
+    include_free (bool): Also return the free gaps between busy ranges.
+
+  Returns:
+    dict: Per calendar, merged busy ranges as [start, end] pairs (and free ranges if requested).
+  """
+  credentials = get_credentials(config)
+  try:
+      window_start = parse_datetime(startDateTime)
+      window_end = parse_datetime(endDateTime)
+      with calendar_service(credentials) as service:
+        response = service.freebusy().query(body={
+            "timeMin": startDateTime,
+            "timeMax": endDateTime,
+            "items": [{"id": calendar} for calendar in calendars],
+        }).execute()
+      result = {}
+      for calendar, info in response.get("calendars", {}).items():
+        if info.get("errors"):
+          result[calendar] = {"error": info["errors"][0].get("reason", "unknown")}
+          continue
+        busy = BusyIndex([
+            (parse_datetime(block["start"]).astimezone(window_start.tzinfo),
+             parse_datetime(block["end"]).astimezone(window_start.tzinfo))
+            for block in info.get("busy", [])
+        ])
+        result[calendar] = {"busy": [[compact_time(start), compact_time(end)] for start, end in zip(busy.starts, busy.ends)]}
+        if include_free:
+          result[calendar]["free"] = [[compact_time(start), compact_time(end)] for start, end in busy.free_gaps(window_start, window_end)]
+      return result
+  except CALENDAR_ERRORS as error:
+      logger.warning("Calendar call failed: %s", error)
+      return classify_error(error)
   
 @tool
 def update_event(
@@ -116,7 +361,8 @@ def update_event(
     start_time: str,
     end_time: str,
     attendees: List[str],
-) -> str:
+    config: RunnableConfig,
+) -> str | dict:
   """Update a Google Calendar event by eventId but does not delete it.
   
   Args:
@@ -131,24 +377,26 @@ def update_event(
   Returns:
     str: The link to the updated event.
   """
+  credentials = get_credentials(config)
   try:
-      service = build("calendar", "v3", credentials=creds)
-      event = service.events().get(calendarId='primary', eventId=eventId).execute()
-      event['summary'] = summary
-      event['location'] = location
-      event['description'] = description
-      event['start'] = {"dateTime": start_time, "timeZone": "America/Los_Angeles"}
-      event['end'] = {"dateTime": end_time, "timeZone": "America/Los_Angeles"}
-      event['attendees'] = [{"email": attendee} for attendee in attendees]
-      updated_event = service.events().update(calendarId='primary', eventId=eventId, body=event).execute()
-      print('Event updated: %s' % (updated_event.get('htmlLink')))
+      with calendar_service(credentials) as service:
+        event = service.events().get(calendarId='primary', eventId=eventId).execute()
+        event['summary'] = summary
+        event['location'] = location
+        event['description'] = description
+        event['start'] = {"dateTime": start_time, "timeZone": "America/Los_Angeles"}
+        event['end'] = {"dateTime": end_time, "timeZone": "America/Los_Angeles"}
+        event['attendees'] = [{"email": attendee} for attendee in attendees]
+        updated_event = service.events().update(calendarId='primary', eventId=eventId, body=event).execute()
+      get_event_store(credentials).record_write(updated_event)
+      logger.info("Event updated: %s", updated_event.get('htmlLink'))
       return updated_event.get('htmlLink')
-  except HttpError as error:
-      print(f"An error occurred: {error}")
-      return error
+  except CALENDAR_ERRORS as error:
+      logger.warning("Calendar call failed: %s", error)
+      return classify_error(error)
   
 @tool
-def delete_event(eventId: str) -> str:
+def delete_event(eventId: str, config: RunnableConfig) -> str | dict:
   """
    Delete a Google Calendar event using event ID.
    
@@ -158,12 +406,14 @@ def delete_event(eventId: str) -> str:
     Returns:
         str: The link to the deleted event.
   """
+  credentials = get_credentials(config)
   try:
-    service = build("calendar", "v3", credentials=creds)
-    event = service.events().get(calendarId='primary', eventId=eventId).execute()
-    service.events().delete(calendarId='primary', eventId=eventId).execute()
-    print('Event deleted: %s' % (event.get('htmlLink')))
+    with calendar_service(credentials) as service:
+      event = service.events().get(calendarId='primary', eventId=eventId).execute()
+      service.events().delete(calendarId='primary', eventId=eventId).execute()
+    get_event_store(credentials).record_delete(eventId)
+    logger.info("Event deleted: %s", event.get('htmlLink'))
     return event.get('htmlLink')
-  except HttpError as error:
-    print(f"An error occurred: {error}")
-    return error
\ No newline at end of file
+  except CALENDAR_ERRORS as error:
+    logger.warning("Calendar call failed: %s", error)
+    return classify_error(error)
\ No newline at end of file
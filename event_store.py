@@ -0,0 +1,399 @@
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Iterator
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+from calendar_service import credential_key
+
+EVENT_STORE_ENABLED = os.getenv("EVENT_STORE_ENABLED", "1") == "1"
+EVENT_STORE_DB = os.getenv("EVENT_STORE_DB")
+EVENT_STORE_MAX_STALENESS = float(os.getenv("EVENT_STORE_MAX_STALENESS", "60"))
+# How far back and ahead the first sync reaches; ranges outside it are read from the API directly.
+EVENT_STORE_SYNC_DAYS = float(os.getenv("EVENT_STORE_SYNC_DAYS", "30"))
+EVENT_STORE_SYNC_AHEAD_DAYS = float(os.getenv("EVENT_STORE_SYNC_AHEAD_DAYS", "90"))
+# Stores kept in memory, least recently used dropped first (a persisted one reloads from EVENT_STORE_DB).
+EVENT_STORE_MAX_STORES = int(os.getenv("EVENT_STORE_MAX_STORES", "256"))
+EVENT_FIELDS = "timeZone,nextPageToken,nextSyncToken,items(id,status,summary,start,end)"
+RANGE_FIELDS = "nextPageToken,items(id,summary,start,end)"
+
+
+def compact_event(event: dict) -> dict:
+    """The few attributes the agents use, with start/end flattened to a single string."""
+    record = {
+        "eventId": event["id"],
+        "summary": event.get("summary", ""),
+        "start": event["start"].get("dateTime") or event["start"].get("date"),
+        "end": event["end"].get("dateTime") or event["end"].get("date"),
+    }
+    if "date" in event["start"]:
+        record["allDay"] = True
+    return record
+
+
+def iter_events(service, time_min: str, time_max: str, calendar_id: str = "primary", page_size: int = 250) -> Iterator[dict]:
+    """Page through events().list lazily, requesting only the fields compact_event needs."""
+    page_token = None
+    while True:
+        response = service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min,
+            timeMax=time_max,
+            singleEvents=True,
+            orderBy="startTime",
+            maxResults=page_size,
+            fields=RANGE_FIELDS,
+            pageToken=page_token,
+        ).execute()
+        for event in response.get("items", []):
+            yield compact_event(event)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
+
+
+# ------------------------------------------------------------------------------
+# Local event store
+#
+#    One store per (credentials, calendar). The first query does a full sync of
+#    the calendar from EVENT_STORE_SYNC_DAYS ago to EVENT_STORE_SYNC_AHEAD_DAYS
+#    ahead and keeps the returned `nextSyncToken`; later queries are answered from
+#    an index sorted by start time (ranges reaching outside the synced window go
+#    to the API), and once the copy is older than EVENT_STORE_MAX_STALENESS
+#    seconds it is refreshed with an incremental sync. The window's end bounds the
+#    instances a recurring event expands to; instances after it that an
+#    incremental sync returns are not kept. Writes made through the calendar
+#    tools are applied to the store directly.
+#    Setting EVENT_STORE_DB persists the events and sync token in SQLite so a
+#    restart only needs an incremental sync. `version` changes whenever the
+#    store's contents may have changed, so callers can key derived data on it.
+# ------------------------------------------------------------------------------
+def to_timestamp(value: dict, time_zone: str | None = None) -> float:
+    """Convert a Calendar `start`/`end` object (dateTime or all-day date) to a UTC timestamp.
+
+    All-day dates are taken as midnight in the calendar's time zone.
+    """
+    if "dateTime" in value:
+        parsed = datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+    else:
+        parsed = datetime.fromisoformat(value["date"])
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=ZoneInfo(time_zone) if time_zone else timezone.utc)
+    return parsed.timestamp()
+
+
+def rfc3339(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def parse_bound(value: str) -> float:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class EventStore:
+    def __init__(
+        self,
+        key: str,
+        calendar_id: str = "primary",
+        db_path: str | None = None,
+        max_staleness: float = EVENT_STORE_MAX_STALENESS,
+        sync_days: float = EVENT_STORE_SYNC_DAYS,
+        sync_ahead_days: float = EVENT_STORE_SYNC_AHEAD_DAYS,
+    ):
+        self.key = key
+        self.calendar_id = calendar_id
+        self.max_staleness = max_staleness
+        self.sync_days = sync_days
+        self.sync_ahead_days = sync_ahead_days
+        self.sync_token: str | None = None
+        self.last_sync: float | None = None
+        # The synced window; events ending before it or starting after it may be missing.
+        self.synced_from: float | None = None
+        self.synced_until: float | None = None
+        self.time_zone: str | None = None
+        self._events: dict[str, dict] = {}
+        self._index: list[tuple[float, str]] = []
+        # Longest event seen, so a range lookup can bisect to the first event that may overlap it.
+        self._max_duration = 0.0
+        self._dirty = False
+        self.version = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._init_db()
+            self._load_db()
+
+    # -- persistence ---------------------------------------------------------------
+    def _init_db(self):
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                store_key TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                body TEXT NOT NULL,
+                PRIMARY KEY (store_key, event_id)
+            );
+            CREATE TABLE IF NOT EXISTS sync_state (
+                store_key TEXT PRIMARY KEY,
+                sync_token TEXT,
+                last_sync REAL,
+                time_zone TEXT
+            );
+            """
+        )
+        for column in ("synced_from", "synced_until"):
+            try:
+                self._db.execute(f"ALTER TABLE sync_state ADD COLUMN {column} REAL")
+            except sqlite3.OperationalError:
+                pass  # Already there.
+        self._db.commit()
+
+    def _load_db(self):
+        row = self._db.execute(
+            "SELECT sync_token, last_sync, time_zone, synced_from, synced_until FROM sync_state WHERE store_key = ?",
+            (self.store_key,),
+        ).fetchone()
+        if row is None:
+            return
+        self.sync_token, self.last_sync, self.time_zone, synced_from, synced_until = row
+        # Stores saved before the window existed synced the whole calendar.
+        self.synced_from = float("-inf") if synced_from is None else synced_from
+        self.synced_until = float("inf") if synced_until is None else synced_until
+        for (body,) in self._db.execute("SELECT body FROM events WHERE store_key = ?", (self.store_key,)):
+            self._put(json.loads(body))
+
+    def _save_db(self, upserted: list[dict], removed: list[str], reset: bool = False):
+        if self._db is None:
+            return
+        with self._db:
+            if reset:
+                self._db.execute("DELETE FROM events WHERE store_key = ?", (self.store_key,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO events (store_key, event_id, body) VALUES (?, ?, ?)",
+                [(self.store_key, event["id"], json.dumps(event)) for event in upserted],
+            )
+            self._db.executemany(
+                "DELETE FROM events WHERE store_key = ? AND event_id = ?",
+                [(self.store_key, event_id) for event_id in removed],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_state (store_key, sync_token, last_sync, time_zone, synced_from, synced_until) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.store_key, self.sync_token, self.last_sync, self.time_zone, self.synced_from, self.synced_until),
+            )
+
+    @property
+    def store_key(self) -> str:
+        return f"{self.key}:{self.calendar_id}"
+
+    # -- index -----------------------------------------------------------------------
+    def _put(self, event: dict):
+        self._drop(event["id"])
+        event = {
+            **event,
+            "_start_ts": to_timestamp(event["start"], self.time_zone),
+            "_end_ts": to_timestamp(event["end"], self.time_zone),
+        }
+        self._events[event["id"]] = event
+        self._max_duration = max(self._max_duration, event["_end_ts"] - event["_start_ts"])
+        bisect.insort(self._index, (event["_start_ts"], event["id"]))
+
+    def _drop(self, event_id: str):
+        event = self._events.pop(event_id, None)
+        if event is None:
+            return
+        position = bisect.bisect_left(self._index, (event["_start_ts"], event_id))
+        if position < len(self._index) and self._index[position] == (event["_start_ts"], event_id):
+            del self._index[position]
+
+    def _apply(self, items: list[dict]) -> tuple[list[dict], list[str]]:
+        if items:
+            self.version += 1
+        upserted, removed = [], []
+        for item in items:
+            if item.get("status") == "cancelled" or "start" not in item or self._past_window(item):
+                self._drop(item["id"])
+                removed.append(item["id"])
+            else:
+                self._put(item)
+                upserted.append(item)
+        return upserted, removed
+
+    def _past_window(self, item: dict) -> bool:
+        return self.synced_until is not None and to_timestamp(item["start"], self.time_zone) >= self.synced_until
+
+    # -- sync ------------------------------------------------------------------------
+    def _list_all(self, service, **params) -> tuple[list[dict], str | None]:
+        items, page_token = [], None
+        while True:
+            response = service.events().list(
+                calendarId=self.calendar_id,
+                singleEvents=True,
+                maxResults=2500,
+                fields=EVENT_FIELDS,
+                pageToken=page_token,
+                **params,
+            ).execute()
+            self.time_zone = response.get("timeZone", self.time_zone)
+            items.extend(response.get("items", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return items, response.get("nextSyncToken")
+
+    def _full_sync(self, service):
+        now = time.time()
+        synced_from, synced_until = now - self.sync_days * 86400, now + self.sync_ahead_days * 86400
+        items, self.sync_token = self._list_all(service, timeMin=rfc3339(synced_from), timeMax=rfc3339(synced_until))
+        self.synced_from, self.synced_until = synced_from, synced_until
+        self._events.clear()
+        self._index.clear()
+        self._max_duration = 0.0
+        self.version += 1
+        upserted, removed = self._apply(items)
+        self.last_sync = time.time()
+        self.full_syncs += 1
+        self._dirty = False
+        self._save_db(upserted, removed, reset=True)
+
+    def _incremental_sync(self, service):
+        try:
+            items, sync_token = self._list_all(service, syncToken=self.sync_token)
+        except HttpError as error:
+            if error.resp.status == 410:
+                # The sync token expired; start over.
+                self._full_sync(service)
+                return
+            raise
+        self.sync_token = sync_token or self.sync_token
+        upserted, removed = self._apply(items)
+        self.last_sync = time.time()
+        self.incremental_syncs += 1
+        self._dirty = False
+        self._save_db(upserted, removed)
+
+    def staleness(self) -> float | None:
+        if self.last_sync is None:
+            return None
+        return time.time() - self.last_sync
+
+    def fresh(self) -> bool:
+        """Whether the store can answer without a sync, i.e. refresh() would do nothing."""
+        with self._lock:
+            return self.sync_token is not None and not self._dirty and self.staleness() <= self.max_staleness
+
+    def refresh(self, service):
+        """Bring the store up to date: full sync on first use, incremental sync when stale."""
+        with self._lock:
+            if self.sync_token is None:
+                self.misses += 1
+                self._full_sync(service)
+            elif self._dirty or self.staleness() > self.max_staleness:
+                self.misses += 1
+                self._incremental_sync(service)
+            else:
+                self.hits += 1
+
+    # -- public API ------------------------------------------------------------------
+    def iter_range(self, service, time_min: str, time_max: str) -> Iterator[dict]:
+        """Lazily yield compact records of events overlapping [time_min, time_max), by start time."""
+        self.refresh(service)
+        start, end = parse_bound(time_min), parse_bound(time_max)
+        if start < self.synced_from or end > self.synced_until:
+            yield from iter_events(service, time_min, time_max, self.calendar_id)
+            return
+        with self._lock:
+            # Nothing starting more than the longest event's duration before `start` can reach it.
+            first = bisect.bisect_left(self._index, (start - self._max_duration, ""))
+            stop = bisect.bisect_left(self._index, (end, ""), first)
+            event_ids = [event_id for _, event_id in self._index[first:stop]]
+        for event_id in event_ids:
+            event = self._events.get(event_id)
+            if event is not None and event["_end_ts"] > start:
+                yield compact_event(event)
+
+    def query(self, service, time_min: str, time_max: str) -> list[dict]:
+        return list(self.iter_range(service, time_min, time_max))
+
+    def record_write(self, event: dict):
+        """Apply an event returned by insert/update without another round trip."""
+        with self._lock:
+            if event.get("recurrence"):
+                # Recurring masters are listed as expanded instances with different ids;
+                # let the next incremental sync pick those up instead.
+                self._dirty = True
+                self.version += 1
+                return
+            upserted, removed = self._apply([event])
+            self._save_db(upserted, removed)
+
+    def record_delete(self, event_id: str):
+        with self._lock:
+            self._drop(event_id)
+            self.version += 1
+            self._save_db([], [event_id])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calendar_id": self.calendar_id,
+                "events": len(self._events),
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "full_syncs": self.full_syncs,
+                "incremental_syncs": self.incremental_syncs,
+                "staleness_seconds": self.staleness(),
+            }
+
+
+_stores: OrderedDict[tuple[str, str], EventStore] = OrderedDict()
+_stores_lock = threading.Lock()
+_evictions = 0
+
+
+def reset_event_stores():
+    """Forget every store (and its sync token); the next query does a full sync."""
+    with _stores_lock:
+        _stores.clear()
+
+
+def get_event_store(creds, calendar_id: str = "primary") -> EventStore:
+    global _evictions
+    key = (credential_key(creds), calendar_id)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = EventStore(key[0], calendar_id, db_path=EVENT_STORE_DB)
+            _stores[key] = store
+            if len(_stores) > EVENT_STORE_MAX_STORES:
+                _stores.popitem(last=False)
+                _evictions += 1
+        _stores.move_to_end(key)
+        return store
+
+
+def event_store_stats() -> dict:
+    """Totals over the stores in memory, for /health."""
+    with _stores_lock:
+        stores = list(_stores.values())
+        evictions = _evictions
+    totals = {"stores": len(stores), "evictions": evictions}
+    for stats in (store.stats() for store in stores):
+        for name in ("events", "hits", "misses", "full_syncs", "incremental_syncs"):
+            totals[name] = totals.get(name, 0) + stats[name]
+    return totals
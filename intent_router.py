@@ -0,0 +1,125 @@
+import logging
+import os
+import re
+from datetime import date
+
+from langchain_openai import ChatOpenAI
+
+from envelopes import IntentChoice
+from response_cache import date_ranges, normalise
+from telemetry import metrics, span
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+# Small model asked when the rules can't tell; unset: such messages get the full agent.
+ROUTER_MODEL = os.getenv("ROUTER_MODEL")
+
+CHIT_CHAT, READ, WRITE, TODO, FULL = "chit_chat", "read", "write", "todo", "full"
+
+ROUTER_PROMPT = """Classify the user's message to a calendar assistant.
+chit_chat: greetings, thanks, small talk, questions about the assistant.
+read: questions about existing events or free time.
+write: create, move, update or delete one or a few specific events.
+todo: a list of tasks to fit into the day, without fixed times."""
+
+_GREETING = re.compile(
+    r"^(hi|hello|hey|hiya|yo|thanks|thank you|thx|ty|cheers|ok|okay|cool|great|nice|perfect|awesome|bye|goodbye"
+    r"|good (morning|afternoon|evening|night)|how are you|who are you|what can you do|help)\b"
+)
+# An explicit list: "my to-do list", "my tasks", "plan my day"; a bare "to do" is just a verb.
+_TODO = re.compile(
+    r"\b((to ?-?do|todo) list|todos|my tasks|these tasks|errands|plan my (day|morning|afternoon|evening|week)"
+    r"|fit (these|them) in)\b"
+)
+# A list under a heading, e.g. "Todo tomorrow: write report, gym, call mom".
+_TODO_HEADING = re.compile(r"^\s*(to ?-?dos?|tasks)\b[^:\n]{0,30}:\s*\S", re.IGNORECASE)
+# Replies that only confirm what the assistant just asked about ("ok go ahead", "yes, do it").
+_AFFIRMATION = re.compile(
+    r"^(yes|yeah|yep|sure|ok|okay|alright|fine|perfect|great|sounds good|please|go ahead|do it|confirm|correct"
+    r"|that works)\b"
+)
+# Verbs that add something new to the calendar, as opposed to changing what is there.
+_CREATE = re.compile(r"\b(create|add|schedule|book|set up|put|fit)\b")
+_WRITE = re.compile(
+    r"\b(create|add|(?<!my )(?<!the )schedule|book|set up|make|move|reschedule|push|shift|change|update|edit|rename|delete"
+    r"|remove|cancel|clear|invite|remind|put)\b"
+)
+_READ = re.compile(
+    r"\b(what|whats|show|list|tell me|any|do i have|have i got|am i|is there|are there|how many|how busy|when"
+    r"|check)\b"
+)
+_TOPIC = re.compile(
+    r"\b(events?|meetings?|calendar|schedule|agenda|plans|appointments?|busy|free|available|availability"
+    r"|anything on|call|lunch|dinner)\b"
+)
+# Lines that look like list items ("- buy milk", "2. call mom").
+_LIST_ITEM = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+\S", re.MULTILINE)
+_CLOCK_TIME = re.compile(r"\b\d{1,2}(:\d{2})?\s*(am|pm)\b|\b\d{1,2}:\d{2}\b|\b(noon|midnight)\b", re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+def classify(text: str) -> str | None:
+    """The message's intent by keyword rules, or None if they can't tell."""
+    if len(_LIST_ITEM.findall(text)) >= 2 or _TODO_HEADING.search(text):
+        return TODO
+    words = normalise(text)
+    if _TODO.search(words):
+        return TODO
+    if _CREATE.search(words) and len(re.findall(r"[,;]|\band\b", text.lower())) >= 2 and not _CLOCK_TIME.search(text):
+        # Several new things and no times: tasks to place ("Schedule gym, groceries and laundry today") or one
+        # event with several guests ("Schedule a meeting with Bob, Alice and Carol tomorrow"). The rules can't
+        # tell, and the WRITE prompt can't ask for scheduling, so leave it to the model or the full agent.
+        return None
+    if _WRITE.search(words):
+        return WRITE
+    if _READ.search(words) and (_TOPIC.search(words) or date_ranges(words, date.today())):
+        return READ
+    if _GREETING.search(words) and len(words.split()) <= 6 and not _TOPIC.search(words):
+        return CHIT_CHAT
+    return None
+
+
+# ------------------------------------------------------------------------------
+# Intent router
+#
+#    The first node of the graph. Most messages are sorted by the keyword rules
+#    above in microseconds; only what they can't place is sent to ROUTER_MODEL, a
+#    small model that answers with an IntentChoice. Each intent then runs with the
+#    smallest prompt, toolset and model tier that can serve it (AGENT_PROFILES in
+#    chatbot_with_todo.py): chit-chat never reaches the calendar agent, reads use
+#    the fast model and two read-only tools, and only to-do lists get the full
+#    scheduling prompt. Decisions are counted in route_total{intent, source}.
+# ------------------------------------------------------------------------------
+class IntentRouter:
+    def __init__(self, model_name: str | None = ROUTER_MODEL):
+        self.model = None
+        if model_name:
+            self.model = ChatOpenAI(model=model_name, temperature=0).with_structured_output(
+                IntentChoice, method="json_schema", strict=True
+            )
+
+    def route(self, text: str, config=None, asked: str | None = None) -> str:
+        """The message's intent; `asked` is the previous turn's intent when its reply asked the user something.
+
+        A short "ok, go ahead" to such a question carries on with that turn's work
+        instead of being taken as chit-chat.
+        """
+        source, intent = "rules", classify(text)
+        if intent is None and self.model is not None:
+            source = "model"
+            try:
+                with span("router", "intent_model"):
+                    intent = self.model.invoke([("system", ROUTER_PROMPT), ("human", text)], config=config).intent
+            except Exception as e:
+                logger.warning("Intent model failed, using the full agent: %s", e)
+                intent = None
+        if intent is None:
+            source, intent = "fallback", FULL
+        if intent == CHIT_CHAT and asked is not None and _AFFIRMATION.search(normalise(text)):
+            source, intent = "follow_up", asked if asked != CHIT_CHAT else FULL
+        metrics.inc("route_total", {"intent": intent, "source": source})
+        logger.debug("Routed %r to %s (%s)", text[:80], intent, source)
+        return intent
+
+
+intent_router = IntentRouter()
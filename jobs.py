@@ -0,0 +1,397 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+from cryptography.fernet import Fernet, InvalidToken
+from google.oauth2.credentials import Credentials
+from langchain_core.messages import HumanMessage
+from langgraph.types import StateSnapshot
+
+from chatbot_with_todo import SCOPES, extract_response, get_workflow, stream_chatbot
+from envelopes import json_objects, parse_schedule
+from ollama_manager import PRIORITY_BACKGROUND
+from telemetry import metrics
+
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1") == "1"
+JOB_DB = os.getenv("JOB_DB", "jobs.sqlite")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# A failed attempt runs again after this many seconds times the attempt number.
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "5"))
+JOB_TTL_HOURS = float(os.getenv("JOB_TTL_HOURS", "168"))
+# How often the Streamlit page refreshes a running job's progress.
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+# A running job belongs to its process for this long after the process's last heartbeat.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+# Fernet key (Fernet.generate_key()) for the credentials stored with queued jobs; set it
+# to the same value for every process sharing JOB_DB, or jobs only run where they were queued.
+JOB_CREDENTIALS_KEY = os.getenv("JOB_CREDENTIALS_KEY")
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+# A running job's stage: the scheduler plans the tasks, then the calendar agent creates them.
+SCHEDULING, CREATING = "scheduling", "creating"
+# The chat runs a turn up to these nodes and leaves the rest to a job.
+BACKGROUND_NODES = ["scheduler"] if JOBS_ENABLED else []
+_COLUMNS = ("id", "thread_id", "message", "status", "stage", "tasks", "response", "error", "attempts", "created", "updated")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    id: str
+    thread_id: str
+    message: str
+    status: str = QUEUED
+    stage: str = QUEUED
+    # One entry per task: summary, status ("pending", "created", "already_created" or "error"), and start_time or link.
+    tasks: list[dict] = field(default_factory=list)
+    response: str | None = None
+    error: str | None = None
+    attempts: int = 0
+    created: float = 0.0
+    updated: float = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "finished": self.finished}
+
+
+def runs_in_background(snapshot: StateSnapshot) -> bool:
+    """Whether the rest of the turn goes to the job queue: the graph stopped before the scheduler."""
+    return JOBS_ENABLED and tuple(snapshot.next) == ("scheduler",)
+
+
+def turn_message(messages: list) -> HumanMessage | None:
+    """The user message that started the thread's latest turn."""
+    return next((m for m in reversed(messages) if isinstance(m, HumanMessage) and m.name is None), None)
+
+
+class TurnIncomplete(Exception):
+    """The turn ended without its schedule created; a retry runs `node` again."""
+
+    def __init__(self, message: str, node: str, retryable: bool = True):
+        super().__init__(message)
+        self.node = node
+        self.retryable = retryable
+
+
+# The node that runs just before each node a retry starts from.
+_PREVIOUS_NODE = {"scheduler": "calendar", "calendar": "scheduler"}
+
+
+def check_turn(messages: list):
+    """Raise TurnIncomplete unless the scheduler answered with a schedule and the calendar agent replied to it.
+
+    The graph's nodes don't raise: a scheduler that fails answers {"error": ...}, and
+    a calendar agent that fails adds no message, so the turn still ends normally.
+    """
+    turn = max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage) and m.name is None)
+    answers = [i for i in range(turn + 1, len(messages)) if messages[i].name == "scheduler"]
+    if not answers:
+        raise TurnIncomplete("The scheduler did not answer", "scheduler")
+    error = next(json_objects(messages[answers[-1]].content), {}).get("error")
+    if isinstance(error, dict):
+        raise TurnIncomplete(error.get("message", "The scheduler failed"), "scheduler", error.get("retryable", True))
+    if not any(m.name == "calendar" for m in messages[answers[-1] + 1:]):
+        raise TurnIncomplete("The calendar agent did not reply to the schedule", "calendar")
+
+
+@functools.lru_cache(maxsize=None)
+def credentials_cipher() -> Fernet:
+    if JOB_CREDENTIALS_KEY:
+        return Fernet(JOB_CREDENTIALS_KEY)
+    logger.warning("JOB_CREDENTIALS_KEY is not set; background jobs can only run in the process that queued them")
+    return Fernet(Fernet.generate_key())
+
+
+def seal_credentials(creds) -> str | None:
+    return credentials_cipher().encrypt(creds.to_json().encode()).decode() if creds is not None else None
+
+
+def open_credentials(sealed: str | None):
+    """The credentials seal_credentials() stored, or None if they are gone or were sealed with another key."""
+    if not sealed:
+        return None
+    try:
+        info = json.loads(credentials_cipher().decrypt(sealed.encode()))
+    except InvalidToken:
+        return None
+    try:
+        return Credentials.from_authorized_user_info(info, SCOPES)
+    except ValueError:
+        # A bare access token works until it expires.
+        return Credentials(token=info.get("token"))
+
+
+# ------------------------------------------------------------------------------
+# Background scheduling jobs
+#
+#    A to-do list turn runs calendar agent -> local scheduler -> calendar agent ->
+#    create_events, which can take minutes with deepseek-r1. The chat runs the turn
+#    with interrupt_before=BACKGROUND_NODES, so it stops once the calendar agent has
+#    actually routed it to the scheduler, and submits the stopped turn here: the job
+#    is stored in SQLite, a worker resumes the turn from that checkpoint on the
+#    conversation's thread, and the chat polls get()/wait() for its stage and
+#    per-task progress (reported by the Calendar tools through
+#    configurable["progress"]). The chat takes no new message on the thread while
+#    active() returns a job for it, so the job is the only run on that checkpoint
+#    thread, and a job whose thread has moved on to another turn fails instead of
+#    resuming it. A browser refresh loses nothing.
+#
+#    Every event a job creates gets an id derived from the job id
+#    (event_handler.idempotent_event_id), so a retried attempt can't add an event
+#    twice, and a retry resumes from the last checkpoint, so the schedule isn't
+#    planned again. A turn that ends without its schedule created (the scheduler
+#    answered with an error, or the calendar agent didn't reply) is retried from
+#    just before the step that failed. Jobs use the local model at background
+#    priority, behind interactive turns. The Google credentials a queued job needs
+#    are stored encrypted with JOB_CREDENTIALS_KEY and dropped once it finishes.
+#
+#    Several processes may share one JOB_DB. A running job is leased to the process
+#    running it, which renews the lease every JOB_LEASE_SECONDS / 3; only a job
+#    whose lease has expired (its process stopped mid-turn) is queued again.
+# ------------------------------------------------------------------------------
+class JobQueue:
+    def __init__(self, path: str = JOB_DB, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 lease_seconds: float = JOB_LEASE_SECONDS):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.graph = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, thread_id TEXT NOT NULL, message TEXT NOT NULL, "
+            "credentials TEXT, status TEXT NOT NULL, stage TEXT NOT NULL, tasks TEXT NOT NULL, response TEXT, "
+            "error TEXT, attempts INTEGER NOT NULL, created REAL NOT NULL, updated REAL NOT NULL, "
+            "owner TEXT, lease_expires REAL)"
+        )
+        for column in ("owner TEXT", "lease_expires REAL"):
+            try:
+                self._execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass  # Already there.
+        self._execute("CREATE INDEX IF NOT EXISTS jobs_by_thread ON jobs (thread_id, status)")
+
+    def _execute(self, sql: str, params: tuple = ()) -> tuple[list[tuple], int]:
+        with self._changed, self._conn:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall()
+            if cursor.rowcount > 0:
+                self._changed.notify_all()
+            return rows, cursor.rowcount
+
+    def start(self, graph=None) -> "JobQueue":
+        """Start the workers and the lease heartbeat, and pick up jobs no live process holds; later calls do nothing."""
+        with self._lock:
+            if self._executor is not None:
+                return self
+            self.graph = graph or get_workflow()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        self._execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                      (DONE, FAILED, time.time() - JOB_TTL_HOURS * 3600))
+        # Stored by an earlier version without encryption.
+        self._execute("UPDATE jobs SET credentials = NULL WHERE credentials LIKE '{%'")
+        rows, _ = self._execute("SELECT id FROM jobs WHERE status = ? ORDER BY created", (QUEUED,))
+        rows += self._requeue_expired()
+        if rows:
+            logger.info("Resuming %d unfinished jobs", len(rows))
+        for (job_id,) in rows:
+            self._executor.submit(self._run, job_id)
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+        return self
+
+    def _requeue_expired(self) -> list[tuple]:
+        """Queue the running jobs whose process stopped renewing their lease; their ids."""
+        rows, _ = self._execute("SELECT id FROM jobs WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?)",
+                                (RUNNING, time.time()))
+        for (job_id,) in rows:
+            self._execute("UPDATE jobs SET status = ?, owner = NULL WHERE id = ? AND status = ?", (QUEUED, job_id, RUNNING))
+        return rows
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                self._execute("UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status = ?",
+                              (time.time() + self.lease_seconds, self.owner, RUNNING))
+                for (job_id,) in self._requeue_expired():
+                    logger.info("Job %s lost its process; running it again", job_id)
+                    self._executor.submit(self._run, job_id)
+            except sqlite3.Error as e:
+                logger.warning("Job heartbeat failed: %s", e)
+
+    def submit(self, snapshot: StateSnapshot, creds) -> Job:
+        """Queue the rest of the turn `snapshot` stopped at (see runs_in_background).
+
+        The job id is derived from the thread and checkpoint, so submitting the same
+        stopped turn again returns the existing job instead of running it twice.
+        """
+        if self._executor is None:
+            raise RuntimeError("JobQueue.start() has not been called")
+        configurable = snapshot.config["configurable"]
+        thread_id, now = configurable["thread_id"], time.time()
+        job_id = hashlib.sha256(f"{thread_id}|{configurable['checkpoint_id']}".encode()).hexdigest()[:32]
+        message = turn_message(snapshot.values.get("messages", []))
+        _, inserted = self._execute(
+            "INSERT OR IGNORE INTO jobs (id, thread_id, message, credentials, status, stage, tasks, attempts, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, '[]', 0, ?, ?)",
+            (job_id, thread_id, message.content if message else "", seal_credentials(creds), QUEUED, QUEUED, now, now),
+        )
+        if inserted > 0:
+            metrics.inc("jobs_total", {"status": "submitted"})
+            self._executor.submit(self._run, job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Job | None:
+        rows, _ = self._execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,))
+        return _job(rows[0]) if rows else None
+
+    def active(self, thread_id: str) -> Job | None:
+        """The conversation's unfinished job; the chat takes no new message on the thread while there is one."""
+        rows, _ = self._execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE thread_id = ? AND status IN (?, ?) ORDER BY created LIMIT 1",
+            (thread_id, QUEUED, RUNNING),
+        )
+        return _job(rows[0]) if rows else None
+
+    def wait(self, job_id: str, after: float = 0.0, timeout: float | None = None) -> Job | None:
+        """The job as soon as it changes after `after` (its `updated` time) or has finished; as it is after `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job.finished or job.updated > after:
+                return job
+            remaining = 1.0 if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._changed:
+                # Also wakes up once a second, for changes another process made.
+                self._changed.wait(min(remaining, 1.0))
+
+    def stats(self) -> dict:
+        rows, _ = self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        return {"workers": self.workers, **dict(rows)}
+
+    def _update(self, job_id: str, **fields):
+        fields["updated"] = time.time()
+        if "tasks" in fields:
+            fields["tasks"] = json.dumps(fields["tasks"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _claim(self, job_id: str) -> Job | None:
+        """Take a queued job for this process, or None if it isn't queued (another worker or process has it)."""
+        now = time.time()
+        _, claimed = self._execute(
+            "UPDATE jobs SET status = ?, stage = ?, attempts = attempts + 1, owner = ?, lease_expires = ?, updated = ? "
+            "WHERE id = ? AND status = ?",
+            (RUNNING, SCHEDULING, self.owner, now + self.lease_seconds, now, job_id, QUEUED),
+        )
+        return self.get(job_id) if claimed > 0 else None
+
+    def _finish(self, job_id: str, status: str, **fields):
+        # The credentials are only kept while the job may still need them.
+        self._update(job_id, status=status, stage=status, credentials=None, owner=None, **fields)
+
+    def _check(self, config: dict, messages: list, attempt: int):
+        """check_turn(); if another attempt will follow, first rewind the thread to just before the failed node."""
+        try:
+            check_turn(messages)
+        except TurnIncomplete as e:
+            if e.retryable and attempt < self.max_attempts:
+                before = next(state for state in self.graph.get_state_history(config) if state.next == (e.node,))
+                # A new checkpoint on top of that one, so the retry resumes there instead of at the end of the turn.
+                self.graph.update_state(before.config, {"messages": []}, as_node=_PREVIOUS_NODE[e.node])
+            raise
+
+    def _run(self, job_id: str):
+        job = self._claim(job_id)
+        if job is None:
+            return
+        rows, _ = self._execute("SELECT credentials FROM jobs WHERE id = ?", (job_id,))
+        attempt, started = job.attempts, time.perf_counter()
+        tasks = {task["summary"]: task for task in job.tasks}
+        tasks_lock = threading.Lock()
+
+        def progress(result: dict):
+            with tasks_lock:
+                tasks[result["summary"]] = {**tasks.get(result["summary"], {}), **result}
+                self._update(job_id, stage=CREATING, tasks=list(tasks.values()))
+
+        config = {"configurable": {"thread_id": job.thread_id}}
+        configurable = {"idempotency_key": job_id, "progress": progress, "model_priority": PRIORITY_BACKGROUND}
+        try:
+            snapshot = self.graph.get_state(config)
+            messages = snapshot.values.get("messages", [])
+            message = turn_message(messages)
+            creds = open_credentials(rows[0][0])
+            if message is None or message.content != job.message:
+                # Never resume a turn that isn't this job's.
+                self._finish(job_id, FAILED, error="The conversation moved on before the job could finish")
+                status = FAILED
+            elif not snapshot.next:
+                # An earlier attempt finished the turn but stopped before recording it.
+                self._check(config, messages, attempt)
+                self._finish(job_id, DONE, response=extract_response(messages[-1].content), error=None)
+                status = DONE
+            elif creds is None:
+                self._finish(job_id, FAILED, error="The job's Google credentials are no longer available; send the request again")
+                status = FAILED
+            else:
+                response = None
+                # Carries on from the turn's last checkpoint, e.g. with the schedule already planned on a retry.
+                for event in stream_chatbot(self.graph, None, creds, job.thread_id, configurable):
+                    if event["type"] == "node" and event["node"] == "scheduler":
+                        schedule = parse_schedule(self.graph.get_state(config).values["messages"][-1].content)
+                        with tasks_lock:
+                            for task in schedule.tasks if schedule is not None else []:
+                                tasks.setdefault(task.summary, {"summary": task.summary, "status": "pending",
+                                                                "start_time": task.start_time})
+                            self._update(job_id, stage=CREATING, tasks=list(tasks.values()))
+                    elif event["type"] == "final":
+                        self._check(config, event["state"].values["messages"], attempt)
+                        response = extract_response(event["state"].values["messages"][-1].content)
+                self._finish(job_id, DONE, response=response, error=None)
+                status = DONE
+        except Exception as e:
+            logger.exception("Job %s failed (attempt %d of %d): %s", job_id, attempt, self.max_attempts, e)
+            if attempt < self.max_attempts and getattr(e, "retryable", True):
+                self._update(job_id, status=QUEUED, owner=None, error=str(e))
+                retry = threading.Timer(JOB_RETRY_SECONDS * attempt, self._executor.submit, (self._run, job_id))
+                retry.daemon = True
+                retry.start()
+                status = "retried"
+            else:
+                self._finish(job_id, FAILED, error=str(e))
+                status = FAILED
+        metrics.inc("jobs_total", {"status": status})
+        metrics.observe("job_duration_seconds", time.perf_counter() - started, {"status": status})
+
+
+def _job(row: tuple) -> Job:
+    values = dict(zip(_COLUMNS, row))
+    return Job(**{**values, "tasks": json.loads(values["tasks"])})
+
+
+@functools.lru_cache(maxsize=None)
+def get_job_queue(path: str = JOB_DB) -> JobQueue:
+    """One job queue per process and database; call start() before submitting."""
+    return JobQueue(path)
@@ -1,87 +1,37 @@
 import streamlit as st
+import logging
 import os
-from PIL import Image
-import io
-from chatbot_with_todo import get_workflow, run_chatbot
-from langchain_core.messages import AIMessage, HumanMessage
-import pickle
-import json
+from chatbot_with_todo import extract_response, get_workflow, run_chatbot
+from checkpointer import make_thread_id
+from calendar_service import credential_key
+import uuid
+from langchain_core.messages import HumanMessage
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from streamlit_extras.stylable_container import stylable_container
-import sounddevice as sd
-import scipy.io.wavfile as wav
-import numpy as np
-import tempfile
-from openai import OpenAI
-import queue
+from typing import Iterator
+from envelopes import parse_reply
+from streaming import JsonFieldStreamer
+from audio_capture import AudioRecorder, transcribe_audio
+from text_to_speech import Speaker
+from telemetry import configure_logging, last_trace
+from ollama_manager import ollama_manager
+from jobs import BACKGROUND_NODES, DONE, JOB_POLL_SECONDS, get_job_queue, runs_in_background
 
 TOKEN_FILE = "token.json"
 CLIENT_SECRET_FILE = "credentials.json"
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
+configure_logging()
+logger = logging.getLogger(__name__)
 
 
-class AudioRecorder:
-    def __init__(self):
-        self.fs = 44100  # Sample rate
-        self.recording = False
-        self.audio_queue = queue.Queue()
-        
-    def callback(self, indata, frames, time, status):
-        if self.recording:
-            self.audio_queue.put(indata.copy())
-    
-    def start_recording(self):
-        self.recording = True
-        self.audio_data = []
-        self.stream = sd.InputStream(
-            samplerate=self.fs,
-            channels=1,
-            callback=self.callback
-        )
-        self.stream.start()
-    
-    def stop_recording(self):
-        self.recording = False
-        self.stream.stop()
-        self.stream.close()
-        
-        # Combine all audio data
-        while not self.audio_queue.empty():
-            self.audio_data.append(self.audio_queue.get())
-        
-        if not self.audio_data:
-            return None
-            
-        audio_data = np.concatenate(self.audio_data, axis=0)
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-        wav.write(temp_file.name, self.fs, audio_data)
-        return temp_file.name
-
-def transcribe_audio(audio_file_path):
-    client = OpenAI()
-    with open(audio_file_path, "rb") as audio_file:
-        transcription = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file
-        )
-    return transcription.text
-
-def speak_text(text):
-    client = OpenAI()
-    speech_file_path = "speech.mp3"
-    response = client.audio.speech.create(
-        model="tts-1",
-        voice="nova",
-        input=text,
-    )
-    response = response.read()
-    st.audio(response, format="audio/wav", autoplay=True)
-
-    # audio_file = open(speech_file_path, "rb")
-    # audio_bytes = audio_file.read()
-    # return audio_bytes
+def new_speaker() -> Speaker:
+    """Speaker for the next reply; one still talking from the previous reply is cut off."""
+    if st.session_state.get("speaker") is not None:
+        st.session_state.speaker.stop()
+    st.session_state.speaker = Speaker()
+    return st.session_state.speaker
 
 
 # Configure page settings with dark theme support
@@ -133,6 +83,10 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+def current_thread_id() -> str:
+    user_id = credential_key(st.session_state.get("creds"))
+    return make_thread_id(user_id, st.session_state.session_id)
+
 def initialize_session_state():
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -140,8 +94,16 @@ def initialize_session_state():
     #     st.session_state.selected_model = "Google Calendar Agent"
     if "graph" not in st.session_state:
         st.session_state.graph = get_workflow() 
+        # Load the local scheduler model while the user is still typing (once per process).
+        ollama_manager.preload_in_background()
+        # Workers for to-do lists, which run in the background (once per process).
+        get_job_queue().start()
+    if "session_id" not in st.session_state:
+        # Kept in the URL so a browser refresh resumes the same conversation.
+        st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+        st.query_params["session"] = st.session_state.session_id
     if "config" not in st.session_state:
-        st.session_state.config = {"configurable": {"thread_id": "1"}}
+        st.session_state.config = {"configurable": {"thread_id": current_thread_id()}}
     if "state" not in st.session_state:
         st.session_state.state = st.session_state.graph.get_state(config=st.session_state.config)
     if "authenticated" not in st.session_state:
@@ -152,63 +114,163 @@ def initialize_session_state():
         st.session_state.transcribed_text = None
     if "recording_icon" not in st.session_state:
         st.session_state.recording_icon = ":material/mic:"
+    if "job_id" not in st.session_state:
+        st.session_state.job_id = None
 
-class AudioRecorder:
-    def __init__(self):
-        self.fs = 44100  # Sample rate
-        self.recording = False
-        self.audio_queue = queue.Queue()
-        
-    def callback(self, indata, frames, time, status):
-        if self.recording:
-            self.audio_queue.put(indata.copy())
-    
-    def start_recording(self):
-        self.recording = True
-        self.audio_data = []
-        self.stream = sd.InputStream(
-            samplerate=self.fs,
-            channels=1,
-            callback=self.callback
-        )
-        self.stream.start()
-    
-    def stop_recording(self):
-        self.recording = False
-        self.stream.stop()
-        self.stream.close()
-        
-        # Combine all audio data
-        while not self.audio_queue.empty():
-            self.audio_data.append(self.audio_queue.get())
-        
-        if not self.audio_data:
-            return None
-            
-        audio_data = np.concatenate(self.audio_data, axis=0)
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-        wav.write(temp_file.name, self.fs, audio_data)
-        return temp_file.name
+def chat_history(messages: list) -> list[dict]:
+    """The checkpointed conversation as the chat shows it: each user message and the reply that ended its turn."""
+    history = []
+    for message in messages:
+        if isinstance(message, HumanMessage) and message.name is None:
+            history.append({"role": "user", "content": message.content})
+        elif message.name == "calendar" and (text := extract_response(message.content)):
+            # A turn's later calendar messages (after the scheduler) replace its earlier ones.
+            if history and history[-1]["role"] == "assistant":
+                history[-1]["content"] = text
+            else:
+                history.append({"role": "assistant", "content": text})
+    return history
+
+# The graph's checkpointer keeps the conversation history, so only the new user
+# message is sent in; resending the history would store it again.
+def stream_message(message, creds) -> Iterator[dict]:
+    for event in run_chatbot(st.session_state.graph, {"messages": [HumanMessage(message)]}, creds, stream=True,
+                             thread_id=current_thread_id(), interrupt_before=BACKGROUND_NODES):
+        if event["type"] == "final":
+            st.session_state.state = event["state"]
+            if runs_in_background(event["state"]):
+                # The calendar agent sent the turn to the scheduler; a job finishes it.
+                st.session_state.job_id = get_job_queue().submit(event["state"], creds).id
+        yield event
+
+NODE_STATUS = {
+    "calendar": "Checking your calendar...",
+    "scheduler": "Planning your schedule...",
+}
+
+JOB_STATUS = {
+    "queued": "Waiting for a free worker...",
+    "scheduling": "Planning your schedule...",
+    "creating": "Adding your tasks to the calendar...",
+}
+TASK_ICONS = {"pending": "⏳", "created": "✅", "already_created": "✅", "error": "⚠️"}
 
-def transcribe_audio(audio_file_path):
-    client = OpenAI()
-    with open(audio_file_path, "rb") as audio_file:
-        transcription = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file
-        )
-    return transcription.text
+# Turns that go to the scheduler (to-do lists) finish as background jobs (jobs.py): the page
+# only polls their progress, so it stays responsive, and a refresh picks the job up again
+# from the session in the URL. The input is disabled until the job is done.
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_job_progress():
+    """The conversation's running job: its stage and each task's status, refreshed every JOB_POLL_SECONDS."""
+    job = get_job_queue().get(st.session_state.job_id) if st.session_state.job_id else None
+    if job is None:
+        return
+    if job.finished:
+        st.session_state.job_id = None
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": job.response if job.status == DONE else f"Sorry, scheduling failed: {job.error}",
+        })
+        st.session_state.state = st.session_state.graph.get_state(config=st.session_state.config)
+        st.rerun()
+    with st.chat_message("assistant"):
+        st.caption(JOB_STATUS.get(job.stage, "Working..."))
+        for task in job.tasks:
+            st.markdown(f"{TASK_ICONS.get(task['status'], '•')} {task['summary']}")
 
-def process_message(message, creds) -> str:
-    if st.session_state.state.values == {}:
-        st.session_state.state.values["messages"] = [HumanMessage(message)]
-    else:
-        st.session_state.state.values["messages"].append(HumanMessage(message))
-    updated_state = run_chatbot(st.session_state.graph, st.session_state.state.values, creds)
-    st.session_state.state.values['messages'].append(updated_state.values["messages"][-1])
-    response = st.session_state.state.values["messages"][-1].content
+def render_streamed_response(message, creds, speaker: Speaker | None = None) -> str:
+    """Render the assistant reply token by token and return the final response text.
+
+    With a `speaker`, the reply is also read aloud sentence by sentence as it streams.
+    """
+    status = st.empty()
+    placeholder = st.empty()
+    streamer, message_id, response, spoken = None, None, "", ""
+    for event in stream_message(message, creds):
+        if event["type"] == "token" and event["node"] == "calendar":
+            # Every calendar model message is a new JSON envelope; only show its response_for_user.
+            if event["id"] != message_id:
+                message_id, streamer, spoken = event["id"], JsonFieldStreamer("response_for_user"), ""
+            new_text = streamer.feed(event["content"])
+            if new_text:
+                if speaker:
+                    speaker.feed(new_text)
+                    spoken += new_text
+                response = streamer.value
+                status.empty()
+                placeholder.markdown(response + "▌")
+        elif event["type"] == "token" and event["node"] == "chat":
+            # Chit-chat replies stream as plain text.
+            if speaker:
+                speaker.feed(event["content"])
+                spoken += event["content"]
+            response += event["content"]
+            status.empty()
+            placeholder.markdown(response + "▌")
+        elif event["type"] == "route" and event["next"] == "scheduler":
+            status.caption(NODE_STATUS["scheduler"])
+        elif event["type"] == "token":
+            status.caption(NODE_STATUS.get(event["node"], "Thinking..."))
+        elif event["type"] == "tool_call":
+            status.caption(f"Running {event['name']}...")
+        elif event["type"] == "final":
+            content = event["state"].values["messages"][-1].content
+            reply = parse_reply(content)
+            response = reply.response_for_user if reply is not None else response or content
+    if speaker:
+        # Speak whatever the stream didn't deliver (e.g. a reply that was not streamed).
+        if response.startswith(spoken):
+            speaker.feed(response[len(spoken):])
+        speaker.close()
+        if speaker.output == "browser":
+            st.audio(speaker.wav(), format="audio/wav", autoplay=True)
+    status.empty()
+    placeholder.markdown(response)
     return response
 
+def finish_recording():
+    recording = st.session_state.audio_recorder.stop_recording()
+    st.session_state.recording = False
+    st.session_state.recording_icon = ":material/mic:"
+    if recording:
+        with st.spinner(""):
+            transcript = transcribe_audio(recording)
+            logger.info("Voice input transcribed", extra={"fields": transcript.latency})
+            st.session_state.transcribed_text = transcript.text
+    st.rerun()
+
+def listen_until_silence(recorder: AudioRecorder):
+    """Wait for voice activity detection to end the recording; the stop button still works meanwhile."""
+    status = st.empty()
+    while not recorder.wait(timeout=0.25):
+        # Updating the page is also where Streamlit notices a click on the stop button.
+        status.caption(f"Listening... {recorder.elapsed():.0f}s, stops when you stop talking")
+    status.empty()
+    finish_recording()
+
+def render_turn_waterfall():
+    """Sidebar waterfall of the latest turn: nodes, model calls, tools and Calendar API requests."""
+    trace = last_trace(current_thread_id())
+    if trace is None:
+        st.sidebar.caption("No turn traced yet.")
+        return
+    rows = [
+        {**row, "label": f"{index:02d} {row['kind']}: {row['name']}", "end_ms": row["offset_ms"] + row["duration_ms"]}
+        for index, row in enumerate(trace.waterfall())
+    ]
+    st.sidebar.vega_lite_chart({
+        "data": {"values": rows},
+        "mark": "bar",
+        "encoding": {
+            "y": {"field": "label", "type": "nominal", "sort": None, "title": None},
+            "x": {"field": "offset_ms", "type": "quantitative", "title": "ms"},
+            "x2": {"field": "end_ms"},
+            "color": {"field": "kind", "type": "nominal"},
+            "tooltip": [{"field": field} for field in
+                        ("label", "duration_ms", "ttft_ms", "input_tokens", "output_tokens", "attempts", "error")],
+        },
+    }, use_container_width=True)
+    st.sidebar.caption(", ".join(f"{key} {value}" for key, value in trace.summary().items()))
+
 def authenticate():
     creds = None
     if os.path.exists(TOKEN_FILE):
@@ -230,6 +292,10 @@ def authenticate():
     
     st.session_state.authenticated = True
     st.session_state.creds = creds
+    st.session_state.config = {"configurable": {"thread_id": current_thread_id()}}
+    st.session_state.state = st.session_state.graph.get_state(config=st.session_state.config)
+    # After a browser refresh the session is new, but the conversation is still in the checkpointer.
+    st.session_state.messages = chat_history(st.session_state.state.values.get("messages", []))
 
 def main():
     try:
@@ -274,8 +340,13 @@ def main():
             """,
         ):
             col1, col2 = st.columns([1, 10])
+            if st.session_state.job_id is None:
+                job = get_job_queue().active(current_thread_id())
+                st.session_state.job_id = job.id if job is not None else None
+            # A job is still working on this conversation's thread.
+            busy = st.session_state.job_id is not None
             with col1:
-                if st.button(icon=st.session_state.recording_icon, label="", key="mic", type='primary'):
+                if st.button(icon=st.session_state.recording_icon, label="", key="mic", type='primary', disabled=busy):
                     if not st.session_state.recording:
                 # Start recording
                         st.session_state.recording = True
@@ -284,22 +355,14 @@ def main():
                         st.session_state.audio_recorder.start_recording()
                         st.rerun()
                     else:
-                        # Stop recording
-                        audio_file = st.session_state.audio_recorder.stop_recording()
-                        st.session_state.recording = False
-                        st.session_state.recording_icon = ":material/mic:"
-                        if audio_file:
-                            with st.spinner(""):
-                                transcription = transcribe_audio(audio_file)
-                                print(transcription)
-                                st.session_state.transcribed_text = transcription
-                                os.unlink(audio_file)  # Clean up temporary file
-                            st.rerun()
+                        finish_recording()
             with col2:
-                user_input = st.chat_input("Ask about your calendar...")       
+                user_input = st.chat_input("Ask about your calendar...", disabled=busy)
             
+        if st.session_state.recording:
+            listen_until_silence(st.session_state.audio_recorder)
         
-        if user_input or st.session_state.transcribed_text:
+        if not busy and (user_input or st.session_state.transcribed_text):
             if user_input:
                 text = user_input
                 audio = False
@@ -315,14 +378,20 @@ def main():
                 })
 
             with st.chat_message("assistant"):
-                response = json.loads(process_message(text, st.session_state.creds))['response_for_user']
-                if audio:
-                    speak_text(response)
-                st.markdown(response)
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": response
-            })
+                response = render_streamed_response(text, st.session_state.creds, speaker=new_speaker() if audio else None)
+                if response:
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": response
+                })
+            if st.session_state.job_id is not None:
+                # The turn went to a job; show its progress with the input disabled.
+                st.rerun()
+
+        render_job_progress()
+
+        if st.sidebar.toggle("Show turn timings"):
+            render_turn_waterfall()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
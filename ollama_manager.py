@@ -0,0 +1,199 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from langchain_ollama import ChatOllama
+from ollama import Client
+
+from telemetry import metrics
+
+SCHEDULER_MODEL = os.getenv("SCHEDULER_MODEL", "deepseek-r1:7b")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL")  # unset: OLLAMA_HOST or http://localhost:11434
+# How long Ollama keeps the model in memory after a request: "30m", seconds, or -1 for good.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "1") == "1"
+# Requests sent to Ollama at once; match the server's OLLAMA_NUM_PARALLEL.
+OLLAMA_MAX_CONCURRENT = int(os.getenv("OLLAMA_MAX_CONCURRENT", "1"))
+OLLAMA_QUEUE_SIZE = int(os.getenv("OLLAMA_QUEUE_SIZE", "8"))
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "60"))
+# A response whose model load took at least this long is counted as a cold start.
+COLD_START_SECONDS = 1.0
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+logger = logging.getLogger(__name__)
+
+
+def parse_keep_alive(value: str | int | float) -> str | int:
+    """Ollama takes a duration string ("30m") or a number of seconds (negative: forever)."""
+    if isinstance(value, str) and value.lstrip("-").isdigit():
+        return int(value)
+    return value
+
+
+class ModelBusy(Exception):
+    """The local model's queue is full, or a request waited in it longer than its timeout."""
+
+    def __init__(self, reason: str, retry_after: float | None = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def as_error(self) -> dict:
+        """The same {"error": ...} shape rate_limiter.classify_error gives the agents."""
+        error = {"category": "model_busy", "retryable": True, "message": f"The scheduling model is busy: {self.reason}"}
+        if self.retry_after is not None:
+            error["retry_after_seconds"] = round(self.retry_after, 1)
+        return {"error": error}
+
+
+# ------------------------------------------------------------------------------
+# Local model lifecycle
+#
+#    One ChatOllama client per process for the scheduler model. The model is
+#    loaded when the app starts (preload_in_background) and every request asks
+#    Ollama to keep it loaded for OLLAMA_KEEP_ALIVE, so a scheduling request
+#    after a quiet spell doesn't pay the multi-second load. Ollama serves one
+#    request at a time by default; instead of letting every user's request pile
+#    up inside it, callers take a slot() first. At most OLLAMA_MAX_CONCURRENT run,
+#    up to OLLAMA_QUEUE_SIZE wait (interactive turns ahead of background work),
+#    and anything beyond that, or waiting past its timeout, gets ModelBusy at once.
+# ------------------------------------------------------------------------------
+class OllamaModelManager:
+    def __init__(
+        self,
+        model: str = SCHEDULER_MODEL,
+        base_url: str | None = OLLAMA_BASE_URL,
+        keep_alive: str | int = OLLAMA_KEEP_ALIVE,
+        max_concurrent: int = OLLAMA_MAX_CONCURRENT,
+        max_queue: int = OLLAMA_QUEUE_SIZE,
+        queue_timeout: float = OLLAMA_QUEUE_TIMEOUT,
+    ):
+        self.model = model
+        self.keep_alive = parse_keep_alive(keep_alive)
+        self.llm = ChatOllama(model=model, base_url=base_url, keep_alive=self.keep_alive)
+        self.client = Client(host=base_url)
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._waiting: list[tuple[int, int]] = []  # heap of (priority, arrival)
+        self._arrivals = itertools.count()
+        self._preload_started = False
+        self.active = 0
+        self.served = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cold_starts = 0
+        self.preload_seconds: float | None = None
+
+    # -- loading -----------------------------------------------------------------------
+    def preload(self) -> float:
+        """Load the model into Ollama (an empty prompt loads without generating); returns seconds taken."""
+        started = time.perf_counter()
+        self.client.generate(model=self.model, prompt="", keep_alive=self.keep_alive)
+        self.preload_seconds = time.perf_counter() - started
+        metrics.observe("ollama_preload_seconds", self.preload_seconds, {"model": self.model})
+        return self.preload_seconds
+
+    def preload_in_background(self):
+        """preload() once per process, on a thread, so startup isn't held up by the model load."""
+        with self._cond:
+            if self._preload_started or not OLLAMA_PRELOAD:
+                return
+            self._preload_started = True
+        threading.Thread(target=self._preload_logged, name="ollama-preload", daemon=True).start()
+
+    def _preload_logged(self):
+        try:
+            logger.info("Preloaded %s in %.1fs", self.model, self.preload())
+        except Exception as e:
+            logger.warning("Could not preload %s: %s", self.model, e)
+
+    def record_response(self, message):
+        """Note the load and prefill times Ollama reports with a response; a slow load was a cold start."""
+        metadata = getattr(message, "response_metadata", None) or {}
+        if metadata.get("prompt_eval_duration") is not None:
+            # Short when the prompt's prefix was still in the KV cache from the previous request.
+            metrics.observe("ollama_prefill_seconds", metadata["prompt_eval_duration"] / 1e9, {"model": self.model})
+        load_ns = metadata.get("load_duration")
+        if load_ns is None:
+            return
+        metrics.observe("ollama_load_seconds", load_ns / 1e9, {"model": self.model})
+        if load_ns / 1e9 >= COLD_START_SECONDS:
+            with self._cond:
+                self.cold_starts += 1
+            metrics.inc("ollama_cold_starts_total", {"model": self.model})
+            logger.warning("Cold start: %s took %.1fs to load", self.model, load_ns / 1e9)
+
+    # -- admission -----------------------------------------------------------------------
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_INTERACTIVE, timeout: float | None = None) -> Iterator[None]:
+        """Hold one of the model's request slots for the block; lower priority values go first."""
+        self._acquire(priority, self.queue_timeout if timeout is None else timeout)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self.served += 1
+                self._publish()
+                self._cond.notify_all()
+
+    def _acquire(self, priority: int, timeout: float):
+        started = time.monotonic()
+        with self._cond:
+            if not self._waiting and self.active < self.max_concurrent:
+                self.active += 1
+                self._publish()
+                return
+            if len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                metrics.inc("ollama_rejected_total", {"model": self.model, "reason": "queue_full"})
+                raise ModelBusy(f"{len(self._waiting)} requests already waiting")
+            ticket = (priority, next(self._arrivals))
+            heapq.heappush(self._waiting, ticket)
+            self._publish()
+            try:
+                while not (self._waiting[0] == ticket and self.active < self.max_concurrent):
+                    remaining = started + timeout - time.monotonic()
+                    if remaining <= 0:
+                        self._waiting.remove(ticket)
+                        heapq.heapify(self._waiting)
+                        self.timeouts += 1
+                        metrics.inc("ollama_rejected_total", {"model": self.model, "reason": "timeout"})
+                        raise ModelBusy(f"no slot within {timeout:g}s", retry_after=timeout)
+                    self._cond.wait(remaining)
+                heapq.heappop(self._waiting)
+                self.active += 1
+            finally:
+                self._publish()
+                # The head of the queue may have changed; let the new head check for a slot.
+                self._cond.notify_all()
+        metrics.observe("ollama_queue_wait_seconds", time.monotonic() - started, {"model": self.model})
+
+    def _publish(self):
+        metrics.set("ollama_queue_depth", len(self._waiting), {"model": self.model})
+        metrics.set("ollama_active_requests", self.active, {"model": self.model})
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "model": self.model,
+                "active": self.active,
+                "queued": len(self._waiting),
+                "served": self.served,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "cold_starts": self.cold_starts,
+                "preload_seconds": None if self.preload_seconds is None else round(self.preload_seconds, 2),
+            }
+
+
+ollama_manager = OllamaModelManager()
@@ -0,0 +1,135 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from calendar_service import calendar_service
+from event_handler import fetch_events
+from event_store import EVENT_STORE_ENABLED, get_event_store, parse_bound
+from rate_limiter import CALENDAR_ERRORS
+from response_cache import date_ranges, normalise
+from slot_scheduler import DEFAULT_TIMEZONE
+from telemetry import metrics, span
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+# Messages naming more days than this ("next week") are not prefetched.
+PREFETCH_MAX_DAYS = int(os.getenv("PREFETCH_MAX_DAYS", "3"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+# A get_events call ending this close to the end of a prefetched day ("23:59") still matches it.
+END_SLACK_SECONDS = 120
+# Requests that usually begin by reading the day: questions about it and changes to existing events.
+_READS_DAY = re.compile(
+    r"\b(what|whats|show|list|any|do i have|have i got|when|move|reschedule|push|shift|change|update|edit"
+    r"|rename|delete|remove|cancel|clear)\b"
+)
+
+logger = logging.getLogger(__name__)
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="calendar-prefetch")
+
+
+# ------------------------------------------------------------------------------
+# Speculative day prefetch
+#
+#    Reading, moving or deleting an event starts with a get_events call for the
+#    whole day, one model turn after the user's message. While that first model
+#    call is in flight, the days the message names are already being fetched
+#    here; get_events then takes the prefetched result instead of making the
+#    request. The days are the user's, in the calendar's time zone, so they match
+#    the ranges the model asks for. A prefetch is only handed out while the
+#    calendar is unchanged since it was fetched (the event store's version), and
+#    one nobody asked for by the end of the calendar node counts as wasted.
+# ------------------------------------------------------------------------------
+class DayPrefetch:
+    def __init__(self, creds, days: list[date], tz: ZoneInfo):
+        self.creds = creds
+        self.days = days
+        self._lock = threading.Lock()
+        self._windows: dict[date, tuple[float, float]] = {}
+        self._futures: dict[date, Future] = {}
+        self._taken: set[date] = set()
+        for day in days:
+            start = datetime.combine(day, time(), tzinfo=tz)
+            end = start + timedelta(days=1)
+            self._windows[day] = (start.timestamp(), end.timestamp())
+            context = contextvars.copy_context()  # keeps the fetch's spans in the turn's trace
+            self._futures[day] = _executor.submit(context.run, self._fetch, start.isoformat(), end.isoformat())
+
+    def _fetch(self, start: str, end: str) -> tuple[list[dict] | dict, int]:
+        with span("prefetch", "get_events", day=start[:10]):
+            # The version is taken before the read, so a write landing during it makes the result stale
+            # instead of being missed; syncing first keeps the read's own sync from doing the same.
+            version = synced_version(self.creds)
+            events = fetch_events(self.creds, start, end)
+        return events, version
+
+    def take(self, start: str, end: str) -> list[dict] | None:
+        """The prefetched events if [start, end) is one of the prefetched days, else None."""
+        try:
+            window = (parse_bound(start), parse_bound(end))
+        except ValueError:
+            return None
+        for day, (day_start, day_end) in self._windows.items():
+            if window[0] == day_start and day_end - END_SLACK_SECONDS <= window[1] <= day_end:
+                break
+        else:
+            return None
+        with self._lock:
+            if day in self._taken:
+                return None
+            self._taken.add(day)
+        events, version = self._futures[day].result()
+        if isinstance(events, dict) or version != get_event_store(self.creds).version:
+            # Failed, or the calendar changed since: let get_events ask again.
+            metrics.inc("prefetch_total", {"outcome": "wasted"})
+            return None
+        metrics.inc("prefetch_total", {"outcome": "hit"})
+        return events
+
+    def close(self):
+        """Count the days nobody asked for; fetches that haven't started are dropped."""
+        with self._lock:
+            unused = [day for day in self.days if day not in self._taken]
+            self._taken.update(unused)
+        for day in unused:
+            self._futures[day].cancel()
+            metrics.inc("prefetch_total", {"outcome": "wasted"})
+        if unused:
+            logger.debug("Prefetched days not used: %s", [day.isoformat() for day in unused])
+
+
+def synced_version(creds) -> int:
+    """The event store's version once it is up to date; a failed sync is left for the read to report."""
+    store = get_event_store(creds)
+    if EVENT_STORE_ENABLED:
+        try:
+            with calendar_service(creds) as service:
+                store.refresh(service)
+        except CALENDAR_ERRORS:
+            pass
+    return store.version
+
+
+def calendar_timezone(creds) -> ZoneInfo:
+    """The calendar's time zone, known once its event store has synced; DEFAULT_TIMEZONE until then."""
+    try:
+        return ZoneInfo(get_event_store(creds).time_zone or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def start_prefetch(creds, text: str, tz: ZoneInfo | None = None) -> DayPrefetch | None:
+    """Start fetching the days `text` refers to (in `tz`, by default the calendar's), if it looks like a read."""
+    if not PREFETCH_ENABLED or not _READS_DAY.search(normalise(text)):
+        return None
+    tz = tz or calendar_timezone(creds)
+    days = []
+    for start, end in date_ranges(text, datetime.now(tz).date()):
+        days.extend(start + timedelta(days=offset) for offset in range((end - start).days))
+    days = sorted(set(days))
+    if not days or len(days) > PREFETCH_MAX_DAYS:
+        return None
+    return DayPrefetch(creds, days, tz)
@@ -0,0 +1,355 @@
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, TypeVar
+
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from telemetry import span
+
+CALENDAR_USER_QPS = float(os.getenv("CALENDAR_USER_QPS", "10"))
+CALENDAR_USER_BURST = float(os.getenv("CALENDAR_USER_BURST", "20"))
+CALENDAR_PROJECT_QPS = float(os.getenv("CALENDAR_PROJECT_QPS", "100"))
+CALENDAR_PROJECT_BURST = float(os.getenv("CALENDAR_PROJECT_BURST", "200"))
+CALENDAR_MAX_RETRIES = int(os.getenv("CALENDAR_MAX_RETRIES", "4"))
+CALENDAR_BACKOFF_BASE = float(os.getenv("CALENDAR_BACKOFF_BASE", "0.5"))
+CALENDAR_BACKOFF_MAX = float(os.getenv("CALENDAR_BACKOFF_MAX", "30"))
+# Longest a single call may wait for a token or a Retry-After before giving up.
+CALENDAR_MAX_WAIT = float(os.getenv("CALENDAR_MAX_WAIT", "15"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+QUOTA_REASONS = {"dailyLimitExceeded", "quotaExceeded"}
+TRANSPORT_ERRORS = (httplib2.HttpLib2Error, OSError)
+
+T = TypeVar("T")
+
+
+class CalendarUnavailable(Exception):
+    """A call refused locally, without reaching Google: the circuit is open or the queue is too long."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Calendar API {reason.replace('_', ' ')}, retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# Every error a Calendar tool can get back from the API layer.
+CALENDAR_ERRORS = (HttpError, CalendarUnavailable) + TRANSPORT_ERRORS
+
+
+def error_reason(error: HttpError) -> str:
+    """The Calendar `reason` code (e.g. rateLimitExceeded), if the error body has one."""
+    details = error.error_details
+    if isinstance(details, list) and details and isinstance(details[0], dict):
+        return details[0].get("reason", "")
+    return ""
+
+
+def retry_after(error: HttpError) -> float | None:
+    """Seconds from the Retry-After header, which may be a delay or an HTTP date."""
+    value = error.resp.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limited(error: HttpError) -> bool:
+    return error.resp.status == 429 or (error.resp.status == 403 and error_reason(error) in RATE_LIMIT_REASONS)
+
+
+def is_retryable(error: HttpError) -> bool:
+    return is_rate_limited(error) or error.resp.status >= 500
+
+
+# Calls that add something new each time they are sent, unless the body names the resource's id.
+NON_IDEMPOTENT_METHODS = {"calendar.events.insert", "calendar.events.quickAdd"}
+
+
+def is_idempotent(request: HttpRequest) -> bool:
+    """Whether sending `request` twice has the same effect as sending it once."""
+    if request.methodId not in NON_IDEMPOTENT_METHODS:
+        return True
+    try:
+        return bool(json.loads(request.body or "{}").get("id"))
+    except (TypeError, ValueError):
+        return False
+
+
+def classify_error(error: Exception) -> dict:
+    """Structured tool result for a failed call, so the model knows whether retrying can help."""
+    if isinstance(error, CalendarUnavailable):
+        return {"error": {
+            "category": error.reason,
+            "retryable": True,
+            "retry_after_seconds": round(error.retry_after),
+            "message": str(error),
+        }}
+    if not isinstance(error, HttpError):
+        return {"error": {"category": "network", "retryable": True, "message": str(error)}}
+    status, reason = error.resp.status, error_reason(error)
+    if is_rate_limited(error):
+        category = "rate_limited"
+    elif status >= 500:
+        category = "server_error"
+    elif status == 401:
+        category = "auth"
+    elif status == 403:
+        category = "quota_exceeded" if reason in QUOTA_REASONS else "forbidden"
+    elif status in (404, 410):
+        category = "not_found"
+    elif status == 409:
+        category = "conflict"
+    else:
+        category = "invalid_request"
+    result = {"category": category, "status": status, "retryable": is_retryable(error), "message": error.reason}
+    if reason:
+        result["reason"] = reason
+    if result["retryable"] and retry_after(error) is not None:
+        result["retry_after_seconds"] = round(retry_after(error))
+    return {"error": result}
+
+
+# ------------------------------------------------------------------------------
+# Calendar API rate limiting
+#
+#    Every Calendar request takes a token from its user's bucket and from the
+#    project-wide bucket (all users share one OAuth project's quota), waiting if
+#    either is empty. Rate-limit responses pause that user's bucket for a jittered
+#    exponential backoff (at least the Retry-After), server errors are retried the
+#    same way, and repeated server or network failures open a circuit breaker so
+#    calls fail fast instead of piling up while the API is down.
+# ------------------------------------------------------------------------------
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take `tokens` and return how long to wait before using them."""
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, tokens: float = 1):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def pause(self, seconds: float):
+        """Hold back every caller of this bucket for at least `seconds`."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; after `reset_seconds` one trial call is let through."""
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "open" if time.monotonic() - self.opened_at < self.reset_seconds else "half_open"
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0:
+                raise CalendarUnavailable("circuit_open", remaining)
+            # Half open: this call is the trial; everyone else waits another period.
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.opens += 1
+                self.opened_at = time.monotonic()
+
+
+class CalendarRateLimiter:
+    def __init__(
+        self,
+        user_qps: float = CALENDAR_USER_QPS,
+        user_burst: float = CALENDAR_USER_BURST,
+        project_qps: float = CALENDAR_PROJECT_QPS,
+        project_burst: float = CALENDAR_PROJECT_BURST,
+        max_retries: int = CALENDAR_MAX_RETRIES,
+        backoff_base: float = CALENDAR_BACKOFF_BASE,
+        backoff_max: float = CALENDAR_BACKOFF_MAX,
+        max_wait: float = CALENDAR_MAX_WAIT,
+        breaker: CircuitBreaker | None = None,
+        max_users: int = 1024,
+    ):
+        self.user_qps = user_qps
+        self.user_burst = user_burst
+        self.project = TokenBucket(project_qps, project_burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self.breaker = breaker or CircuitBreaker()
+        self.max_users = max_users
+        self._users: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.rejected = 0
+
+    def user_bucket(self, key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._users.get(key)
+            if bucket is None:
+                bucket = self._users[key] = TokenBucket(self.user_qps, self.user_burst)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            self._users.move_to_end(key)
+            return bucket
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def pause(self, key: str, seconds: float):
+        self.user_bucket(key).pause(seconds)
+
+    def acquire(self, key: str, cost: float = 1):
+        user = self.user_bucket(key)
+        wait = max(user.reserve(cost), self.project.reserve(cost))
+        if wait > self.max_wait:
+            user.refund(cost)
+            self.project.refund(cost)
+            with self._lock:
+                self.rejected += 1
+            raise CalendarUnavailable("rate_limited", wait)
+        if wait > 0:
+            with self._lock:
+                self.throttled += 1
+            time.sleep(wait)
+
+    def call(self, key: str, send: Callable[[], T], cost: float = 1, name: str = "request", idempotent: bool = True) -> T:
+        """Run `send` under user `key`'s rate limit, retrying rate-limit, server and network errors.
+
+        A server or network error may come after Google already applied the request,
+        so a call that isn't `idempotent` is only retried when it was rate limited.
+        The whole call, waits and retries included, is traced as a "calendar_api" span called `name`.
+        """
+        attempt = 0
+        with self._lock:
+            self.calls += 1
+        with span("calendar_api", name, cost=cost) as attributes:
+            while True:
+                attributes["attempts"] = attempt + 1
+                self.breaker.before_call()
+                self.acquire(key, cost)
+                try:
+                    result = send()
+                except HttpError as error:
+                    if not is_retryable(error):
+                        # The API answered; a 4xx says nothing about its health.
+                        self.breaker.record_success()
+                        raise
+                    delay = self.backoff(attempt, retry_after(error))
+                    if is_rate_limited(error):
+                        # Hold back this user's other calls too; acquire() does the waiting.
+                        self.pause(key, delay)
+                    else:
+                        self.breaker.record_failure()
+                    if attempt >= self.max_retries or delay > self.max_wait:
+                        raise
+                    if not idempotent and not is_rate_limited(error):
+                        raise
+                    if is_rate_limited(error):
+                        delay = 0.0
+                except TRANSPORT_ERRORS:
+                    self.breaker.record_failure()
+                    if attempt >= self.max_retries or not idempotent:
+                        raise
+                    delay = self.backoff(attempt)
+                else:
+                    self.breaker.record_success()
+                    return result
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+                "users": len(self._users),
+                "circuit": self.breaker.state,
+                "circuit_opens": self.breaker.opens,
+            }
+
+
+calendar_limiter = CalendarRateLimiter()
+
+
+class LimitedHttpRequest(HttpRequest):
+    """HttpRequest whose execute() goes through calendar_limiter under `limiter_key`."""
+
+    limiter_key = "anonymous"
+
+    def execute(self, http=None, num_retries=0):
+        return calendar_limiter.call(
+            self.limiter_key,
+            lambda: HttpRequest.execute(self, http=http, num_retries=num_retries),
+            name=self.methodId or self.method,
+            idempotent=is_idempotent(self),
+        )
+
+
+def request_builder(key: str) -> Callable[..., HttpRequest]:
+    """requestBuilder for build_from_document that tags every request with the user's key."""
+    def build(*args, **kwargs) -> HttpRequest:
+        request = LimitedHttpRequest(*args, **kwargs)
+        request.limiter_key = key
+        return request
+    return build
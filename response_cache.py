@@ -0,0 +1,219 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+
+from calendar_service import credential_key
+from envelopes import parse_reply
+from event_store import EVENT_STORE_ENABLED, get_event_store
+from slot_scheduler import DEFAULT_TIMEZONE
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "900"))
+READ_ONLY_TOOLS = {"get_events", "get_free_busy"}
+logger = logging.getLogger(__name__)
+
+_WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_READ = re.compile(
+    r"\b(what|whats|show|list|tell me|any|do i have|have i got|am i|is there|are there|how many|how busy|when)\b"
+)
+_WRITE = re.compile(
+    r"\b(create|add|schedule|book|set up|make|move|reschedule|change|update|edit|rename|delete|remove|cancel"
+    r"|clear|invite|remind|plan|put)\b"
+)
+_TOPIC = re.compile(
+    r"\b(events?|meetings?|calendar|schedule|agenda|plans|appointments?|busy|free|available|availability"
+    r"|do i have|have i got|anything on)\b"
+)
+# Words that don't change what is being asked; anything else ("with bob", "morning") becomes part of the key.
+_FILLER = set(
+    "what whats show list tell me any do i have got am is are there how many much when on in my the a an for "
+    "of to please can you could events event meetings meeting calendar schedule agenda plans planned "
+    "appointments appointment anything busy free available availability like look looking does going with".split()
+)
+_FREE_BUSY = re.compile(r"\b(free|busy|available|availability)\b")
+_DATES = re.compile(
+    r"\b(day after tomorrow|today|tonight|tomorrow|yesterday|this week|next week|this weekend|next weekend"
+    r"|next (?:%s)|(?:%s)|\d{4}-\d{2}-\d{2})\b" % ("|".join(_WEEKDAYS), "|".join(_WEEKDAYS))
+)
+
+
+@dataclass(frozen=True)
+class ReadQuery:
+    intent: str  # "list_events" or "free_busy"
+    start: date
+    end: date  # exclusive
+    qualifiers: tuple[str, ...] = ()
+
+    @property
+    def key(self) -> str:
+        return f"{self.intent}:{'+'.join(self.qualifiers)}:{self.start.isoformat()}:{self.end.isoformat()}"
+
+
+def normalise(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s-]", "", text.lower().replace("'", "")).split())
+
+
+def resolve_dates(phrase: str, today: date) -> tuple[date, date] | None:
+    """[start, end) days for a relative or ISO date; None for phrases that are ambiguous ("next friday")."""
+    monday = today - timedelta(days=today.weekday())
+    days = {"today": 0, "tonight": 0, "tomorrow": 1, "yesterday": -1, "day after tomorrow": 2}
+    if phrase in days:
+        start = today + timedelta(days=days[phrase])
+        return start, start + timedelta(days=1)
+    if phrase == "this week":
+        return today, monday + timedelta(days=7)
+    if phrase == "next week":
+        return monday + timedelta(days=7), monday + timedelta(days=14)
+    if phrase == "this weekend":
+        return max(today, monday + timedelta(days=5)), monday + timedelta(days=7)
+    if phrase in _WEEKDAYS:
+        start = today + timedelta(days=(_WEEKDAYS.index(phrase) - today.weekday()) % 7)
+        return start, start + timedelta(days=1)
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", phrase):
+        try:
+            start = date.fromisoformat(phrase)
+        except ValueError:
+            return None
+        return start, start + timedelta(days=1)
+    return None
+
+
+def date_ranges(text: str, today: date) -> list[tuple[date, date]]:
+    """[start, end) days of every date phrase in `text` that resolves unambiguously."""
+    ranges = [resolve_dates(phrase, today) for phrase in sorted(set(_DATES.findall(normalise(text))))]
+    return sorted(dates for dates in ranges if dates is not None)
+
+
+def read_query(text: str, today: date) -> ReadQuery | None:
+    """The question as a cacheable read (intent plus date range), or None if it may write or is unclear."""
+    text = normalise(text)
+    if not _READ.search(text) or not _TOPIC.search(text) or _WRITE.search(text):
+        return None
+    phrases = set(_DATES.findall(text))
+    if len(phrases) != 1:
+        return None
+    phrase = phrases.pop()
+    dates = resolve_dates(phrase, today)
+    if dates is None:
+        return None
+    qualifiers = tuple(sorted({word for word in text.replace(phrase, " ").split() if word not in _FILLER}))
+    return ReadQuery("free_busy" if _FREE_BUSY.search(text) else "list_events", *dates, qualifiers)
+
+
+def cacheable_reply(messages: list[BaseMessage]) -> str | None:
+    """The final reply of the last turn, if that turn only read the calendar and succeeded."""
+    turn = []
+    for message in reversed(messages):
+        turn.append(message)
+        if isinstance(message, HumanMessage) and message.name is None:
+            break
+    reply = messages[-1] if messages else None
+    if reply is None or getattr(reply, "name", None) != "calendar":
+        return None
+    for message in turn:
+        if getattr(message, "name", None) == "scheduler":
+            return None
+        if isinstance(message, ToolMessage):
+            if message.name not in READ_ONLY_TOOLS or '"error"' in str(message.content):
+                return None
+    envelope = parse_reply(reply.content)
+    if envelope is None or envelope.needs_deep_analysis or not envelope.response_for_user:
+        return None
+    return reply.content
+
+
+# ------------------------------------------------------------------------------
+# Response cache for read-only questions
+#
+#    "What's on my calendar tomorrow?" is answered once by the agents; a repeat of
+#    the same read (same intent and resolved dates) for the same user is answered
+#    from here without a model or API call. Entries are keyed on the event store's
+#    version, which every create/update/delete made through event_handler.py (and
+#    every sync that brings in outside changes) bumps, so an entry can never outlive
+#    the calendar contents it describes. Only questions that parse as a single,
+#    unambiguous read are cached; everything else bypasses the cache. Looking up
+#    never calls the API: while the store is due for a sync the question misses
+#    and the agents' own read brings the store up to date.
+# ------------------------------------------------------------------------------
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl_seconds: float = RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+
+    def key(self, creds, text: str, now: datetime | None = None) -> tuple | None:
+        """(user, calendar version, intent and dates), or None if this question can't be cached."""
+        if not (RESPONSE_CACHE_ENABLED and EVENT_STORE_ENABLED):
+            return None
+        today = (now or datetime.now(ZoneInfo(DEFAULT_TIMEZONE))).date()
+        query = read_query(text, today)
+        if query is None:
+            return None
+        store = get_event_store(creds)
+        if not store.fresh():
+            # Not synced yet or older than its max staleness: the turn's own read refreshes it.
+            return None
+        return credential_key(creds), store.calendar_id, store.version, query.key
+
+    def lookup(self, creds, text: str) -> str | None:
+        key = self.key(creds, text)
+        with self._lock:
+            if key is None:
+                self.bypassed += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def store(self, creds, text: str, messages: list[BaseMessage]):
+        """Cache the turn's reply, keyed on the calendar version after the turn ran."""
+        reply = cacheable_reply(messages)
+        if reply is None:
+            return
+        key = self.key(creds, text)
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = (reply, time.time())
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "stores": self.stores,
+                "entries": len(self._entries),
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import weakref
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from google.oauth2.credentials import Credentials
+from langchain_core.messages import HumanMessage
+from pydantic import BaseModel, Field
+
+from calendar_service import credential_key
+from chatbot_with_todo import SCOPES, astream_chatbot, extract_response, get_workflow
+from checkpointer import async_checkpointer, make_thread_id
+from event_store import event_store_stats
+from jobs import BACKGROUND_NODES, get_job_queue, runs_in_background
+from response_cache import response_cache
+from telemetry import configure_logging, metrics
+from ollama_manager import ollama_manager
+
+MAX_CONCURRENT_CHATS = int(os.getenv("MAX_CONCURRENT_CHATS", "16"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "30"))
+
+configure_logging()
+
+
+# ------------------------------------------------------------------------------
+# Async HTTP / SSE serving layer
+#
+#    One compiled graph and one async checkpointer serve every user. Each request
+#    carries its own Google credentials, which are passed to the tools through the
+#    graph config; the conversation thread is keyed by credential identity and
+#    session id so two users can never share one. At most MAX_CONCURRENT_CHATS
+#    turns run at once, and turns within one session are serialised. A turn the
+#    calendar agent routes to the scheduler is handed to the job queue (jobs.py)
+#    and the response carries the job to poll; the session takes no new message
+#    (409) until that job has finished.
+#
+#        uvicorn server:app --workers 1
+# ------------------------------------------------------------------------------
+class ChatRequest(BaseModel):
+    session_id: str
+    message: str
+    credentials: dict = Field(
+        description="Authorized-user info (token, refresh_token, client_id, client_secret) "
+                    "as stored in token.json."
+    )
+
+
+class ChatResponse(BaseModel):
+    session_id: str
+    response: str
+    job: dict | None = Field(
+        None, description="The background job finishing the turn (a to-do list); poll GET /jobs/{id} for its reply."
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the local scheduler model now rather than on the first to-do list.
+    ollama_manager.preload_in_background()
+    # The job workers use their own graph on the sync checkpointer (same database).
+    await asyncio.to_thread(get_job_queue().start)
+    async with async_checkpointer() as saver:
+        app.state.graph = get_workflow(checkpointer=saver)
+        app.state.slots = asyncio.Semaphore(MAX_CONCURRENT_CHATS)
+        app.state.session_locks = weakref.WeakValueDictionary()
+        app.state.active = 0
+        yield
+
+
+app = FastAPI(title="Calendar Assistant", lifespan=lifespan)
+
+
+def load_credentials(info: dict) -> Credentials:
+    try:
+        return Credentials.from_authorized_user_info(info, SCOPES)
+    except ValueError:
+        if info.get("token"):
+            # A bare access token works until it expires; it cannot be refreshed.
+            return Credentials(token=info["token"])
+        raise HTTPException(status_code=400, detail="Invalid Google credentials")
+
+
+@asynccontextmanager
+async def admitted(thread_id: str):
+    """Wait for a free slot (503 after CHAT_QUEUE_TIMEOUT) and for the session's previous turn.
+
+    409 while a background job is still finishing one of the session's turns.
+    """
+    try:
+        await asyncio.wait_for(app.state.slots.acquire(), timeout=CHAT_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Too many concurrent chats, retry later")
+    lock = app.state.session_locks.get(thread_id)
+    if lock is None:
+        lock = app.state.session_locks[thread_id] = asyncio.Lock()
+    app.state.active += 1
+    try:
+        async with lock:
+            job = await asyncio.to_thread(get_job_queue().active, thread_id)
+            if job is not None:
+                raise HTTPException(status_code=409, detail=f"Job {job.id} is still running in this session")
+            yield
+    finally:
+        app.state.active -= 1
+        app.state.slots.release()
+
+
+class Admission:
+    """admitted() held across the lifetime of a streamed response; release() may be called more than once."""
+
+    def __init__(self, thread_id: str):
+        self._context = admitted(thread_id)
+        self._released = False
+
+    async def acquire(self):
+        await self._context.__aenter__()
+
+    async def release(self):
+        if not self._released:
+            self._released = True
+            await self._context.__aexit__(None, None, None)
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Releases its admission however the response ends: finished, failed, or the client gone before the body started."""
+
+    def __init__(self, content, admission: Admission, **kwargs):
+        super().__init__(content, **kwargs)
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.admission.release()
+
+
+def request_thread(request: ChatRequest) -> tuple[Credentials, str]:
+    creds = load_credentials(request.credentials)
+    return creds, make_thread_id(credential_key(creds), request.session_id)
+
+
+async def hand_off(final_state, creds) -> dict | None:
+    """Queue the rest of a turn that stopped before the scheduler; the job, or None if the turn is done."""
+    if not runs_in_background(final_state):
+        return None
+    job = await asyncio.to_thread(get_job_queue().submit, final_state, creds)
+    return job.as_dict()
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest) -> ChatResponse:
+    creds, thread_id = request_thread(request)
+    state = {"messages": [HumanMessage(request.message)]}
+    async with admitted(thread_id):
+        async for event in astream_chatbot(app.state.graph, state, creds, thread_id, BACKGROUND_NODES):
+            if event["type"] == "final":
+                final_state = event["state"]
+        job = await hand_off(final_state, creds)
+    content = final_state.values["messages"][-1].content
+    return ChatResponse(session_id=request.session_id, response=extract_response(content), job=job)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest) -> StreamingResponse:
+    creds, thread_id = request_thread(request)
+    state = {"messages": [HumanMessage(request.message)]}
+
+    # Admit before the response starts so an overloaded server can still answer 503.
+    admission = Admission(thread_id)
+    await admission.acquire()
+
+    async def events():
+        try:
+            async for event in astream_chatbot(app.state.graph, state, creds, thread_id, BACKGROUND_NODES):
+                if event["type"] == "final":
+                    job = await hand_off(event["state"], creds)
+                    if job is not None:
+                        yield f"event: job\ndata: {json.dumps(job)}\n\n"
+                    content = event["state"].values["messages"][-1].content
+                    event = {"type": "final", "response": extract_response(content)}
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            # Frees the slot as soon as the turn ends, before the response closes.
+            await admission.release()
+
+    try:
+        return AdmittedStreamingResponse(events(), admission, media_type="text/event-stream")
+    except BaseException:
+        await admission.release()
+        raise
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> dict:
+    job = await asyncio.to_thread(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job.as_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    """The job's state on every change (stage, task progress), until it finishes."""
+    if await asyncio.to_thread(get_job_queue().get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def events():
+        updated = 0.0
+        while True:
+            job = await asyncio.to_thread(get_job_queue().wait, job_id, updated, CHAT_QUEUE_TIMEOUT)
+            if job.updated > updated or job.finished:
+                updated = job.updated
+                yield f"event: job\ndata: {json.dumps(job.as_dict())}\n\n"
+            if job.finished:
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/health")
+async def health() -> dict:
+    return {
+        "active_chats": app.state.active,
+        "max_concurrent_chats": MAX_CONCURRENT_CHATS,
+        "response_cache": response_cache.stats(),
+        "event_store": event_store_stats(),
+        "scheduler_model": ollama_manager.stats(),
+        "jobs": get_job_queue().stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics() -> str:
+    """Turn, node, model, tool and Calendar API latencies, local model queue, for Prometheus to scrape."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,158 @@
+import bisect
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+DEFAULT_TIMEZONE = "America/Los_Angeles"
+WORK_START = os.getenv("WORK_START", "09:00")
+WORK_END = os.getenv("WORK_END", "18:00")
+SCHEDULE_BUFFER_MINUTES = int(os.getenv("SCHEDULE_BUFFER_MINUTES", "5"))
+
+
+# ------------------------------------------------------------------------------
+# Deterministic slot scheduler
+#
+#    Fast path for the scheduler node: the calendar agent only estimates how long
+#    each task takes, and the tasks are packed into the free gaps of the day here,
+#    in priority order, after the current time, inside working hours and without
+#    overlapping any existing event. No model call is needed unless the request
+#    is ambiguous (see parse_tasks).
+# ------------------------------------------------------------------------------
+@dataclass
+class Task:
+    summary: str
+    duration: timedelta
+    priority: int = 2
+    earliest: datetime | None = None
+    deadline: datetime | None = None
+    order: int = 0
+
+
+class AmbiguousSchedule(ValueError):
+    """The request cannot be scheduled deterministically; fall back to the model."""
+
+
+class BusyIndex:
+    """Merged, start-sorted busy intervals of one day."""
+
+    def __init__(self, intervals: list[tuple[datetime, datetime]]):
+        merged: list[list[datetime]] = []
+        for start, end in sorted(intervals):
+            if end <= start:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = [start for start, _ in merged]
+        self.ends = [end for _, end in merged]
+
+    def free_gaps(self, window_start: datetime, window_end: datetime) -> list[tuple[datetime, datetime]]:
+        gaps, cursor = [], window_start
+        first = bisect.bisect_right(self.ends, window_start)
+        for start, end in zip(self.starts[first:], self.ends[first:]):
+            if start >= window_end:
+                break
+            if start > cursor:
+                gaps.append((cursor, start))
+            cursor = max(cursor, end)
+        if cursor < window_end:
+            gaps.append((cursor, window_end))
+        return gaps
+
+
+def _parse_datetime(value: str, tz: ZoneInfo) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=tz)
+
+
+def _parse_clock(value: str, day: date, tz: ZoneInfo) -> datetime:
+    return datetime.combine(day, time.fromisoformat(value), tzinfo=tz)
+
+
+def busy_intervals(ranges: list[list[str]], tz: ZoneInfo) -> list[tuple[datetime, datetime]]:
+    """(start, end) datetimes from get_free_busy's [start, end] pairs."""
+    return [(_parse_datetime(start, tz), _parse_datetime(end, tz)) for start, end in ranges]
+
+
+def parse_tasks(context: dict, tz: ZoneInfo) -> list[Task]:
+    """Tasks from the calendar agent's scheduling_context; raises AmbiguousSchedule if unusable."""
+    raw_tasks = context.get("tasks") if isinstance(context, dict) else None
+    if not raw_tasks:
+        raise AmbiguousSchedule("no tasks in scheduling_context")
+    tasks = []
+    for order, raw in enumerate(raw_tasks):
+        try:
+            minutes = float(raw["duration_minutes"])
+        except (KeyError, TypeError, ValueError):
+            raise AmbiguousSchedule(f"missing duration for task {raw!r}")
+        if minutes <= 0 or not raw.get("summary"):
+            raise AmbiguousSchedule(f"invalid task {raw!r}")
+        tasks.append(Task(
+            summary=raw["summary"],
+            duration=timedelta(minutes=minutes),
+            priority=int(raw.get("priority") or 2),
+            earliest=_parse_datetime(raw["earliest"], tz) if raw.get("earliest") else None,
+            deadline=_parse_datetime(raw["deadline"], tz) if raw.get("deadline") else None,
+            order=order,
+        ))
+    return tasks
+
+
+def pack_tasks(
+    tasks: list[Task],
+    busy: BusyIndex,
+    window_start: datetime,
+    window_end: datetime,
+    buffer: timedelta = timedelta(minutes=SCHEDULE_BUFFER_MINUTES),
+) -> tuple[list[dict], list[dict]]:
+    """First-fit the tasks, highest priority (then earliest deadline) first, into the free gaps."""
+    gaps = busy.free_gaps(window_start, window_end)
+    scheduled, unscheduled = [], []
+    for task in sorted(tasks, key=lambda t: (t.priority, t.deadline or window_end, t.order)):
+        for index, (gap_start, gap_end) in enumerate(gaps):
+            start = max(gap_start, task.earliest or gap_start)
+            end = start + task.duration
+            if end > min(gap_end, task.deadline or gap_end):
+                continue
+            scheduled.append({
+                "summary": task.summary,
+                "start_time": start.isoformat(),
+                "end_time": end.isoformat(),
+                "priority": task.priority,
+            })
+            # Split the gap around the placed task, leaving a buffer after it.
+            remaining = [(gap_start, start)] if start > gap_start else []
+            if end + buffer < gap_end:
+                remaining.append((end + buffer, gap_end))
+            gaps[index:index + 1] = remaining
+            break
+        else:
+            unscheduled.append({"summary": task.summary, "reason": "no free slot long enough"})
+    scheduled.sort(key=lambda item: item["start_time"])
+    return scheduled, unscheduled
+
+
+def plan_day(context: dict, busy: list[list[str]], now: datetime) -> dict:
+    """Schedule the tasks in `context` around the `busy` ranges of the requested day, after `now`."""
+    tz = ZoneInfo(context.get("timezone") or DEFAULT_TIMEZONE)
+    now = now.astimezone(tz)
+    day = date.fromisoformat(context["date"]) if context.get("date") else now.date()
+    hours = context.get("working_hours") or {}
+    work_start = _parse_clock(hours.get("start") or WORK_START, day, tz)
+    work_end = _parse_clock(hours.get("end") or WORK_END, day, tz)
+    tasks = parse_tasks(context, tz)
+    # Never schedule in the past: start from the next quarter hour after now.
+    next_slot = (now + timedelta(minutes=15 - now.minute % 15)).replace(second=0, microsecond=0)
+    window_start = max(work_start, next_slot)
+    scheduled, unscheduled = pack_tasks(tasks, BusyIndex(busy_intervals(busy, tz)), window_start, work_end)
+    return {"date": day.isoformat(), "timezone": str(tz), "tasks": scheduled, "unscheduled": unscheduled}
+
+
+def day_bounds(context: dict, now: datetime) -> tuple[str, str]:
+    """RFC3339 start and end of the requested day, for fetching its events."""
+    tz = ZoneInfo(context.get("timezone") or DEFAULT_TIMEZONE)
+    day = date.fromisoformat(context["date"]) if context.get("date") else now.astimezone(tz).date()
+    start = datetime.combine(day, time(), tzinfo=tz)
+    return start.isoformat(), (start + timedelta(days=1)).isoformat()
@@ -0,0 +1,150 @@
+import json
+import re
+
+# ------------------------------------------------------------------------------
+# Incremental parsing of streamed model output
+# ------------------------------------------------------------------------------
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class JsonFieldStreamer:
+    """Pull the value of one string field out of a JSON object while it is still streaming.
+
+    Feed raw text chunks as they arrive; each call returns the newly decoded
+    characters of the field value (possibly empty).
+    """
+
+    def __init__(self, field: str):
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._position = None
+        self.value = ""
+        self.done = False
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+        if self.done:
+            return ""
+        if self._position is None:
+            match = self._key.search(self._buffer)
+            if match is None:
+                return ""
+            self._position = match.end()
+
+        decoded = []
+        buffer, position = self._buffer, self._position
+        while position < len(buffer):
+            char = buffer[position]
+            if char == '"':
+                self.done = True
+                position += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                position += 1
+                continue
+            # Escape sequence: wait for the rest of it if it is split across chunks.
+            if position + 1 >= len(buffer):
+                break
+            escape = buffer[position + 1]
+            if escape == "u":
+                if position + 6 > len(buffer):
+                    break
+                length = 6
+                if 0xD800 <= int(buffer[position + 2:position + 6], 16) < 0xDC00:
+                    # High surrogate: decode together with the low half that follows.
+                    if position + 12 > len(buffer):
+                        break
+                    length = 12
+                decoded.append(json.loads('"%s"' % buffer[position:position + length]))
+                position += length
+            else:
+                decoded.append(_ESCAPES.get(escape, escape))
+                position += 2
+        self._position = position
+        new_text = "".join(decoded)
+        self.value += new_text
+        return new_text
+
+
+class JsonFlagStreamer:
+    """Read one boolean field of a JSON object as soon as it has streamed.
+
+    feed() returns the field's value once it is complete (None until then). The
+    rest of the object is never parsed, so the caller can act before it ends.
+    """
+
+    def __init__(self, field: str):
+        self._key = re.compile(r'"%s"\s*:\s*(true|false)' % re.escape(field))
+        self._buffer = ""
+        self.value = None
+        self.done = False
+
+    def feed(self, text: str) -> bool | None:
+        if not self.done:
+            self._buffer += text
+            match = self._key.search(self._buffer)
+            if match is not None:
+                self.value, self.done, self._buffer = match.group(1) == "true", True, ""
+        return self.value
+
+
+def _partial_tag(text: str, tag: str) -> int:
+    """Length of the longest prefix of `tag` that `text` ends with (a tag split across chunks)."""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+class ThinkStreamer:
+    """Separate a reasoning model's <think>...</think> block from its answer while it streams.
+
+    feed() returns the (reasoning, answer) text that each chunk settled. Output that
+    doesn't open with <think> is all answer; a block that never closes is all reasoning.
+    """
+
+    OPEN, CLOSE = "<think>", "</think>"
+
+    def __init__(self):
+        self._buffer = ""
+        self.state = "start"  # start -> reasoning -> answer, or start -> answer
+        self.reasoning = ""
+        self.answer = ""
+
+    def feed(self, text: str) -> tuple[str, str]:
+        self._buffer += text
+        reasoning = answer = ""
+        if self.state == "start":
+            stripped = self._buffer.lstrip()
+            if len(stripped) < len(self.OPEN) and self.OPEN.startswith(stripped):
+                return "", ""
+            if stripped.startswith(self.OPEN):
+                self.state, self._buffer = "reasoning", stripped[len(self.OPEN):]
+            else:
+                self.state = "answer"
+        if self.state == "reasoning":
+            end = self._buffer.find(self.CLOSE)
+            if end == -1:
+                settled = len(self._buffer) - _partial_tag(self._buffer, self.CLOSE)
+                reasoning, self._buffer = self._buffer[:settled], self._buffer[settled:]
+            else:
+                reasoning, self._buffer = self._buffer[:end], self._buffer[end + len(self.CLOSE):]
+                self.state = "answer"
+        if self.state == "answer":
+            answer, self._buffer = self._buffer, ""
+            if not self.answer:
+                answer = answer.lstrip()
+        self.reasoning += reasoning
+        self.answer += answer
+        return reasoning, answer
+
+    def flush(self) -> tuple[str, str]:
+        """Settle whatever is still buffered once the stream has ended."""
+        rest, self._buffer = self._buffer, ""
+        if self.state == "reasoning":
+            self.reasoning += rest
+            return rest, ""
+        rest = rest.strip() if not self.answer else rest
+        self.answer += rest
+        return "", rest
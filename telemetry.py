@@ -0,0 +1,353 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from typing import Iterator
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "64"))
+METRICS_PREFIX = "calendar_assistant_"
+# Span attributes that also label the span's metrics, e.g. turn latency per routed intent.
+METRIC_LABELS = ("intent",)
+# Histogram buckets in seconds, from a cached Calendar read up to a slow local-model plan.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------------------
+# Structured logging
+#
+#    Modules log through logging.getLogger(__name__) and pass structured values in
+#    extra={"fields": {...}}. LOG_FORMAT=json writes one JSON object per line;
+#    the default text format appends the fields as key=value pairs. The entry
+#    points (main.py, server.py) call configure_logging(); importing a module never
+#    touches the root logger.
+# ------------------------------------------------------------------------------
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, as_json: bool):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.as_json = as_json
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", {})
+        if self.as_json:
+            entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                     "message": record.getMessage(), **fields}
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        text = super().format(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Install the structured handler on the root logger, unless the application already configured one."""
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(StructuredFormatter(as_json=log_format == "json"))
+    root.addHandler(handler)
+    root.setLevel(level)
+    # The OpenAI and Ollama clients log every HTTP request at INFO.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+
+# ------------------------------------------------------------------------------
+# Metrics
+#
+#    Counters, gauges and latency histograms kept in process and rendered in the
+#    Prometheus text format by server.py's /metrics endpoint.
+# ------------------------------------------------------------------------------
+class Metrics:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self._counters: dict[tuple, float] = defaultdict(float)
+        self._gauges: dict[tuple, float] = {}
+        self._histograms: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict | None) -> tuple:
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name: str, labels: dict | None = None, value: float = 1):
+        with self._lock:
+            self._counters[self._key(name, labels)] += value
+
+    def value(self, name: str, labels: dict | None = None) -> float:
+        """A counter's current value (0 if it was never incremented)."""
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def set(self, name: str, value: float, labels: dict | None = None):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, labels: dict | None = None):
+        with self._lock:
+            # Per-bucket counts, then sum and count.
+            histogram = self._histograms.setdefault(self._key(name, labels), [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        def series(name: str, labels: tuple, extra: tuple = ()) -> str:
+            pairs = ",".join(f'{key}="{value}"' for key, value in labels + extra)
+            return f"{METRICS_PREFIX}{name}{{{pairs}}}" if pairs else f"{METRICS_PREFIX}{name}"
+
+        lines, typed = [], set()
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {METRICS_PREFIX}{name} counter")
+                lines.append(f"{series(name, labels)} {value:g}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {METRICS_PREFIX}{name} gauge")
+                lines.append(f"{series(name, labels)} {value:g}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {METRICS_PREFIX}{name} histogram")
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"{series(name + '_bucket', labels, (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{series(name + '_bucket', labels, (('le', '+Inf'),))} {histogram[-1]}")
+                lines.append(f"{series(name + '_sum', labels)} {histogram[-2]:.6f}")
+                lines.append(f"{series(name + '_count', labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# ------------------------------------------------------------------------------
+# Turn traces
+#
+#    Each chat turn gets a Trace holding timing spans: the graph nodes (calendar,
+#    scheduler), every model call (with time to first token and token counts),
+#    every tool and every Calendar API request (including its retries). The trace
+#    travels in a context variable, which LangGraph copies into the threads and
+#    tasks it runs nodes and tools in. Every span also feeds the metrics, and the
+#    finished turn is logged with a per-kind time breakdown. The last TRACE_HISTORY
+#    traces are kept by thread id for the Streamlit debug panel.
+# ------------------------------------------------------------------------------
+@dataclass
+class Span:
+    kind: str  # "turn", "node", "model", "tool" or "calendar_api"
+    name: str
+    start: float  # time.perf_counter()
+    duration: float
+    attributes: dict = field(default_factory=dict)
+
+
+class Trace:
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.started = time.perf_counter()
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def waterfall(self) -> list[dict]:
+        """Spans in start order, with offsets from the start of the turn in milliseconds."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return [
+            {
+                "kind": span.kind,
+                "name": span.name,
+                "offset_ms": round((span.start - self.started) * 1000, 1),
+                "duration_ms": round(span.duration * 1000, 1),
+                **span.attributes,
+            }
+            for span in spans
+        ]
+
+    def summary(self) -> dict:
+        """Total seconds and span count per kind."""
+        totals = defaultdict(lambda: [0.0, 0])
+        with self._lock:
+            for span in self.spans:
+                totals[span.kind][0] += span.duration
+                totals[span.kind][1] += 1
+        return {f"{kind}_seconds": round(seconds, 3) for kind, (seconds, _) in totals.items()} | {
+            f"{kind}_count": count for kind, (_, count) in totals.items()
+        }
+
+
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("current_trace", default=None)
+_traces: OrderedDict[str, Trace] = OrderedDict()
+_traces_lock = threading.Lock()
+
+
+def record(kind: str, name: str, start: float, duration: float, **attributes):
+    """Add a finished span to the current turn's trace and to the metrics."""
+    labels = {"name": name, **{key: attributes[key] for key in METRIC_LABELS if attributes.get(key)}}
+    metrics.observe(f"{kind}_duration_seconds", duration, labels)
+    if "error" in attributes:
+        metrics.inc(f"{kind}_errors_total", labels)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(Span(kind, name, start, duration, attributes))
+    logger.debug("span", extra={"fields": {"kind": kind, "name": name, "ms": round(duration * 1000, 1), **attributes}})
+
+
+@contextlib.contextmanager
+def span(kind: str, name: str, **attributes) -> Iterator[dict]:
+    """Time the block as a span; the yielded dict takes attributes known only later."""
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        record(kind, name, start, time.perf_counter() - start, **attributes)
+
+
+def traced(kind: str, name: str):
+    """Decorator form of span(), e.g. for graph nodes."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(kind, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def turn(thread_id: str) -> Iterator[dict]:
+    """Trace one chat turn; the yielded dict takes attributes for the turn span."""
+    trace = Trace(thread_id)
+    token = _current_trace.set(trace)
+    try:
+        with span("turn", "turn") as attributes:
+            yield attributes
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # A generator resumed in another context (e.g. a different thread) set it.
+            _current_trace.set(None)
+        with _traces_lock:
+            _traces[thread_id] = trace
+            _traces.move_to_end(thread_id)
+            while len(_traces) > TRACE_HISTORY:
+                _traces.popitem(last=False)
+        logger.info("turn finished", extra={"fields": {"thread_id": thread_id, **trace.summary()}})
+
+
+def last_trace(thread_id: str) -> Trace | None:
+    with _traces_lock:
+        return _traces.get(thread_id)
+
+
+class TracingCallbacks(BaseCallbackHandler):
+    """Model and tool spans from LangChain's callbacks; pass in the run config's "callbacks"."""
+
+    # Called in the run's own thread/task, so timings are exact and the trace context is visible.
+    run_inline = True
+
+    def __init__(self):
+        self._runs: dict[UUID, dict] = {}
+
+    @staticmethod
+    def _node(metadata: dict | None) -> str | None:
+        metadata = metadata or {}
+        return metadata.get("langgraph_checkpoint_ns", "").split(":")[0] or metadata.get("langgraph_node")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._runs[run_id] = {
+            "start": time.perf_counter(),
+            "first_token": None,
+            "name": (metadata or {}).get("ls_model_name") or (serialized or {}).get("name") or "model",
+            "node": self._node(metadata),
+        }
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and run["first_token"] is None:
+            run["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        attributes = {"node": run["node"]}
+        if run["first_token"] is not None:
+            attributes["ttft_ms"] = round((run["first_token"] - run["start"]) * 1000, 1)
+        message = getattr(response.generations[0][0], "message", None) if response.generations else None
+        usage = getattr(message, "usage_metadata", None) or {}
+        for kind in ("input_tokens", "output_tokens"):
+            if usage.get(kind):
+                attributes[kind] = usage[kind]
+                metrics.inc("model_tokens_total", {"name": run["name"], "type": kind.split("_")[0]}, usage[kind])
+        # Prompt tokens the provider served from its prompt cache instead of prefilling again.
+        cached = (usage.get("input_token_details") or {}).get("cache_read")
+        if cached:
+            attributes["cached_tokens"] = cached
+            metrics.inc("model_tokens_total", {"name": run["name"], "type": "cached"}, cached)
+        if run["first_token"] is not None:
+            metrics.observe("model_ttft_seconds", run["first_token"] - run["start"], {"name": run["name"]})
+        record("model", run["name"], run["start"], time.perf_counter() - run["start"], **attributes)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record("model", run["name"], run["start"], time.perf_counter() - run["start"],
+                   node=run["node"], error=type(error).__name__)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, metadata=None, **kwargs):
+        self._runs[run_id] = {"start": time.perf_counter(), "name": (serialized or {}).get("name") or "tool",
+                              "node": self._node(metadata)}
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            attributes = {"node": run["node"]}
+            if isinstance(output, dict) and "error" in output:
+                attributes["error"] = output["error"].get("category", "error")
+            elif isinstance(getattr(output, "content", None), str) and output.content.startswith('{"error"'):
+                attributes["error"] = "error"
+            record("tool", run["name"], run["start"], time.perf_counter() - run["start"], **attributes)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record("tool", run["name"], run["start"], time.perf_counter() - run["start"],
+                   node=run["node"], error=type(error).__name__)
+
+
+tracing_callbacks = TracingCallbacks()
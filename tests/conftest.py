@@ -0,0 +1,58 @@
+import contextlib
+import os
+
+# In-memory checkpoints, short backoffs and no throttling, so every test runs the code under test offline and fast.
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("CALENDAR_USER_QPS", "1000")
+os.environ.setdefault("CALENDAR_USER_BURST", "1000")
+os.environ.setdefault("CALENDAR_PROJECT_QPS", "1000")
+os.environ.setdefault("CALENDAR_PROJECT_BURST", "1000")
+os.environ.setdefault("CALENDAR_BACKOFF_BASE", "0.02")
+os.environ.setdefault("CALENDAR_BACKOFF_MAX", "0.2")
+os.environ.setdefault("CIRCUIT_RESET_SECONDS", "1")
+
+import pytest
+
+import calendar_service
+from agent_registry import agent_registry
+from benchmarks.fake_calendar import FakeCalendarServer
+from benchmarks.fake_ollama import FakeOllamaServer
+from event_store import reset_event_stores
+from rate_limiter import calendar_limiter
+from response_cache import response_cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    """Every test starts without compiled agents, cached replies, event stores or an open circuit."""
+    agent_registry.clear()
+    response_cache.clear()
+    reset_event_stores()
+    yield
+    calendar_limiter.breaker.record_success()
+
+
+@pytest.fixture
+def fake_calendar(monkeypatch):
+    """Start a FakeCalendarServer (same arguments) and point the Calendar client at it."""
+    with contextlib.ExitStack() as stack:
+        def start(*args, **kwargs) -> FakeCalendarServer:
+            server = stack.enter_context(FakeCalendarServer(*args, **kwargs))
+            monkeypatch.setattr(calendar_service, "CALENDAR_API_ENDPOINT", server.endpoint)
+            calendar_service.service_pool.clear()
+            return server
+        yield start
+    calendar_service.service_pool.clear()
+
+
+@pytest.fixture
+def calendar(fake_calendar) -> FakeCalendarServer:
+    """A fault-free fake Calendar with no latency."""
+    return fake_calendar()
+
+
+@pytest.fixture
+def fake_ollama():
+    """Start a FakeOllamaServer (same arguments); stopped when the test ends."""
+    with contextlib.ExitStack() as stack:
+        yield lambda *args, **kwargs: stack.enter_context(FakeOllamaServer(*args, **kwargs))
@@ -0,0 +1,67 @@
+"""Calendar tools must ride out 429/5xx responses and fail fast in an outage."""
+import pytest
+from googleapiclient.errors import HttpError
+
+import event_handler
+import response_cache
+from benchmarks.fake_calendar import FaultPlan
+from calendar_service import calendar_service
+from event_handler import create_event, delete_event, get_events, get_free_busy, update_event
+from rate_limiter import calendar_limiter
+
+CONFIG = {"configurable": {"credentials": None}}
+
+
+@pytest.fixture(autouse=True)
+def no_event_store(monkeypatch):
+    """Every tool call must really reach the server."""
+    monkeypatch.setattr(event_handler, "EVENT_STORE_ENABLED", False)
+    monkeypatch.setattr(response_cache, "EVENT_STORE_ENABLED", False)
+
+
+def is_error(result) -> bool:
+    return isinstance(result, dict) and "error" in result
+
+
+def run_round(day: int) -> dict:
+    """One create / read / update / delete cycle; returns the tool results by name."""
+    start, end = f"2030-01-{day:02d}T10:00:00+00:00", f"2030-01-{day:02d}T11:00:00+00:00"
+    event = {"summary": "Review", "location": "", "description": "", "start_time": start,
+             "end_time": end, "attendees": []}
+    results = {"create_event": create_event.invoke(event, config=CONFIG)}
+    day_range = {"startDateTime": f"2030-01-{day:02d}T00:00:00+00:00", "endDateTime": f"2030-01-{day:02d}T23:59:00+00:00"}
+    results["get_events"] = events = get_events.invoke(day_range, config=CONFIG)
+    results["get_free_busy"] = get_free_busy.invoke(day_range, config=CONFIG)
+    if not is_error(events) and events:
+        event_id = events[0]["eventId"]
+        results["update_event"] = update_event.invoke({**event, "eventId": event_id, "summary": "Review (moved)"}, config=CONFIG)
+        results["delete_event"] = delete_event.invoke({"eventId": event_id}, config=CONFIG)
+    return results
+
+
+def test_tools_retry_through_rate_limits_and_server_errors(fake_calendar):
+    server = fake_calendar(FaultPlan(rate=0.2, seed=0))
+    for round_ in range(20):
+        for name, result in run_round(1 + round_ % 28).items():
+            assert not is_error(result), f"{name} failed despite retries: {result['error']}"
+    assert server.faults_injected
+
+
+def test_outage_opens_the_circuit(fake_calendar):
+    fake_calendar(FaultPlan(rate=1.0, statuses=(503,)))
+    opens = calendar_limiter.breaker.opens
+    day = {"startDateTime": "2030-02-01T00:00:00+00:00", "endDateTime": "2030-02-01T23:59:00+00:00"}
+    results = [get_free_busy.invoke(day, config=CONFIG) for _ in range(5)]
+    categories = [result.get("error", {}).get("category") for result in results]
+    assert calendar_limiter.breaker.opens > opens, "circuit breaker never opened during the outage"
+    assert "circuit_open" in categories, "no call was refused by the open circuit"
+    assert all(result.get("error", {}).get("retryable") for result in results), "outage errors should be marked retryable"
+
+
+def test_insert_without_an_id_is_not_retried_after_a_server_error(fake_calendar):
+    server = fake_calendar(FaultPlan(script=[503]))
+    body = {"summary": "Review", "start": {"dateTime": "2030-01-01T10:00:00+00:00"},
+            "end": {"dateTime": "2030-01-01T11:00:00+00:00"}}
+    with pytest.raises(HttpError), calendar_service(None) as service:
+        service.events().insert(calendarId="primary", body=body).execute()
+    assert server.requests == 1 and not server.events
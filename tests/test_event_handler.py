@@ -0,0 +1,33 @@
+"""Inserts carry ids derived from the job and the event, so a job never creates an event twice."""
+from event_handler import create_event, create_events
+
+CONFIG = {"configurable": {"credentials": None, "idempotency_key": "job-1"}}
+
+
+def gym(hour: int) -> dict:
+    return {"summary": "Gym", "location": "", "description": "", "start_time": f"2030-01-01T{hour:02d}:00:00+00:00",
+            "end_time": f"2030-01-01T{hour + 1:02d}:00:00+00:00", "attendees": []}
+
+
+def test_same_name_at_different_times_creates_both(calendar):
+    assert create_event.invoke(gym(7), config=CONFIG).startswith("Event created")
+    assert create_event.invoke(gym(18), config=CONFIG).startswith("Event created")
+    results = create_events.invoke({"events": [gym(9)]}, config=CONFIG) + \
+        create_events.invoke({"events": [gym(12)]}, config=CONFIG)
+    assert [result["status"] for result in results] == ["created", "created"]
+    assert len(calendar.events) == 4
+
+
+def test_retried_job_gets_the_same_ids(calendar):
+    create_events.invoke({"events": [gym(7), gym(18)]}, config=CONFIG)
+    retried = {**gym(7), "start_time": "2030-01-01T07:00:00Z", "end_time": "2030-01-01T08:00:00Z"}
+    assert create_event.invoke(retried, config=CONFIG) == "Event already created by an earlier attempt"
+    results = create_events.invoke({"events": [gym(7), gym(18)]}, config=CONFIG)
+    assert [result["status"] for result in results] == ["already_created", "already_created"]
+    assert len(calendar.events) == 2
+
+
+def test_another_job_creates_its_own_events(calendar):
+    create_event.invoke(gym(7), config=CONFIG)
+    create_event.invoke(gym(7), config={"configurable": {"credentials": None, "idempotency_key": "job-2"}})
+    assert len(calendar.events) == 2
@@ -0,0 +1,40 @@
+"""The local event store answers ranges inside its synced window and sends the rest to the API."""
+from datetime import datetime, timedelta, timezone
+
+import event_store
+from calendar_service import calendar_service
+from event_store import EventStore, event_store_stats, get_event_store
+
+
+def iso(moment: datetime) -> str:
+    return moment.isoformat()
+
+
+def weekly(event_id: str, start: datetime, weeks: int) -> list[dict]:
+    """A weekly event's instances as singleEvents=True lists them."""
+    return [{"id": f"{event_id}_{week}", "summary": "Standup",
+             "start": {"dateTime": iso(start + timedelta(weeks=week))},
+             "end": {"dateTime": iso(start + timedelta(weeks=week, minutes=15))}} for week in range(weeks)]
+
+
+def test_full_sync_is_bounded_and_later_ranges_go_to_the_api(calendar):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    calendar.reset(weekly("standup", now + timedelta(days=1), weeks=104))
+    store = EventStore("test", sync_days=7, sync_ahead_days=28)
+    with calendar_service(None) as service:
+        assert len(store.query(service, iso(now), iso(now + timedelta(days=28)))) == 4
+        assert store.stats()["events"] == 4, "instances after the synced window were stored"
+        requests = calendar.requests
+        later = store.query(service, iso(now + timedelta(days=60)), iso(now + timedelta(days=90)))
+    assert len(later) in (4, 5)
+    assert calendar.requests == requests + 1, "a range past the synced window must be read from the API"
+
+
+def test_store_count_is_capped(monkeypatch):
+    monkeypatch.setattr(event_store, "EVENT_STORE_MAX_STORES", 2)
+    first = get_event_store(None, "first")
+    get_event_store(None, "second")
+    get_event_store(None, "third")
+    assert event_store_stats()["stores"] == 2
+    assert get_event_store(None, "first") is not first
+    assert event_store_stats()["evictions"] >= 2
@@ -0,0 +1,32 @@
+"""Stored history and prompt size must grow linearly with turns."""
+import json
+
+from langchain_core.messages import HumanMessage
+
+import chatbot_with_todo
+from benchmarks.fakes import FakeChatModel
+
+TURNS = 20
+FINAL_RESPONSE = json.dumps({
+    "message": "",
+    "needs_deep_analysis": False,
+    "scheduling_context": {},
+    "response_for_user": "You have no events tomorrow.",
+})
+
+
+def test_history_and_prompt_grow_linearly(monkeypatch):
+    model = FakeChatModel(responses=[FINAL_RESPONSE])
+    monkeypatch.setattr(chatbot_with_todo, "llm", model)
+    graph = chatbot_with_todo.get_workflow()
+    messages, prompt_tokens = [], []
+    for turn in range(1, TURNS + 1):
+        snapshot = chatbot_with_todo.run_chatbot(
+            graph, {"messages": [HumanMessage(f"List tomorrows events ({turn})")]}, None
+        )
+        messages.append(len(snapshot.values["messages"]))
+        prompt_tokens.append(model.prompt_tokens[-1])
+
+    assert messages[-1] <= messages[0] * TURNS
+    increments = [b - a for a, b in zip(prompt_tokens, prompt_tokens[1:])]
+    assert max(increments) <= 1.5 * max(increments[0], 1), f"prompt growth per turn rose to {max(increments)} tokens"
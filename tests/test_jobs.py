@@ -0,0 +1,162 @@
+"""A to-do list turn finishes in the background, reports progress and never creates an event twice."""
+import time
+import uuid
+
+import pytest
+from google.oauth2.credentials import Credentials
+from langchain_core.messages import HumanMessage
+
+import chatbot_with_todo
+import jobs
+from benchmarks.fakes import FakeChatModel, slow
+from benchmarks.turn_latency import TASKS, local_scheduler, todo_list
+from jobs import BACKGROUND_NODES, CREATING, DONE, FAILED, RUNNING, SCHEDULING, JobQueue, runs_in_background, seal_credentials
+
+MESSAGE = f"Todo tomorrow: {', '.join(TASKS)}"
+MODEL_SECONDS = 0.05
+LEASE_SECONDS = 0.3
+
+
+def follow(queue: JobQueue, job_id: str, timeout: float = 30) -> list[str]:
+    """Poll the job until it finishes; the stages it went through."""
+    stages, updated, deadline = [], 0.0, time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.wait(job_id, after=updated, timeout=deadline - time.monotonic())
+        updated = job.updated
+        if not stages or stages[-1] != job.stage:
+            stages.append(job.stage)
+        if job.finished:
+            break
+    return stages
+
+
+def rewind_to_creation(graph, thread_id: str):
+    """Make the thread's latest checkpoint the one after the scheduler, as if the process died creating the events."""
+    config = {"configurable": {"thread_id": thread_id}}
+    planned = next(state for state in graph.get_state_history(config) if state.next == ("calendar",))
+    graph.update_state(planned.config, {"messages": []}, as_node="scheduler")
+
+
+@pytest.fixture
+def calendar_model(monkeypatch) -> FakeChatModel:
+    model = FakeChatModel(responses=[slow(todo_list(with_durations=False), MODEL_SECONDS)])
+    monkeypatch.setattr(chatbot_with_todo, "llm", model)
+    monkeypatch.setattr(chatbot_with_todo, "scheduler_llm", FakeChatModel(
+        responses=[slow(local_scheduler, MODEL_SECONDS)], model_name="fake-scheduler"))
+    return model
+
+
+@pytest.fixture
+def handed_off(calendar, calendar_model):
+    """The chat turn for the to-do list, stopped where it hands over to the scheduler."""
+    graph, thread_id = chatbot_with_todo.get_workflow(), uuid.uuid4().hex
+    stopped = chatbot_with_todo.run_chatbot(graph, {"messages": [HumanMessage(MESSAGE)]}, Credentials(token="test-jobs"),
+                                            thread_id=thread_id, interrupt_before=BACKGROUND_NODES)
+    assert runs_in_background(stopped), f"the to-do list turn was not stopped before the scheduler ({stopped.next})"
+    return graph, thread_id, stopped
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch) -> str:
+    monkeypatch.setattr(jobs, "JOB_RETRY_SECONDS", 0.01)
+    return str(tmp_path / "jobs.sqlite")
+
+
+def fails_once(script, when):
+    """`script`, except that the first call whose messages match `when` raises."""
+    failed = []
+
+    def run(messages):
+        if when(messages) and not failed:
+            failed.append(True)
+            raise RuntimeError("model went away")
+        return script(messages)
+    return run
+
+
+def test_job_finishes_the_turn_and_reports_progress(calendar, handed_off, path):
+    graph, _, stopped = handed_off
+    queue = JobQueue(path).start(graph)
+    started = time.perf_counter()
+    job = queue.submit(stopped, Credentials(token="test-jobs"))
+    assert time.perf_counter() - started < 0.05, "submit() should only queue the job"
+    stages = follow(queue, job.id)
+    job = queue.get(job.id)
+    assert job.status == DONE and job.response, job.error
+    assert SCHEDULING in stages and CREATING in stages
+    assert sum(task["status"] == "created" for task in job.tasks) == len(TASKS)
+    assert len(calendar.events) == len(TASKS)
+
+
+def test_submitting_the_same_turn_again_runs_nothing(handed_off, calendar_model, path):
+    graph, _, stopped = handed_off
+    queue = JobQueue(path).start(graph)
+    job = queue.submit(stopped, Credentials(token="test-jobs"))
+    follow(queue, job.id)
+    calls = calendar_model.calls
+    again = queue.submit(stopped, Credentials(token="test-jobs"))
+    assert again.id == job.id and again.status == DONE
+    assert calendar_model.calls == calls
+
+
+def test_expired_lease_resumes_without_duplicates(calendar, handed_off, path):
+    graph, thread_id, stopped = handed_off
+    creds = Credentials(token="test-jobs")
+    queue = JobQueue(path).start(graph)
+    job = queue.submit(stopped, creds)
+    follow(queue, job.id)
+    job = queue.get(job.id)
+
+    # Another process is still running the job: a process starting up must leave it alone.
+    rewind_to_creation(graph, thread_id)
+    queue._update(job.id, status=RUNNING, owner="another-process", lease_expires=time.time() + 60,
+                  credentials=seal_credentials(creds))
+    restarted = JobQueue(path, lease_seconds=LEASE_SECONDS).start(graph)
+    time.sleep(LEASE_SECONDS * 2)
+    held = restarted.get(job.id)
+    assert held.status == RUNNING and held.attempts == job.attempts, "a job with a live lease was taken over"
+
+    # That process stopped mid-turn; once its lease expires the job resumes where the turn stopped.
+    queue._update(job.id, lease_expires=time.time() - 1)
+    follow(restarted, job.id)
+    job = restarted.get(job.id)
+    assert job.status == DONE and job.attempts == 2, job.error
+    assert sum(task["status"] == "already_created" for task in job.tasks) == len(TASKS)
+    assert len(calendar.events) == len(TASKS)
+
+
+def test_scheduler_error_is_retried(calendar, handed_off, path, monkeypatch):
+    graph, _, stopped = handed_off
+    monkeypatch.setattr(chatbot_with_todo, "scheduler_llm", FakeChatModel(
+        responses=["I can't plan this.", "Still no plan.", local_scheduler], model_name="fake-scheduler"))
+    queue = JobQueue(path).start(graph)
+    job = queue.submit(stopped, Credentials(token="test-jobs"))
+    follow(queue, job.id)
+    job = queue.get(job.id)
+    assert job.status == DONE and job.attempts == 2, job.error
+    assert len(calendar.events) == len(TASKS)
+
+
+def test_missing_calendar_reply_is_retried(calendar, handed_off, path, monkeypatch):
+    graph, _, stopped = handed_off
+    after_schedule = fails_once(todo_list(with_durations=False), lambda messages: messages[-1].name == "create_events")
+    monkeypatch.setattr(chatbot_with_todo, "llm", FakeChatModel(responses=[after_schedule], model_name="fake-flaky"))
+    queue = JobQueue(path).start(graph)
+    job = queue.submit(stopped, Credentials(token="test-jobs"))
+    follow(queue, job.id)
+    job = queue.get(job.id)
+    assert job.status == DONE and job.attempts == 2, job.error
+    assert job.response == f"Scheduled {len(TASKS)} tasks for tomorrow."
+    assert len(calendar.events) == len(TASKS)
+
+
+def test_job_fails_once_its_attempts_are_used_up(calendar, handed_off, path, monkeypatch):
+    graph, _, stopped = handed_off
+    monkeypatch.setattr(chatbot_with_todo, "scheduler_llm", FakeChatModel(responses=["No plan."], model_name="fake-scheduler"))
+    queue = JobQueue(path, max_attempts=2).start(graph)
+    job = queue.submit(stopped, Credentials(token="test-jobs"))
+    follow(queue, job.id)
+    job = queue.get(job.id)
+    assert job.status == FAILED and job.attempts == 2
+    assert job.error == "The scheduling model did not produce a schedule"
+    assert not calendar.events
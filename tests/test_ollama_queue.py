@@ -0,0 +1,90 @@
+"""Preloading avoids cold starts, and the local model's request queue is bounded and prioritised."""
+import threading
+import time
+
+import pytest
+
+from ollama_manager import COLD_START_SECONDS, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, ModelBusy, OllamaModelManager
+from telemetry import metrics
+
+PROMPT = [("human", "Plan my day")]
+
+
+def ask(manager: OllamaModelManager, priority: int = PRIORITY_INTERACTIVE, timeout: float | None = None):
+    with manager.slot(priority, timeout):
+        message = manager.llm.invoke(PROMPT)
+    manager.record_response(message)
+    return message
+
+
+def test_preload_avoids_the_cold_start(fake_ollama):
+    server = fake_ollama(reply="ok", load_seconds=COLD_START_SECONDS + 0.2)
+    manager = OllamaModelManager(base_url=server.url, keep_alive="5m")
+    ask(manager)
+    server.unload()
+    manager.preload()
+    started = time.perf_counter()
+    ask(manager)
+    assert time.perf_counter() - started < COLD_START_SECONDS
+    assert manager.cold_starts == 1
+    assert set(server.keep_alives) == {"5m"}
+    exposed = metrics.render()
+    for name in ("ollama_cold_starts_total", "ollama_load_seconds"):
+        assert name in exposed, f"metric {name} is not exposed"
+
+
+def test_burst_beyond_the_queue_is_refused_at_once(fake_ollama):
+    size, queue_size = 8, 3
+    server = fake_ollama(reply="ok", load_seconds=0.0, generate_seconds=0.1)
+    manager = OllamaModelManager(base_url=server.url, max_concurrent=1, max_queue=queue_size, queue_timeout=10)
+    results, gate = [], threading.Barrier(size)
+
+    def request():
+        gate.wait()
+        started = time.perf_counter()
+        try:
+            ask(manager)
+            results.append(("served", time.perf_counter() - started))
+        except ModelBusy:
+            results.append(("refused", time.perf_counter() - started))
+
+    threads = [threading.Thread(target=request) for _ in range(size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    served = [seconds for outcome, seconds in results if outcome == "served"]
+    refused = [seconds for outcome, seconds in results if outcome == "refused"]
+    assert len(served) == 1 + queue_size
+    assert max(refused, default=0) <= 0.05, "a full queue must refuse at once"
+    assert server.max_in_flight == 1
+
+
+def test_interactive_requests_overtake_background_work(fake_ollama):
+    server = fake_ollama(reply="ok", load_seconds=0.0, generate_seconds=0.2)
+    manager = OllamaModelManager(base_url=server.url, max_concurrent=1, max_queue=4)
+    order = []
+
+    def request(name: str, level: int):
+        ask(manager, level)
+        order.append(name)
+
+    threads = [threading.Thread(target=request, args=("first", PRIORITY_INTERACTIVE)),
+               threading.Thread(target=request, args=("background", PRIORITY_BACKGROUND)),
+               threading.Thread(target=request, args=("interactive", PRIORITY_INTERACTIVE))]
+    for thread, pause in zip(threads, (0.05, 0.02, 0)):
+        thread.start()
+        time.sleep(pause)
+    for thread in threads:
+        thread.join()
+    assert order == ["first", "interactive", "background"]
+    exposed = metrics.render()
+    for name in ("ollama_queue_depth", "ollama_queue_wait_seconds"):
+        assert name in exposed, f"metric {name} is not exposed"
+
+    holder = threading.Thread(target=request, args=("holder", PRIORITY_INTERACTIVE))
+    holder.start()
+    time.sleep(0.05)
+    with pytest.raises(ModelBusy):
+        ask(manager, timeout=0.05)
+    holder.join()
@@ -0,0 +1,85 @@
+"""The days a message names are prefetched while the model runs, and only handed out when still current."""
+import uuid
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+from google.oauth2.credentials import Credentials
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+import chatbot_with_todo
+import prefetch
+from benchmarks.fakes import FakeChatModel
+from benchmarks.turn_latency import at, day_range, envelope, list_events, seeded_event, single_create, update_by_name
+from event_handler import fetch_events
+from event_store import get_event_store
+from telemetry import metrics
+
+DENTIST = [seeded_event("dentist", "Dentist", at(10), at(11))]
+
+
+def morning_only(messages):
+    """Reads only the morning, which the whole-day prefetch doesn't match."""
+    if isinstance(messages[-1], ToolMessage):
+        return envelope("Your morning is free.")
+    return AIMessage(content="", tool_calls=[{"name": "get_events", "id": "call_morning", "args": {
+        "startDateTime": at(6), "endDateTime": at(12)}}])
+
+
+def prefetched(calendar, monkeypatch, script, text: str, events: list[dict]) -> dict:
+    """Run one turn with prefetch on; how many prefetched days were used and wasted."""
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", True)
+    monkeypatch.setattr(chatbot_with_todo, "llm", FakeChatModel(responses=[script]))
+    calendar.reset(events)
+    before = {outcome: metrics.value("prefetch_total", {"outcome": outcome}) for outcome in ("hit", "wasted")}
+    chatbot_with_todo.run_chatbot(chatbot_with_todo.get_workflow(), {"messages": [HumanMessage(text)]},
+                                  Credentials(token="test-prefetch"), thread_id=uuid.uuid4().hex)
+    return {outcome: metrics.value("prefetch_total", {"outcome": outcome}) - before[outcome] for outcome in before}
+
+
+@pytest.mark.parametrize("script, text", [
+    (update_by_name, "Move my dentist appointment tomorrow to 3pm"),
+    (list_events, "What's on my calendar tomorrow?"),
+])
+def test_reading_the_named_day_uses_the_prefetch(calendar, monkeypatch, script, text):
+    assert prefetched(calendar, monkeypatch, script, text, DENTIST) == {"hit": 1, "wasted": 0}
+
+
+def test_unused_prefetch_is_counted_as_wasted(calendar, monkeypatch):
+    counts = prefetched(calendar, monkeypatch, morning_only, "What do I have tomorrow morning?", DENTIST)
+    assert counts == {"hit": 0, "wasted": 1}
+
+
+def test_plain_create_prefetches_nothing(calendar, monkeypatch):
+    counts = prefetched(calendar, monkeypatch, single_create, "Book lunch with Sam tomorrow at noon", [])
+    assert counts == {"hit": 0, "wasted": 0}
+
+
+def test_days_are_the_calendars(fake_calendar, monkeypatch):
+    calendar = fake_calendar(time_zone="Asia/Tokyo")
+    tz = ZoneInfo("Asia/Tokyo")
+    day = datetime.now(tz).date() + timedelta(days=1)
+
+    def tokyo_day(messages):
+        if isinstance(messages[-1], ToolMessage):
+            return envelope("Nothing tomorrow.")
+        return AIMessage(content="", tool_calls=[{"name": "get_events", "id": "call_day", "args": {
+            "startDateTime": datetime.combine(day, time(), tz).isoformat(),
+            "endDateTime": datetime.combine(day, time(23, 59), tz).isoformat()}}])
+
+    # The first turn learns the calendar's time zone; from then on its days are prefetched.
+    prefetched(calendar, monkeypatch, tokyo_day, "What's on my calendar tomorrow?", [])
+    assert prefetched(calendar, monkeypatch, tokyo_day, "Show me tomorrow", []) == {"hit": 1, "wasted": 0}
+
+
+def test_write_during_the_fetch_makes_it_stale(calendar, monkeypatch):
+    def fetch_then_write(creds, start, end):
+        events = fetch_events(creds, start, end)
+        get_event_store(creds).record_delete("dentist")
+        return events
+
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", True)
+    monkeypatch.setattr(prefetch, "fetch_events", fetch_then_write)
+    calendar.reset(DENTIST)
+    days = prefetch.start_prefetch(Credentials(token="test-prefetch"), "What's on my calendar tomorrow?")
+    assert days.take(*day_range().values()) is None
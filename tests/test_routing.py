@@ -0,0 +1,62 @@
+"""The intent router sends each message to the cheapest prompt, toolset and model that serves it."""
+import pytest
+from langchain_core.messages import HumanMessage
+
+import chatbot_with_todo
+from benchmarks.fakes import FakeChatModel
+from intent_router import CHIT_CHAT, FULL, READ, TODO, WRITE, classify, intent_router
+
+LABELLED = {
+    "hi": CHIT_CHAT,
+    "Thanks!": CHIT_CHAT,
+    "good morning": CHIT_CHAT,
+    "what can you do?": CHIT_CHAT,
+    "What's on my calendar tomorrow?": READ,
+    "what is on my schedule today": READ,
+    "Am I free at 3pm on Friday?": READ,
+    "Do I have any meetings next week?": READ,
+    "Book lunch with Sam tomorrow at noon": WRITE,
+    "Move my dentist appointment tomorrow to 3pm": WRITE,
+    "Delete the standup on Friday": WRITE,
+    "Schedule a call with Alex at 4pm today": WRITE,
+    "Todo tomorrow: write report, gym, call mom": TODO,
+    "Plan my day: groceries and laundry": TODO,
+    "- write report\n- email Alex\n- gym": TODO,
+    "tomorrow I need to write the report, go to the gym, call mom": TODO,
+    "Schedule gym, groceries and laundry today": FULL,
+    "Schedule a meeting with Bob, Alice and Carol tomorrow": FULL,
+    "I have a dentist appointment at 3pm tomorrow": FULL,
+    "What do I have to do tomorrow?": READ,
+    "Is there anything I have to do today?": READ,
+    "What do I have Monday, Tuesday, and Wednesday?": READ,
+    "Delete the meeting I need to do prep for": WRITE,
+    "Move lunch, dinner, and gym to Friday": WRITE,
+}
+
+# Replies to a question the assistant asked in a WRITE turn, and the intent each should get.
+FOLLOW_UPS = {
+    "ok go ahead": WRITE,
+    "okay, do it": WRITE,
+    "perfect": WRITE,
+    "thanks, that's all": CHIT_CHAT,
+}
+
+
+@pytest.mark.parametrize("text, expected", LABELLED.items())
+def test_rules_route_safely(text, expected):
+    # Routing to the full agent is always safe, only slower; anything else must be exact.
+    assert (classify(text) or FULL) in (expected, FULL)
+
+
+@pytest.mark.parametrize("text, expected", FOLLOW_UPS.items())
+def test_follow_up_keeps_the_question_intent(text, expected):
+    assert intent_router.route(text, asked=WRITE) == expected
+
+
+def test_chit_chat_uses_the_turn_date(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(chatbot_with_todo, "fast_llm", FakeChatModel(
+        responses=[lambda messages: prompts.append(messages) or "Hi!"]))
+    config = {"configurable": {"today_str": "2030-01-02"}}
+    chatbot_with_todo.chat_agent({"messages": [HumanMessage(content="hello")]}, config)
+    assert "Today's date is 2030-01-02." in [message.content for message in prompts[0]]
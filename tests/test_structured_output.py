@@ -0,0 +1,95 @@
+"""Replies are schema-checked, the route is known early in the stream, and the scheduler is held to its schema."""
+import json
+
+import pytest
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+import chatbot_with_todo
+from envelopes import CalendarReply, Schedule, parse_reply, parse_schedule, strict_json_schema
+from ollama_manager import OllamaModelManager
+
+CHUNK = 8  # characters per streamed token, roughly
+
+
+@pytest.fixture
+def reply() -> str:
+    context = {"date": "2030-01-02", "timezone": "America/Los_Angeles", "working_hours": None,
+               "tasks": [{"summary": f"Task {i}", "duration_minutes": None, "priority": 2, "earliest": None,
+                          "deadline": None} for i in range(10)]}
+    return CalendarReply(needs_deep_analysis=True, message="Please schedule these tasks.",
+                         scheduling_context=context, response_for_user="").model_dump_json()
+
+
+def strict_mode_problems(node, path: str) -> list[str]:
+    """Everything OpenAI's strict mode would reject in a JSON schema."""
+    problems = []
+    if isinstance(node, dict):
+        if "default" in node:
+            problems.append(f"{path} has a default")
+        if node.get("type") == "object" and "properties" in node:
+            if set(node.get("required", [])) != set(node["properties"]):
+                problems.append(f"{path} does not require every property")
+            if node.get("additionalProperties") is not False:
+                problems.append(f"{path} allows additional properties")
+        for key, value in node.items():
+            problems += strict_mode_problems(value, f"{path}.{key}")
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            problems += strict_mode_problems(value, f"{path}[{index}]")
+    return problems
+
+
+@pytest.mark.parametrize("model", [CalendarReply, Schedule])
+def test_schema_is_accepted_by_strict_mode(model):
+    assert strict_mode_problems(strict_json_schema(model), model.__name__) == []
+
+
+def test_route_field_streams_first():
+    assert next(iter(strict_json_schema(CalendarReply)["properties"])) == chatbot_with_todo.ROUTE_FIELD
+
+
+def test_noisy_replies_parse(reply):
+    for text in (reply, f"```json\n{reply}\n```", f"Here is the result: {reply}", reply + "\n}"):
+        assert parse_reply(text) is not None, text
+    for text in ("", "Sorry, I can't help with that.", '{"response_for_user": 1}'):
+        assert parse_reply(text) is None, text
+    assert parse_schedule('<think>hmm {"a": 1}</think>{"tasks": []}') is not None
+
+
+def test_route_is_known_early_in_the_stream(reply):
+    metadata = {"langgraph_checkpoint_ns": "calendar:1", "langgraph_node": "calendar"}
+    routes, received, routed = {}, 0, []
+    for start in range(0, len(reply), CHUNK):
+        chunk = AIMessageChunk(content=reply[start:start + CHUNK], id="reply")
+        received += len(chunk.content)
+        for event in chatbot_with_todo.stream_events("messages", (chunk, metadata), routes):
+            if event["type"] == "route":
+                routed.append((received, event["next"]))
+    assert len(routed) == 1, "the reply must be routed exactly once"
+    assert routed[0][1] == "scheduler"
+    assert routed[0][0] <= 4 * CHUNK
+
+
+def test_schedule_decision_tolerates_stray_text(reply):
+    state = {"messages": [HumanMessage("plan my day"), HumanMessage(reply, name="calendar")]}
+    assert chatbot_with_todo.schedule_decision(state) == "scheduler"
+    state["messages"][-1] = HumanMessage(reply.replace("true", "false", 1) + " trailing junk", name="calendar")
+    assert chatbot_with_todo.schedule_decision(state) == chatbot_with_todo.END
+
+
+def test_scheduler_is_asked_again_with_the_schema_as_format(fake_ollama, monkeypatch):
+    schedule = {"tasks": [{"summary": "Task 0", "start_time": "2030-01-02T09:00:00-08:00",
+                           "end_time": "2030-01-02T09:30:00-08:00"}]}
+
+    def answer(messages):
+        if "out of thinking time" in messages[-1]["content"]:
+            return json.dumps(schedule)
+        return "<think>One task, first thing.</think>Sure! Task 0 fits at 9am, it takes half an hour."
+
+    server = fake_ollama(reply=answer, load_seconds=0.0)
+    monkeypatch.setattr(chatbot_with_todo, "scheduler_llm", OllamaModelManager(base_url=server.url).llm)
+    envelope = CalendarReply(needs_deep_analysis=True, message="Schedule Task 0", response_for_user="")
+    state = {"messages": [HumanMessage("plan my day"), HumanMessage(envelope.model_dump_json(), name="calendar")]}
+    result = chatbot_with_todo.scheduling_agent(state, {"configurable": {}})
+    assert server.formats == [None, chatbot_with_todo.SCHEDULE_SCHEMA]
+    assert parse_schedule(result["messages"][-1].content) is not None
@@ -0,0 +1,23 @@
+"""Synthesised audio is cached by text, and the cache only touches the disk once it has something to store."""
+import os
+
+from text_to_speech import AudioCache, SentenceSplitter
+
+
+def test_cache_directory_is_created_on_first_write(tmp_path):
+    directory = tmp_path / "tts"
+    cache = AudioCache(str(directory), max_bytes=10)
+    key = cache.key("tts-1", "nova", "You have no events tomorrow.")
+    assert cache.get(key) is None and not directory.exists()
+    cache.put(key, b"\0" * 8)
+    assert cache.get(key) == b"\0" * 8
+    cache.put(cache.key("tts-1", "nova", "Done."), b"\0" * 8)
+    assert cache.get(key) is None and len(os.listdir(directory)) == 1
+
+
+def test_sentences_are_cut_as_they_complete():
+    splitter = SentenceSplitter()
+    assert splitter.feed("You have a meeting at 9 a.m. with Sam. ") == ["You have a meeting at 9 a.m. with Sam."]
+    # Too short to be spoken on its own: merged into what follows.
+    assert splitter.feed("Then lunch. ") == []
+    assert splitter.flush() == ["Then lunch."]
@@ -0,0 +1,255 @@
+import hashlib
+import io
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import unicodedata
+import wave
+from collections import OrderedDict
+
+from audio_capture import openai_client
+
+TTS_MODEL = os.getenv("TTS_MODEL", "tts-1")
+TTS_VOICE = os.getenv("TTS_VOICE", "nova")
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".tts_cache")
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "64"))
+# "device": streamed to this machine's speakers as it is synthesised, so speech starts after
+# the first sentence (the app runs where the user is); "browser": for a remote deployment,
+# the whole reply is played in the browser as one clip (st.audio) once it is synthesised.
+TTS_OUTPUT = os.getenv("TTS_OUTPUT", "device")
+# The "pcm" response format: raw 24 kHz 16-bit mono, playable as it arrives.
+TTS_SAMPLE_RATE = 24000
+CHUNK_BYTES = 4800  # 100 ms of audio
+MIN_SENTENCE_CHARS = 20
+logger = logging.getLogger(__name__)
+
+# Sentence-ending punctuation after two non-dot characters, so "a.m." or "e.g." don't split.
+_SENTENCE_END = re.compile(r"(?<=[^\s.]{2}[.!?])[\"')\]]*\s+|\n+")
+_MARKDOWN = re.compile(r"[*_`#>|]+|^\s*[-+]\s+", re.MULTILINE)
+
+
+def speakable(text: str) -> str:
+    """Normalised text to synthesise (and to key the cache on): no markdown, single spaces."""
+    text = unicodedata.normalize("NFC", _MARKDOWN.sub("", text))
+    return " ".join(text.split())
+
+
+class SentenceSplitter:
+    """Cut streamed text into sentences, so each can be synthesised as soon as it is complete."""
+
+    def __init__(self, min_chars: int = MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        self._buffer += text
+        sentences, start = [], 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            # Very short pieces ("Sure.") are merged into the next sentence.
+            if len(self._buffer[start:match.start()].strip()) >= self.min_chars:
+                sentences.append(self._buffer[start:match.start()].strip())
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> list[str]:
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+# ------------------------------------------------------------------------------
+# Content-addressed audio cache
+#
+#    Synthesised audio is stored on disk under sha256(model, voice, normalised
+#    text), so recurring phrases ("You have no events tomorrow.") are synthesised
+#    and billed once. The least recently used files are deleted once the cache
+#    grows past TTS_CACHE_MAX_MB. The directory is created on the first write.
+# ------------------------------------------------------------------------------
+class AudioCache:
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_bytes: int = int(TTS_CACHE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        files = []
+        if os.path.isdir(directory):
+            files = [entry for entry in os.scandir(directory) if entry.name.endswith(".pcm")]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self._sizes[entry.name[:-4]] = entry.stat().st_size
+
+    @staticmethod
+    def key(model: str, voice: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{voice}\0{text}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pcm")
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            if key not in self._sizes:
+                self.misses += 1
+                return None
+            self._sizes.move_to_end(key)
+            self.hits += 1
+        try:
+            with open(self._path(key), "rb") as file:
+                audio = file.read()
+            os.utime(self._path(key))
+            return audio
+        except FileNotFoundError:
+            with self._lock:
+                self._sizes.pop(key, None)
+            return None
+
+    def put(self, key: str, audio: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(audio)
+        os.replace(temporary, self._path(key))
+        with self._lock:
+            self._sizes[key] = len(audio)
+            self._sizes.move_to_end(key)
+            while sum(self._sizes.values()) > self.max_bytes and len(self._sizes) > 1:
+                evicted, _ = self._sizes.popitem(last=False)
+                try:
+                    os.remove(self._path(evicted))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "files": len(self._sizes), "bytes": sum(self._sizes.values())}
+
+
+audio_cache = AudioCache()
+
+
+# ------------------------------------------------------------------------------
+# Streaming speech output
+#
+#    Text is fed in as the reply streams, and each complete sentence is
+#    synthesised (or read from the cache) on a background thread while the rest
+#    of the reply is still streaming. With the default device output it is played
+#    on this machine's speakers chunk by chunk as it downloads, so speech starts
+#    after the first sentence. With TTS_OUTPUT=browser the audio is collected and
+#    wav() returns the whole reply for st.audio once the reply ends: a page can't
+#    queue clips one after another, so a browser only hears the reply once all
+#    of it is synthesised.
+# ------------------------------------------------------------------------------
+class Speaker:
+    def __init__(self, voice: str = TTS_VOICE, model: str = TTS_MODEL, cache: AudioCache = audio_cache,
+                 output: str = TTS_OUTPUT):
+        self.voice = voice
+        self.model = model
+        self.cache = cache
+        self.output = output
+        self._audio = bytearray()
+        self._splitter = SentenceSplitter()
+        self._sentences: queue.Queue[str | None] = queue.Queue()
+        self._chunks: queue.Queue[bytes | None] = queue.Queue()
+        self._stopped = threading.Event()
+        self.started = time.monotonic()
+        self.first_audio_at: float | None = None
+        self._threads = [
+            threading.Thread(target=self._synthesise_all, daemon=True),
+            threading.Thread(target=self._play_all if output == "device" else self._collect_all, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def feed(self, text: str):
+        for sentence in self._splitter.feed(text):
+            self._sentences.put(sentence)
+
+    def close(self):
+        """No more text; the rest of the buffered text is spoken as the last sentence."""
+        for sentence in self._splitter.flush():
+            self._sentences.put(sentence)
+        self._sentences.put(None)
+
+    def stop(self):
+        """Cut playback short, e.g. when a new reply starts."""
+        self._stopped.set()
+        self._sentences.put(None)
+
+    def wait(self, timeout: float | None = None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wav(self, timeout: float | None = None) -> bytes:
+        """The reply's audio as a WAV file, once synthesis has finished (browser output)."""
+        self.wait(timeout)
+        audio = bytes(self._audio[:len(self._audio) - len(self._audio) % 2])
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(TTS_SAMPLE_RATE)
+            file.writeframes(audio)
+        return buffer.getvalue()
+
+    def _stream(self, text: str):
+        key = self.cache.key(self.model, self.voice, text)
+        audio = self.cache.get(key)
+        if audio is not None:
+            yield audio
+            return
+        received = []
+        with openai_client().audio.speech.with_streaming_response.create(
+            model=self.model, voice=self.voice, input=text, response_format="pcm"
+        ) as response:
+            for chunk in response.iter_bytes(CHUNK_BYTES):
+                if self._stopped.is_set():
+                    return
+                received.append(chunk)
+                yield chunk
+        self.cache.put(key, b"".join(received))
+
+    def _synthesise_all(self):
+        try:
+            while not self._stopped.is_set():
+                sentence = self._sentences.get()
+                if sentence is None:
+                    break
+                text = speakable(sentence)
+                if text:
+                    for chunk in self._stream(text):
+                        self._chunks.put(chunk)
+        except Exception as e:
+            logger.exception("Speech synthesis failed: %s", e)
+        finally:
+            self._chunks.put(None)
+
+    def _next_chunk(self) -> bytes | None:
+        chunk = None if self._stopped.is_set() else self._chunks.get()
+        if chunk is not None and self.first_audio_at is None:
+            self.first_audio_at = time.monotonic()
+            logger.info("Speech ready after %.2fs", self.first_audio_at - self.started)
+        return chunk
+
+    def _collect_all(self):
+        while (chunk := self._next_chunk()) is not None:
+            self._audio += chunk
+
+    def _play_all(self):
+        try:
+            import sounddevice as sd
+
+            with sd.RawOutputStream(samplerate=TTS_SAMPLE_RATE, channels=1, dtype="int16") as stream:
+                pending = b""
+                while (chunk := self._next_chunk()) is not None:
+                    # Only whole 16-bit samples can be written.
+                    pending += chunk
+                    whole = len(pending) - len(pending) % 2
+                    stream.write(pending[:whole])
+                    pending = pending[whole:]
+        except Exception as e:
+            # E.g. a headless host without an output device.
+            logger.error("Cannot play speech on this machine (TTS_OUTPUT=device): %s", e)
+            self._stopped.set()